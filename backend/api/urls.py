@@ -22,6 +22,7 @@ from shopapp.views import (
     TagsListAPIView,
     SalesListAPIView,
     BasketAPIView,
+    BasketBatchAPIView,
 
     CreateOrderAPIView,
     OrderDetailAPIView,
@@ -50,6 +51,7 @@ urlpatterns = [
     path('product/<int:id>', ProductDetailsAPIView.as_view()),
     path('product/<int:id>/reviews', ProductReviewAPIView.as_view()),
     path('basket', BasketAPIView.as_view()),
+    path('basket/batch', BasketBatchAPIView.as_view()),
 
     path('orders', CreateOrderAPIView.as_view()),
     path('order/<int:order_id>', OrderDetailAPIView.as_view()),
@@ -14,3 +14,9 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 
 application = get_asgi_application()
+
+# потоки хэширования паролей запускаются вместе с сервером, а не на первом входе;
+# представления входа синхронные и ждут результата хэширования в потоке запроса
+from myauth.hashing import warm_up  # noqa: E402
+
+warm_up()
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -90,9 +91,44 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # ожидание блокировки при одновременной записи из нескольких потоков
+            'timeout': 20,
+        },
+        'TEST': {
+            # тестовая база в файле, а не в памяти: тесты конкурентного
+            # доступа обращаются к ней из нескольких потоков
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
+    }
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# Кэш используется для версионированных данных магазина (shopapp.cache).
+# Номера версий должны быть общими для всех процессов (веб-сервер,
+# run_payment_worker, update_popularity и другие команды), поэтому кэш
+# хранится в файлах каталога CACHE_ROOT, а не в памяти процесса.
+# Если процессы работают на нескольких серверах, CACHE_ROOT должен
+# быть общим каталогом, либо следует указать Redis или Memcached.
+
+CACHE_ROOT = Path(os.environ.get("SHOP_CACHE_ROOT", BASE_DIR / "cache"))
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': CACHE_ROOT / 'default',
+        'OPTIONS': {
+            # по записи на каждый продукт, профиль и т.д.
+            'MAX_ENTRIES': 10000,
+        },
     }
 }
 
+# тесты используют отдельный временный каталог кэша
+TEST_RUNNER = 'backend.test_runner.TestRunner'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -113,6 +149,28 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# Пароли хэшируются в ограниченном пуле потоков (см. myauth.hashing):
+# не больше PASSWORD_HASHING_WORKERS хэширований одновременно (None - по числу
+# ядер) и PASSWORD_HASHING_QUEUE_LIMIT ожидающих, остальные запросы сразу
+# получают 503. Поток запроса при этом ждёт результата хэширования
+PASSWORD_HASHING_WORKERS = None
+PASSWORD_HASHING_QUEUE_LIMIT = 32
+# число итераций PBKDF2; при изменении пароли перехэшируются при входе
+PASSWORD_PBKDF2_ITERATIONS = 600000
+
+PASSWORD_HASHERS = [
+    'myauth.hashing.TunablePBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+
+AUTHENTICATION_BACKENDS = [
+    'myauth.hashing.PasswordHashingBackend',
+]
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/4.2/topics/i18n/
 
@@ -134,6 +192,16 @@ STATIC_ROOT = BASE_DIR / "static"
 MEDIA_URL = "/media/"
 MEDIA_ROOT = BASE_DIR / "media"
 
+# медиафайлы хранятся под именами из хэша содержимого (см. shopapp.storage)
+STORAGES = {
+    "default": {
+        "BACKEND": "shopapp.storage.ContentAddressedStorage",
+    },
+    "staticfiles": {
+        "BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage",
+    },
+}
+
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
@@ -156,3 +224,32 @@ SPECTACULAR_SETTINGS = {
 }
 
 
+
+# проверка количества SQL-запросов в "горячих" представлениях
+# (см. shopapp.querybudget), включается в тестах и на staging
+QUERY_BUDGET_ENABLED = False
+
+# популярность товаров считается по продажам за последние POPULARITY_WINDOW_DAYS
+# дней, вес продажи уменьшается вдвое каждые POPULARITY_HALF_LIFE_DAYS дней
+# (None - без затухания), см. команду update_popularity
+POPULARITY_WINDOW_DAYS = 30
+POPULARITY_HALF_LIFE_DAYS = 7
+
+# сколько секунд товары оформленного, но не оплаченного заказа остаются
+# зарезервированными, см. команду release_expired_reservations
+STOCK_RESERVATION_TTL = 15 * 60
+
+# очередь оплаты заказов (см. shopapp.payments и команду run_payment_worker):
+# через сколько секунд задание зависшего обработчика выдаётся снова
+# и сколько раз повторяется задание, завершившееся ошибкой
+PAYMENT_JOB_TIMEOUT = 60
+PAYMENT_JOB_MAX_ATTEMPTS = 3
+
+# сколько секунд хранится ответ на запрос с заголовком Idempotency-Key
+# (см. shopapp.idempotency). Ключи хранятся в базе данных, просроченные
+# удаляет команда delete_expired_idempotency_keys - её нужно запускать
+# периодически, например раз в час
+IDEMPOTENCY_KEY_TTL = 24 * 60 * 60
+
+# наибольший размер загружаемого файла аватара в байтах (см. myauth.avatars)
+AVATAR_MAX_UPLOAD_SIZE = 10 * 1024 * 1024
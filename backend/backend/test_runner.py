@@ -0,0 +1,38 @@
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class TestRunner(DiscoverRunner):
+    """
+    Запускает тесты с пустым кэшем во временном каталоге, чтобы они
+    не видели данные, закэшированные разработческим сервером или
+    предыдущим запуском тестов. Каталог передаётся и в дочерние
+    процессы через переменную окружения SHOP_CACHE_ROOT
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.cache_root = Path(tempfile.mkdtemp(prefix="shop-cache-"))
+        self.previous_cache_root = os.environ.get("SHOP_CACHE_ROOT")
+        os.environ["SHOP_CACHE_ROOT"] = str(self.cache_root)
+        caches = {
+            alias: {**config, "LOCATION": self.cache_root / Path(config["LOCATION"]).name}
+            for alias, config in settings.CACHES.items()
+        }
+        self.cache_override = override_settings(CACHE_ROOT=self.cache_root, CACHES=caches)
+        self.cache_override.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.cache_override.disable()
+        if self.previous_cache_root is None:
+            os.environ.pop("SHOP_CACHE_ROOT", None)
+        else:
+            os.environ["SHOP_CACHE_ROOT"] = self.previous_cache_root
+        shutil.rmtree(self.cache_root, ignore_errors=True)
+        super().teardown_test_environment(**kwargs)
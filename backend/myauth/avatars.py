@@ -0,0 +1,124 @@
+"""
+Обработка аватаров пользователей.
+
+Загруженный файл записывается во временный файл по частям (без чтения
+целиком в память), проверяется Pillow и превращается в квадратные
+варианты фиксированных размеров AVATAR_SIZES в форматах WebP и JPEG.
+Исходный файл не сохраняется. Варианты хранятся под именами из хэша
+содержимого (см. shopapp.storage), поэтому новый аватар никогда
+не совпадает по адресу со старым и может кэшироваться сколько угодно.
+
+Файлы прежнего аватара удаляются в фоновом потоке (см. shopapp.images)
+после фиксации транзакции, не задерживая ответ, если их не использует
+кто-то ещё.
+"""
+import io
+import tempfile
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from shopapp.images import delete_files_later, to_rgb
+from .models import DEFAULT_AVATAR, avatar_image_directory_path
+
+# сторона квадратного варианта в пикселях
+AVATAR_SIZES = {
+    "small": 64,
+    "medium": 256,
+}
+AVATAR_FORMATS = {
+    "webp": {"format": "WEBP", "quality": 80, "method": 4},
+    "jpeg": {"format": "JPEG", "quality": 85, "optimize": True, "progressive": True},
+}
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+
+class InvalidAvatar(Exception):
+    """Исключение, возникающее, когда загруженный файл не подходит для аватара"""
+
+
+def _open_image(upload):
+    """Копирует загрузку во временный файл по частям и открывает её в Pillow"""
+    if upload.size > settings.AVATAR_MAX_UPLOAD_SIZE:
+        raise InvalidAvatar("Слишком большой файл")
+    temporary = tempfile.TemporaryFile()
+    for chunk in upload.chunks(UPLOAD_CHUNK_SIZE):
+        temporary.write(chunk)
+    temporary.seek(0)
+    try:
+        image = Image.open(temporary)
+        # JPEG декодируется сразу в уменьшенном виде, это в разы быстрее
+        largest = max(AVATAR_SIZES.values())
+        image.draft("RGB", (largest * 2, largest * 2))
+        image = ImageOps.exif_transpose(image)
+        image.load()
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError, SyntaxError):
+        raise InvalidAvatar("Файл не является изображением")
+    finally:
+        temporary.close()
+    return image
+
+
+def _encode(image, image_format):
+    options = dict(AVATAR_FORMATS[image_format])
+    if options["format"] == "JPEG" and image.mode != "RGB":
+        background = Image.new("RGB", image.size, "white")
+        background.paste(image, mask=image.getchannel("A") if "A" in image.getbands() else None)
+        image = background
+    output = io.BytesIO()
+    image.save(output, **options)
+    return output.getvalue()
+
+
+def render_variants(upload):
+    """
+    Варианты аватара: {размер: {формат: содержимое файла}}.
+    Выбрасывает InvalidAvatar, если файл не удаётся прочитать как изображение
+    """
+    image = to_rgb(_open_image(upload))
+    variants = {}
+    for size_name, size in AVATAR_SIZES.items():
+        square = ImageOps.fit(image, (size, size), Image.LANCZOS)
+        variants[size_name] = {
+            image_format: _encode(square, image_format) for image_format in AVATAR_FORMATS
+        }
+    return variants
+
+
+def get_avatar_files(profile):
+    """Имена всех файлов текущего аватара пользователя"""
+    names = {
+        name for formats in profile.avatar_variants.values() for name in formats.values()
+    }
+    if profile.avatar:
+        names.add(profile.avatar.name)
+    names.discard(DEFAULT_AVATAR)
+    return names
+
+
+def set_avatar(profile, upload):
+    """
+    Сохраняет новый аватар пользователя из загруженного файла,
+    файлы прежнего аватара удаляются в фоне
+    """
+    variants = render_variants(upload)
+    storage = profile.avatar.storage
+    old_names = get_avatar_files(profile)
+    saved = {}
+    try:
+        for size_name, formats in variants.items():
+            for image_format, content in formats.items():
+                name = avatar_image_directory_path(profile, f"{size_name}.{image_format}")
+                saved.setdefault(size_name, {})[image_format] = storage.save(name, ContentFile(content))
+        with transaction.atomic():
+            profile.avatar_variants = saved
+            # в самом поле - самый крупный вариант JPEG, понятный любому клиенту
+            largest = max(AVATAR_SIZES, key=AVATAR_SIZES.get)
+            profile.avatar.name = saved[largest]["jpeg"]
+            profile.save(update_fields=["avatar", "avatar_variants"])
+            transaction.on_commit(lambda: delete_files_later(storage, old_names))
+    except Exception:
+        delete_files_later(storage, {name for formats in saved.values() for name in formats.values()})
+        raise
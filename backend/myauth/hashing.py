@@ -0,0 +1,137 @@
+"""
+Хэширование паролей в ограниченном пуле потоков.
+
+Хэширование PBKDF2 занимает сотни миллисекунд процессорного времени.
+Все операции с паролями (вход, регистрация, смена пароля) выполняются
+в общем пуле из settings.PASSWORD_HASHING_WORKERS потоков (hashlib
+отпускает GIL, поэтому потоки работают параллельно на всех ядрах).
+
+Пул ограничивает число одновременных хэширований и отсекает лишнюю
+нагрузку, но не освобождает поток запроса: представления синхронные,
+и поток запроса ждёт результата (время в очереди плюс само хэширование).
+Так всплеск входов не отнимает процессор у остальных запросов сверх
+PASSWORD_HASHING_WORKERS ядер, а если пул занят и в очереди уже
+PASSWORD_HASHING_QUEUE_LIMIT операций, новая операция сразу отклоняется
+исключением HashingOverloaded (ответ 503) вместо долгого ожидания.
+
+Число итераций PBKDF2 задаётся настройкой PASSWORD_PBKDF2_ITERATIONS.
+При входе пароль, захэшированный с другими параметрами, хэшируется
+заново (в пуле) и сохраняется в потоке запроса.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import get_user_model, hashers
+from django.contrib.auth.backends import ModelBackend
+
+
+class HashingOverloaded(Exception):
+    """Исключение, возникающее, когда очередь операций с паролями переполнена"""
+
+
+class TunablePBKDF2PasswordHasher(hashers.PBKDF2PasswordHasher):
+    """
+    PBKDF2-SHA256 с числом итераций из настроек. Алгоритм совпадает
+    со стандартным, поэтому существующие пароли проверяются этим же
+    классом и перехэшируются при изменении числа итераций
+    """
+
+    @property
+    def iterations(self):
+        return settings.PASSWORD_PBKDF2_ITERATIONS
+
+
+_executor = None
+_slots = None
+_lock = threading.Lock()
+
+
+def get_pool_size():
+    return settings.PASSWORD_HASHING_WORKERS or os.cpu_count() or 1
+
+
+def _get_pool():
+    global _executor, _slots
+    with _lock:
+        if _executor is None:
+            workers = get_pool_size()
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hashing")
+            _slots = threading.BoundedSemaphore(workers + settings.PASSWORD_HASHING_QUEUE_LIMIT)
+        return _executor, _slots
+
+
+def warm_up():
+    """Запускает потоки пула и загружает хэшеры заранее, до первых запросов"""
+    executor, slots = _get_pool()
+    hashers.get_hashers()
+    for future in [executor.submit(hashers.get_hasher) for _ in range(get_pool_size())]:
+        future.result()
+
+
+def shutdown():
+    """Останавливает пул; следующая операция создаст его заново с текущими настройками"""
+    global _executor, _slots
+    with _lock:
+        if _executor is not None:
+            _executor.shutdown()
+        _executor = _slots = None
+
+
+def run_in_pool(func, *args):
+    """
+    Выполняет func в пуле, поток вызывающего ждёт результата.
+    Если свободных мест в пуле и очереди нет, выбрасывает HashingOverloaded
+    """
+    executor, slots = _get_pool()
+    if not slots.acquire(blocking=False):
+        raise HashingOverloaded()
+    try:
+        return executor.submit(func, *args).result()
+    finally:
+        slots.release()
+
+
+def hash_password(password):
+    """Хэш пароля по текущей политике хэширования"""
+    return run_in_pool(hashers.make_password, password)
+
+
+def _check_password(password, encoded):
+    needs_update = []
+    correct = hashers.check_password(password, encoded, setter=needs_update.append)
+    return correct, hashers.make_password(password) if needs_update else None
+
+
+def verify_password(user, password):
+    """
+    Проверяет пароль пользователя. Хэш, устаревший по политике
+    хэширования, заменяется новым
+    """
+    correct, new_password = run_in_pool(_check_password, password, user.password)
+    if new_password is not None:
+        user.password = new_password
+        user.save(update_fields=["password"])
+    return correct
+
+
+class PasswordHashingBackend(ModelBackend):
+    """ModelBackend, проверяющий пароль в пуле хэширования"""
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        UserModel = get_user_model()
+        if username is None:
+            username = kwargs.get(UserModel.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+        try:
+            user = UserModel._default_manager.get_by_natural_key(username)
+        except UserModel.DoesNotExist:
+            # хэшируем пароль и для несуществующего пользователя, чтобы
+            # по времени ответа нельзя было узнать, есть ли такой пользователь
+            hash_password(password)
+            return None
+        if verify_password(user, password) and self.user_can_authenticate(user):
+            return user
+        return None
@@ -0,0 +1,76 @@
+import os
+import threading
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from myauth import hashing
+
+
+class Command(BaseCommand):
+    help = (
+        "Измеряет пропускную способность проверки паролей при входе: "
+        "несколько потоков одновременно проверяют пароль через пул хэширования, "
+        "результат - входов в секунду всего и на одно ядро процессора"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--clients", type=int, default=32, help="одновременных клиентов")
+        parser.add_argument("--signins", type=int, default=200, help="всего входов")
+        parser.add_argument("--iterations", type=int, default=None, help="итераций PBKDF2")
+        parser.add_argument("--workers", type=int, default=None, help="потоков в пуле хэширования")
+
+    def handle(self, *args, **options):
+        overrides = {"PASSWORD_HASHING_QUEUE_LIMIT": options["clients"]}
+        if options["iterations"]:
+            overrides["PASSWORD_PBKDF2_ITERATIONS"] = options["iterations"]
+        if options["workers"]:
+            overrides["PASSWORD_HASHING_WORKERS"] = options["workers"]
+        with override_settings(**overrides):
+            hashing.shutdown()
+            try:
+                self.run(options)
+            finally:
+                hashing.shutdown()
+
+    def run(self, options):
+        password = "benchmark-password"
+        # пользователь не сохраняется: измеряется только работа с паролем
+        user = User(username="benchmark", password=hashing.hash_password(password))
+        hashing.warm_up()
+        remaining = [options["signins"]]
+        counters = {"ok": 0, "overloaded": 0}
+        lock = threading.Lock()
+
+        def client():
+            while True:
+                with lock:
+                    if remaining[0] <= 0:
+                        return
+                    remaining[0] -= 1
+                try:
+                    hashing.verify_password(user, password)
+                    result = "ok"
+                except hashing.HashingOverloaded:
+                    result = "overloaded"
+                with lock:
+                    counters[result] += 1
+
+        clients = [threading.Thread(target=client) for _ in range(options["clients"])]
+        started = time.perf_counter()
+        for thread in clients:
+            thread.start()
+        for thread in clients:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        cores = os.cpu_count() or 1
+        rate = counters["ok"] / elapsed
+        self.stdout.write(
+            f"Потоков хэширования: {hashing.get_pool_size()}, ядер: {cores}, "
+            f"итераций PBKDF2: {hashing.TunablePBKDF2PasswordHasher().iterations}"
+        )
+        self.stdout.write(f"Входов: {counters['ok']}, отклонено (503): {counters['overloaded']}, время: {elapsed:.2f} с")
+        self.stdout.write(self.style.SUCCESS(f"{rate:.1f} входов/с, {rate / cores:.1f} входов/с на ядро"))
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.5 on 2026-10-18 09:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myauth', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profileuser',
+            name='avatar_variants',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
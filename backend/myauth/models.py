@@ -2,8 +2,13 @@ from django.db import models
 from django.contrib.auth.models import User
 
 
+# аватар, который получает каждый новый пользователь
+DEFAULT_AVATAR = "avatar_default.png"
+
+
+# имя файла заменяется хэшем содержимого (см. shopapp.storage)
 def avatar_image_directory_path(instance: "ProfileUser", filename: str):
-    return f"profile/profile_{instance.pk}/avatar/{filename}"
+    return f"profile/avatar/{filename}"
 
 
 class ProfileUser(models.Model):
@@ -18,10 +23,17 @@ class ProfileUser(models.Model):
         blank=True,
         upload_to=avatar_image_directory_path
     )
+    # уменьшенные копии аватара: {размер: {формат: имя файла}} (см. myauth.avatars)
+    avatar_variants = models.JSONField(default=dict, blank=True)
 
-    def get_avatar(self):
+    def get_avatar(self, size="medium", image_format="webp"):
+        """
+        Адрес аватара нужного размера и формата. Аватар,
+        загруженный до появления вариантов, отдаётся как есть
+        """
+        name = self.avatar_variants.get(size, {}).get(image_format, self.avatar.name)
         avatar = {
-            "src": self.avatar.url,
+            "src": self.avatar.storage.url(name),
             "alt": self.avatar.name,
         }
         return avatar
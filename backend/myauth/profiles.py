@@ -0,0 +1,42 @@
+"""
+Кэширование профиля пользователя.
+
+Профиль читается почти на каждой странице, а меняется редко, поэтому
+готовое представление профиля хранится в общем кэше под версией
+пространства имён пользователя (см. shopapp.cache). Изменение профиля
+или пользователя - в API, при смене аватара или в админке - увеличивает
+версию через сигналы (см. myauth.signals). Версия входит в ETag,
+так что клиент с актуальным профилем получает ответ 304.
+"""
+from shopapp import cache
+
+from .models import ProfileUser
+from .serializers import ProfileSerializer
+
+
+def profile_namespace(user_id):
+    """Пространство имён данных профиля пользователя"""
+    return f"profile:{user_id}"
+
+
+def build_profile(user_id):
+    profile = ProfileUser.objects.select_related('user').get(user_id=user_id)
+    return ProfileSerializer(profile).data
+
+
+def load_profile(user_id):
+    """Возвращает пару (версия, представление профиля) из кэша"""
+    return cache.get_or_build(
+        profile_namespace(user_id), lambda: build_profile(user_id), local=False
+    )
+
+
+def invalidate_profile(user_id):
+    cache.bump_version(profile_namespace(user_id))
+
+
+def profile_etag(request):
+    if not request.user.is_authenticated:
+        return None
+    version = cache.get_version(profile_namespace(request.user.pk))
+    return f'"profile-{request.user.pk}-{version}"'
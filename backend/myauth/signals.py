@@ -0,0 +1,20 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import ProfileUser
+from .profiles import invalidate_profile
+
+
+@receiver([post_save, post_delete], sender=ProfileUser)
+def invalidate_profile_on_change(sender, instance, **kwargs):
+    invalidate_profile(instance.user_id)
+
+
+@receiver(post_save, sender=User)
+def invalidate_profile_on_user_change(sender, instance, update_fields=None, **kwargs):
+    # из пользователя в профиле показывается только email; сохранение
+    # отдельных полей при входе (last_login, password) профиль не меняет
+    if update_fields is not None and "email" not in update_fields:
+        return
+    invalidate_profile(instance.pk)
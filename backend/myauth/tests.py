@@ -1,3 +1,168 @@
-from django.test import TestCase
+import io
+import json
+import shutil
+import tempfile
+import threading
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, TransactionTestCase, override_settings
+from PIL import Image
+
+from shopapp import images
+
+from . import avatars, hashing
+from .models import ProfileUser
+
+
+@override_settings(PASSWORD_PBKDF2_ITERATIONS=1000)
+class SignInAPIViewTestCase(TestCase):
+    def setUp(self):
+        hashing.shutdown()
+        self.user = User.objects.create(username="buyer", password=hashing.hash_password("password"))
+
+    def tearDown(self):
+        hashing.shutdown()
+
+    def sign_in(self, password="password"):
+        return self.client.post(
+            "/api/sign-in", json.dumps({"username": "buyer", "password": password}), content_type="application/json"
+        )
+
+    def test_sign_in(self):
+        self.assertEqual(self.sign_in("wrong").status_code, 500)
+        self.assertEqual(self.sign_in().status_code, 200)
+        self.assertEqual(int(self.client.session["_auth_user_id"]), self.user.pk)
+
+    def test_password_is_rehashed_on_sign_in(self):
+        with self.settings(PASSWORD_PBKDF2_ITERATIONS=2000):
+            self.assertEqual(self.sign_in().status_code, 200)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith("pbkdf2_sha256$2000$"))
+        self.assertTrue(self.user.check_password("password"))
+
+    @override_settings(PASSWORD_HASHING_WORKERS=1, PASSWORD_HASHING_QUEUE_LIMIT=0)
+    def test_overloaded_pool(self):
+        hashing.shutdown()
+        started, release = threading.Event(), threading.Event()
+
+        def busy():
+            started.set()
+            release.wait()
+
+        worker = threading.Thread(target=hashing.run_in_pool, args=(busy,))
+        worker.start()
+        started.wait()
+        try:
+            response = self.sign_in()
+        finally:
+            release.set()
+            worker.join()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response["Retry-After"], "1")
+        self.assertEqual(self.sign_in().status_code, 200)
+
+
+class ProfileUserAPIViewTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username="buyer", email="buyer@example.com")
+        self.profile = ProfileUser.objects.create(
+            user=self.user, name="Иван", surname="Иванов", patronymic="Иванович", avatar="avatar_default.png"
+        )
+        self.client.force_login(self.user)
+
+    def test_unchanged_profile_is_not_read_again(self):
+        response = self.client.get("/api/profile")
+        self.assertEqual(response.json()["fullName"], "Иванов Иван Иванович")
+        self.assertEqual(response.json()["email"], "buyer@example.com")
+        # сессия и пользователь, профиль из кэша
+        with self.assertNumQueries(2):
+            self.assertEqual(self.client.get("/api/profile").json(), response.json())
+        with self.assertNumQueries(2):
+            cached = self.client.get("/api/profile", HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(cached.status_code, 304)
+
+    def test_changed_profile_is_read_again(self):
+        etag = self.client.get("/api/profile")["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post("/api/profile", {"fullName": "Петров Пётр Петрович", "phone": "123"})
+        response = self.client.get("/api/profile", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["fullName"], "Петров Пётр Петрович")
+
+        self.user.email = "new@example.com"
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        self.assertEqual(self.client.get("/api/profile").json()["email"], "new@example.com")
+
+
+def make_image_file(name="avatar.jpg", size=(1200, 800), image_format="JPEG", mode="RGB", color="red"):
+    content = io.BytesIO()
+    Image.new(mode, size, color).save(content, image_format)
+    return SimpleUploadedFile(name, content.getvalue())
+
+
+# файлы удаляются в отдельном потоке после проверки ссылок на них в базе данных,
+# поэтому изменения должны быть зафиксированы
+class AvatarChangeAPIViewTestCase(TransactionTestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        self.user = User.objects.create(username="buyer")
+        self.profile = ProfileUser.objects.create(user=self.user, avatar="avatar_default.png")
+        self.client.force_login(self.user)
+
+    def upload(self, upload, profile=None):
+        profile = profile or self.profile
+        self.client.force_login(profile.user)
+        response = self.client.post("/api/profile/avatar", {"avatar": upload})
+        # дожидаемся фонового удаления старых файлов
+        images.wait()
+        profile.refresh_from_db()
+        return response
+
+    def test_variants(self):
+        self.assertEqual(self.upload(make_image_file()).status_code, 200)
+        for size_name, size in avatars.AVATAR_SIZES.items():
+            for image_format in avatars.AVATAR_FORMATS:
+                with default_storage.open(self.profile.avatar_variants[size_name][image_format]) as file:
+                    with Image.open(file) as image:
+                        self.assertEqual(image.size, (size, size))
+                        self.assertEqual(image.format, avatars.AVATAR_FORMATS[image_format]["format"])
+        self.assertEqual(self.profile.avatar.name, self.profile.avatar_variants["medium"]["jpeg"])
+        self.assertEqual(
+            self.profile.get_avatar()["src"], default_storage.url(self.profile.avatar_variants["medium"]["webp"])
+        )
+        self.assertTrue(self.profile.get_avatar("small", "jpeg")["src"].endswith(".jpeg"))
+        self.assertEqual(self.client.get("/api/profile").json()["avatar"], self.profile.get_avatar())
+
+    def test_old_files_are_deleted(self):
+        self.upload(make_image_file("avatar.png", image_format="PNG", mode="RGBA"))
+        old_names = avatars.get_avatar_files(self.profile)
+        self.assertEqual(len(old_names), 4)
+        self.upload(make_image_file(color="green"))
+        new_names = avatars.get_avatar_files(self.profile)
+        self.assertTrue(all(default_storage.exists(name) for name in new_names))
+        self.assertFalse(any(default_storage.exists(name) for name in old_names))
+
+    def test_shared_files_are_kept(self):
+        other = ProfileUser.objects.create(user=User.objects.create(username="other"), avatar="avatar_default.png")
+        self.upload(make_image_file())
+        self.upload(make_image_file(), profile=other)
+        # одинаковые картинки хранятся одним набором файлов
+        self.assertEqual(other.avatar_variants, self.profile.avatar_variants)
+        shared = avatars.get_avatar_files(other)
+        self.upload(make_image_file(color="green"))
+        self.assertTrue(all(default_storage.exists(name) for name in shared))
+
+    def test_invalid_file(self):
+        response = self.upload(SimpleUploadedFile("avatar.jpg", b"not an image"))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.profile.avatar.name, "avatar_default.png")
+        self.assertEqual(self.profile.get_avatar()["src"], "/media/avatar_default.png")
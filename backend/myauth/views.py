@@ -1,17 +1,25 @@
 import json
-import os
 
-from django.conf import settings
-from django.contrib.auth import logout, login, authenticate, hashers
+from django.contrib.auth import logout, login, authenticate
 from django.contrib.auth.models import User
 from django.http.response import HttpResponse, JsonResponse
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
+from rest_framework.exceptions import NotAuthenticated
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from .models import ProfileUser
-from .serializers import ProfileSerializer
-from .forms import ProfileForm
+from shopapp.basket import merge_guest_basket
+from .avatars import InvalidAvatar, set_avatar
+from .hashing import HashingOverloaded, hash_password, verify_password
+from .models import DEFAULT_AVATAR, ProfileUser
+from .profiles import load_profile, profile_etag
+
+
+def overloaded_response():
+    """Ответ, когда пул хэширования паролей переполнен"""
+    return Response({"error": "Сервер перегружен, повторите попытку"}, status=503, headers={"Retry-After": "1"})
 
 
 class SignOutAPIView(APIView):
@@ -31,10 +39,16 @@ class SignInAPIView(APIView):
         data = json.loads(request.body)
         username = data['username']
         password = data['password']
-        user = authenticate(request, username=username, password=password)
+        try:
+            user = authenticate(request, username=username, password=password)
+        except HashingOverloaded:
+            return overloaded_response()
         if user is not None:
             login(request, user)
-            return Response(status=200)
+            response = Response(status=200)
+            # переносим корзину, собранную до входа в систему
+            merge_guest_basket(request, user, response)
+            return response
         return Response(status=500)
 
 
@@ -42,8 +56,9 @@ class SignUpAPIView(APIView):
     """
     Класс, реализующий регистрацию пользователя и вход в систему
     При создании пользователя необходимо создавать защищенный
-    пароль. Делается это при помощи:
-    django.contrib.auth.hashers.make_password('any_password')
+    пароль. Делается это при помощи myauth.hashing.hash_password,
+    хэширующей пароль в ограниченном пуле потоков (запрос ждёт результата,
+    при переполненном пуле отвечаем 503)
     """
 
     def post(self, request):
@@ -52,21 +67,25 @@ class SignUpAPIView(APIView):
         password = data['password']
         name = data['name']
         email = username + '@django.com'
-        user = User.objects.create(username=username, email=email)
-        user.password = hashers.make_password(password)
-        user.save()
+        try:
+            encoded_password = hash_password(password)
+        except HashingOverloaded:
+            return overloaded_response()
+        user = User.objects.create(username=username, email=email, password=encoded_password)
         # Пользователь создан
 
         # Создадим профиль пользователя, с аватаркой по-умолчанию
         ProfileUser.objects.create(
             user=user,
             email=email,
-            avatar='avatar_default.png'
+            avatar=DEFAULT_AVATAR
         )
 
         if user is not None:
             login(request, user)
-            return Response(status=200)
+            response = Response(status=200)
+            merge_guest_basket(request, user, response)
+            return response
         return Response(status=500)
 
 
@@ -75,17 +94,17 @@ class ProfileUserAPIView(APIView):
     Класс отвечающий за вывод и редактирование
     информации о пользователе
     """
+    @method_decorator(condition(etag_func=profile_etag))
     def get(self, request):
         """
         Метод выводит на страницу профиля пользователя
-        информацию о нём.
+        информацию о нём. Профиль берётся из кэша, при неизменном
+        профиле клиент получает ответ 304 (ETag)
         """
-        profile = ProfileUser.objects.get(user=request.user)
-        print(profile.avatar)
-        serializer = ProfileSerializer(profile)
-        print(serializer.data)
-
-        return Response(serializer.data)
+        if not request.user.is_authenticated:
+            raise NotAuthenticated()
+        version, profile_data = load_profile(request.user.pk)
+        return Response(profile_data)
 
     def post(self, request):
         """
@@ -108,10 +127,7 @@ class ProfileUserAPIView(APIView):
             "full_name": f"{profile.surname} {profile.name} {profile.patronymic}",
             "email": profile.email,
             "phone": profile.phone,
-            "avatar": {
-                "src": profile.avatar.url,
-                "alt": profile.avatar.name,
-            },
+            "avatar": profile.get_avatar(),
         }
 
         return JsonResponse(data)
@@ -120,7 +136,8 @@ class ProfileUserAPIView(APIView):
 class AvatarChangeAPIView(APIView):
     """
     Класс отвечающий за смену аватарки пользователя.
-    А так же удаление старого файла аватарки
+    Загруженный файл превращается в уменьшенные копии,
+    старые файлы аватарки удаляются в фоне (см. myauth.avatars)
     """
 
     permission_classes = [IsAuthenticated, ]
@@ -128,19 +145,12 @@ class AvatarChangeAPIView(APIView):
     def post(self, request):
         user_profile = ProfileUser.objects.get(user=request.user)
         avatar_file = request.FILES.get('avatar')
-        avatar_path = os.path.join(settings.MEDIA_ROOT, str(user_profile.avatar))
-
-        # если получили новый файл аватара, то удалим
-        # старый, если он конечно доступен и это не аватарка по-умолчанию
         if avatar_file:
-            if os.path.isfile(avatar_path) and user_profile.avatar != 'avatar_default.png':
-                os.remove(avatar_path)
-
-        form = ProfileForm(request.POST, request.FILES, instance=user_profile)
-        if form.is_valid():
-            form.save()
-            return Response(status=200)
-        return Response(status=500)
+            try:
+                set_avatar(user_profile, avatar_file)
+            except InvalidAvatar as error:
+                return Response({"error": str(error)}, status=400)
+        return Response(status=200)
 
 
 class ChangePasswordAPIView(APIView):
@@ -155,8 +165,11 @@ class ChangePasswordAPIView(APIView):
         current_password = request.data.get('currentPassword')
         new_password = request.data.get('newPassword')
 
-        if user.check_password(current_password):
-            user.set_password(new_password)
-            user.save()
-            return Response(status=200)
+        try:
+            if verify_password(user, current_password):
+                user.password = hash_password(new_password)
+                user.save(update_fields=["password"])
+                return Response(status=200)
+        except HashingOverloaded:
+            return overloaded_response()
         return Response(status=500)
@@ -4,7 +4,7 @@ from .models import (
     Category, SubCategory,
     Product, ProductImage,
     Tag, Review, Specification, Sale,
-    BasketItem, Basket, Order, DeliveryPrice, Payment
+    BasketItem, Basket, Order, OrderItem, StockReservation, DeliveryPrice, Payment, PaymentJob, HomeFeed
 )
 
 
@@ -30,6 +30,9 @@ class ProductAdmin(admin.ModelAdmin):
     list_display_links = "pk", "title", "price"
     ordering = ("pk", )
     search_fields = ("title", )
+    # рейтинг пересчитывается автоматически при изменении отзывов,
+    # счётчики продаж - при оплате заказов
+    readonly_fields = ("rating", "reviews_count", "count_of_orders", "popularity")
 
 
 @admin.register(Tag)
@@ -74,10 +77,28 @@ class BasketItemAdmin(admin.ModelAdmin):
     list_display_links = "pk", "product", "basket", "quantity"
 
 
+class OrderItemInline(admin.TabularInline):
+    model = OrderItem
+    fields = "product", "title", "price", "quantity"
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+
+
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
     list_display = "pk", "created_at", "city", "delivery_address"
     list_display_links = "pk", "created_at", "city", "delivery_address"
+    inlines = [OrderItemInline]
+
+
+@admin.register(StockReservation)
+class StockReservationAdmin(admin.ModelAdmin):
+    list_display = "pk", "order", "state", "expires_at"
+    list_display_links = "pk", "order"
+    list_filter = ("state",)
+    # состояние меняется только вместе с остатками товаров (см. shopapp.stock)
+    readonly_fields = ("order", "state", "created_at", "expires_at")
 
 
 @admin.register(DeliveryPrice)
@@ -90,3 +111,18 @@ class DeliveryPriceAdmin(admin.ModelAdmin):
 class PaymentAdmin(admin.ModelAdmin):
     list_display = "pk", "order", "card_number", "success"
     list_display_links = "pk", "order", "card_number"
+
+
+@admin.register(PaymentJob)
+class PaymentJobAdmin(admin.ModelAdmin):
+    list_display = "pk", "order", "state", "attempts", "available_at", "locked_by"
+    list_display_links = "pk", "order"
+    list_filter = ("state",)
+    readonly_fields = ("order", "card_number", "validity_period", "attempts", "created_at", "locked_by", "locked_at")
+
+
+@admin.register(HomeFeed)
+class HomeFeedAdmin(admin.ModelAdmin):
+    list_display = "pk", "name", "version", "updated_at"
+    list_display_links = "pk", "name"
+    readonly_fields = ("items", "version", "updated_at")
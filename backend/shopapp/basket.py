@@ -0,0 +1,185 @@
+"""
+Операции с корзиной.
+
+Корзина вошедшего пользователя хранится в Basket/BasketItem и читается
+одним запросом с присоединёнными товарами (плюс загрузка картинок и тегов).
+Пока посетитель не вошёл в систему, содержимое корзины хранится
+в подписанной cookie ({id товара: количество}) и не пишется в базу
+данных. При входе в систему корзина переносится в Basket пользователя
+одним запросом UPSERT (см. merge_guest_basket).
+"""
+import json
+
+from django.core import signing
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+
+from .models import Basket, BasketItem, Product
+
+GUEST_BASKET_COOKIE = "basket"
+GUEST_BASKET_SALT = "shopapp.basket"
+GUEST_BASKET_MAX_AGE = 60 * 60 * 24 * 30
+# ограничение размера cookie: не больше стольких разных товаров
+GUEST_BASKET_MAX_ITEMS = 100
+
+
+class GuestBasket:
+    """Корзина анонимного посетителя в подписанной cookie"""
+
+    def __init__(self, request):
+        self.items = {}
+        try:
+            data = request.get_signed_cookie(
+                GUEST_BASKET_COOKIE, salt=GUEST_BASKET_SALT, max_age=GUEST_BASKET_MAX_AGE
+            )
+        except (KeyError, signing.BadSignature):
+            return
+        try:
+            self.items = {int(product_id): int(quantity) for product_id, quantity in json.loads(data).items()}
+        except (ValueError, TypeError, AttributeError):
+            self.items = {}
+
+    def __bool__(self):
+        return bool(self.items)
+
+    def add(self, product_id, count):
+        """Добавляет товар, возвращает False, если корзина переполнена"""
+        if product_id not in self.items and len(self.items) >= GUEST_BASKET_MAX_ITEMS:
+            return False
+        self.items[product_id] = self.items.get(product_id, 0) + count
+        return True
+
+    def remove(self, product_id, count):
+        """Уменьшает количество товара, удаляя его при достижении нуля"""
+        if product_id not in self.items:
+            return False
+        if self.items[product_id] > count:
+            self.items[product_id] -= count
+        else:
+            del self.items[product_id]
+        return True
+
+    def get_items(self, product_ids=None):
+        """
+        Несохраняемые объекты BasketItem для сериализации корзины,
+        все товары загружаются одним запросом
+        """
+        if product_ids is None:
+            product_ids = self.items
+        products = Product.objects.filter(
+            pk__in=[product_id for product_id in product_ids if product_id in self.items]
+        ).prefetch_related('images', 'tags')
+        return [BasketItem(product=product, quantity=self.items[product.pk]) for product in products]
+
+    def save(self, response):
+        if not self.items:
+            response.delete_cookie(GUEST_BASKET_COOKIE)
+            return
+        response.set_signed_cookie(
+            GUEST_BASKET_COOKIE,
+            json.dumps(self.items),
+            salt=GUEST_BASKET_SALT,
+            max_age=GUEST_BASKET_MAX_AGE,
+            httponly=True,
+            samesite="Lax",
+        )
+
+
+def get_basket_items(user, product_ids=None):
+    """
+    Товары корзины пользователя вместе с продуктами (один запрос с JOIN),
+    их картинками и тегами. product_ids ограничивает выборку
+    изменившимися товарами
+    """
+    items = BasketItem.objects.filter(basket__user=user).select_related('product').prefetch_related(
+        'product__images', 'product__tags'
+    )
+    if product_ids is not None:
+        items = items.filter(product_id__in=product_ids)
+    return items
+
+
+def upsert_items(basket, quantities):
+    """
+    Добавляет товары в корзину одним запросом INSERT ... ON CONFLICT
+    по уникальному индексу (basket, product): количество увеличивается
+    в самой базе данных, поэтому одновременные запросы не теряют изменений
+    и не создают повторяющихся строк. quantities - {id товара: количество}
+    """
+    if not quantities:
+        return
+    if connection.vendor not in ("sqlite", "postgresql"):
+        for product_id, quantity in quantities.items():
+            _increment_item(basket, product_id, quantity)
+        return
+    table = connection.ops.quote_name(BasketItem._meta.db_table)
+    values = ", ".join(["(%s, %s, %s)"] * len(quantities))
+    params = []
+    for product_id, quantity in quantities.items():
+        params += [basket.pk, product_id, quantity]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {table} (basket_id, product_id, quantity) VALUES {values} "
+            f"ON CONFLICT (basket_id, product_id) "
+            f"DO UPDATE SET quantity = {table}.quantity + excluded.quantity",
+            params,
+        )
+
+
+def _increment_item(basket, product_id, quantity):
+    """Запасной вариант UPSERT для СУБД без ON CONFLICT"""
+    items = BasketItem.objects.filter(basket=basket, product_id=product_id)
+    while not items.update(quantity=F("quantity") + quantity):
+        try:
+            with transaction.atomic():
+                BasketItem.objects.create(basket=basket, product_id=product_id, quantity=quantity)
+            return
+        except IntegrityError:
+            # строку только что создал параллельный запрос - увеличиваем её
+            continue
+
+
+def add_item(basket, product_id, count):
+    """Добавляет count единиц товара в корзину пользователя"""
+    upsert_items(basket, {product_id: count})
+    return True
+
+
+def remove_item(basket, product_id, count):
+    """
+    Убирает count единиц товара из корзины пользователя условными
+    UPDATE/DELETE без чтения строки, возвращает False, если такого
+    товара в корзине нет
+    """
+    items = BasketItem.objects.filter(basket=basket, product_id=product_id)
+    while True:
+        if items.filter(quantity__gt=count).update(quantity=F("quantity") - count):
+            return True
+        deleted, _ = items.filter(quantity__lte=count).delete()
+        if deleted:
+            return True
+        # количество изменилось между запросами - пробуем снова,
+        # если строка ещё существует
+        if not items.exists():
+            return False
+
+
+def merge_guest_basket(request, user, response):
+    """
+    Переносит корзину анонимного посетителя в корзину пользователя
+    при входе в систему и удаляет cookie корзины
+    """
+    guest_basket = GuestBasket(request)
+    if not guest_basket:
+        return
+    with transaction.atomic():
+        _merge_items(user, guest_basket.items)
+    response.delete_cookie(GUEST_BASKET_COOKIE)
+
+
+def _merge_items(user, items):
+    basket, created = Basket.objects.get_or_create(user=user)
+    upsert_items(basket, {
+        product_id: items[product_id]
+        for product_id in Product.objects.filter(pk__in=items).values_list("pk", flat=True)
+    })
@@ -0,0 +1,86 @@
+"""
+Версионированное кэширование редко изменяемых данных.
+
+Каждому пространству имён (дерево категорий, настройки магазина и т.д.)
+соответствует номер версии в общем кэше (settings.CACHES). Сигналы
+сохранения/удаления моделей меняют версию после фиксации транзакции,
+после чего все процессы при следующем обращении перестраивают данные. Дополнительно значение
+хранится в памяти процесса, чтобы не десериализовать его на каждый запрос.
+"""
+import time
+
+from django.core.cache import cache
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.db import transaction
+
+CATEGORIES = "categories"
+HOME_FEEDS = "home-feeds"
+SHOP_CONFIG = "shop-config"
+
+
+def product_namespace(product_id):
+    """Пространство имён данных отдельного продукта"""
+    return f"product:{product_id}"
+
+# значения, закэшированные в памяти процесса: {(namespace, key): (version, value)}
+_local_cache = {}
+
+
+def _version_key(namespace):
+    return f"shopapp:version:{namespace}"
+
+
+def get_version(namespace):
+    """Возвращает текущую версию пространства имён"""
+    key = _version_key(namespace)
+    version = cache.get(key)
+    if version is None:
+        # версия, вытесненная из кэша, начинается с текущего времени,
+        # чтобы не совпасть ни с одной из ранее выданных версий
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(namespace):
+    """
+    Делает устаревшими все закэшированные значения пространства имён
+    после фиксации текущей транзакции (вне транзакции - сразу). Если
+    сменить версию до фиксации, другой процесс может успеть перестроить
+    значение по ещё не изменённым данным и сохранить его под новой версией
+    """
+    transaction.on_commit(lambda: _set_new_version(namespace))
+
+
+def _set_new_version(namespace):
+    """
+    Новая версия - текущее время, но не меньше прежней версии плюс один:
+    в отличие от incr это не требует атомарности от кэша, и одновременные
+    изменения из разных процессов всё равно дают версию, отличную от прежней
+    """
+    key = _version_key(namespace)
+    version = max(time.time_ns(), (cache.get(key) or 0) + 1)
+    cache.set(key, version, timeout=None)
+    return version
+
+
+def get_or_build(namespace, builder, key="", local=True, timeout=DEFAULT_TIMEOUT):
+    """
+    Возвращает пару (версия, значение) из кэша текущей версии,
+    при промахе вызывает builder() и сохраняет результат
+    """
+    version = get_version(namespace)
+    local_key = (namespace, key)
+    if local:
+        cached = _local_cache.get(local_key)
+        if cached is not None and cached[0] == version:
+            return cached
+
+    shared_key = f"shopapp:{namespace}:{key}:{version}"
+    value = cache.get(shared_key)
+    if value is None:
+        value = builder()
+        cache.set(shared_key, value, timeout=timeout)
+    if local:
+        _local_cache[local_key] = (version, value)
+    return version, value
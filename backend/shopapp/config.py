@@ -0,0 +1,35 @@
+"""
+Настройки магазина (стоимость доставки и т.д.).
+
+Настройки читаются на каждом шаге оформления заказа, поэтому хранятся
+в памяти процесса и загружаются из базы данных только после изменения:
+сигналы сохранения/удаления увеличивают версию пространства имён
+SHOP_CONFIG в общем кэше, и каждый процесс при следующем обращении
+перечитывает настройки (см. shopapp.cache).
+"""
+from . import cache
+from .models import DeliveryPrice
+
+# стоимость доставки хранится в единственной записи DeliveryPrice
+DELIVERY_PRICE_ID = 1
+
+
+def build_config():
+    delivery_price = DeliveryPrice.objects.filter(pk=DELIVERY_PRICE_ID).first()
+    if delivery_price is None:
+        # запись ещё не создана в админке - доставка бесплатная
+        delivery_price = DeliveryPrice(pk=DELIVERY_PRICE_ID)
+    return {
+        "delivery_price": delivery_price,
+    }
+
+
+def get_config():
+    """Словарь настроек магазина, изменять его нельзя"""
+    version, config = cache.get_or_build(cache.SHOP_CONFIG, build_config)
+    return config
+
+
+def get_delivery_price():
+    """Стоимость доставки (объект DeliveryPrice)"""
+    return get_config()["delivery_price"]
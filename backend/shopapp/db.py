@@ -0,0 +1,15 @@
+"""
+Вспомогательные выражения для запросов к базе данных.
+"""
+from django.db.models import Case, F, Value, When
+
+
+def add_per_row(field, amounts, key='pk'):
+    """
+    Выражение F(field) + amounts[key]: своё приращение для каждой строки,
+    чтобы обновить счётчики нескольких записей одним UPDATE
+    """
+    return F(field) + Case(
+        *[When(**{key: key_value}, then=Value(amount)) for key_value, amount in amounts.items()],
+        default=Value(0),
+    )
@@ -0,0 +1,31 @@
+"""
+Загрузка карточки товара.
+
+Товар вместе с картинками, тегами, характеристиками и первыми отзывами
+загружается фиксированным числом запросов, рейтинг хранится в самом
+товаре. Готовый ответ кэшируется по id товара, сигналы изменения
+товара и связанных с ним данных увеличивают версию кэша (см. signals).
+"""
+from . import cache
+from .models import Product
+from .serializers import DetailsSerializer
+
+
+def build_product_details(product_id):
+    product = Product.objects.prefetch_related(
+        'images', 'tags', 'specification'
+    ).get(pk=product_id)
+    return DetailsSerializer(product).data
+
+
+def load_product_details(product_id):
+    """
+    Возвращает карточку товара из кэша, при промахе строит её.
+    Если товара нет, выбрасывает Product.DoesNotExist
+    """
+    version, details = cache.get_or_build(
+        cache.product_namespace(product_id),
+        lambda: build_product_details(product_id),
+        local=False,
+    )
+    return details
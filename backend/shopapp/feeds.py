@@ -0,0 +1,44 @@
+"""
+Подборки товаров для главной страницы.
+
+Каждая подборка хранится в HomeFeed как готовый ответ API вместе
+с версией данных каталога, для которой она построена. Изменения
+товаров, картинок, тегов и отзывов (см. signals) и остатков на складе
+(см. stock) увеличивают версию,
+и подборка перестраивается при следующем обращении или командой
+refresh_home_feeds. Чтение актуальной подборки - один запрос.
+"""
+from . import cache
+from .models import HomeFeed, Product
+from .serializers import ProductSerializer
+
+
+def get_feed_queryset(name):
+    products = Product.objects.prefetch_related('images', 'tags', 'specification')
+    if name == HomeFeed.BANNERS:
+        # три продукта с самым большим рейтингом
+        return products.filter(rating__gt=0).order_by('-rating')[:3]
+    if name == HomeFeed.POPULAR:
+        # самые продаваемые товары, см. shopapp.popularity
+        return products.order_by('-popularity', 'id')[:8]
+    if name == HomeFeed.LIMITED:
+        return products.filter(tags__name__in=['limited'])[:16]
+    raise KeyError(name)
+
+
+def refresh_feed(name):
+    """Перестраивает подборку и сохраняет её снимок"""
+    version = cache.get_version(cache.HOME_FEEDS)
+    items = ProductSerializer(get_feed_queryset(name), many=True).data
+    feed, created = HomeFeed.objects.update_or_create(
+        name=name, defaults={"items": items, "version": version}
+    )
+    return feed.items
+
+
+def get_feed(name):
+    """Возвращает актуальную подборку, при необходимости перестраивая её"""
+    feed = HomeFeed.objects.filter(name=name).first()
+    if feed is None or feed.version != cache.get_version(cache.HOME_FEEDS):
+        return refresh_feed(name)
+    return feed.items
@@ -0,0 +1,181 @@
+"""
+Ключи идемпотентности для изменяющих запросов.
+
+Клиент передаёт в заголовке Idempotency-Key уникальную строку для каждой
+операции и повторяет с ней запрос, если не дождался ответа. Первый
+ответ сохраняется на settings.IDEMPOTENCY_KEY_TTL секунд, повторные
+запросы с тем же ключом получают его копию (с заголовком
+Idempotent-Replayed) без повторного создания заказа, платежа и т.д.
+Пока первый запрос выполняется, повтор получает 409. Ключ, повторно
+использованный с другим телом запроса, отклоняется с кодом 422.
+Ответы с кодами 401, 403 и 5xx не сохраняются, такой запрос можно повторить.
+
+Ключи хранятся в таблице IdempotencyKey, а не в кэше: повтор может
+попасть в другой процесс или сервер, а кэш вытесняет записи раньше
+срока. Ключ занимается вставкой строки с уникальным key, поэтому
+из одновременных запросов выполняется только один. Просроченные
+ключи удаляет команда delete_expired_idempotency_keys, её нужно
+запускать периодически (например, раз в час).
+
+Ключи хранятся отдельно для каждого пользователя (определённого
+аутентификацией DRF: по сессии, Basic и т.д.), метода и адреса
+запроса; ключи анонимных посетителей общие, поэтому клиент должен
+выбирать их случайно (например, UUID4).
+"""
+import datetime
+import hashlib
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse, JsonResponse
+from django.utils import timezone
+
+from .models import IdempotencyKey
+
+IDEMPOTENCY_HEADER = "HTTP_IDEMPOTENCY_KEY"
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+# сколько секунд ключ считается занятым выполняющимся запросом
+IDEMPOTENCY_LOCK_TIMEOUT = 60
+# заголовки ответа, которые повторяются вместе с ним
+REPLAYED_HEADERS = ("Content-Type", "Location", "Link")
+# ответы, которые не сохраняются: запрос не был выполнен и его можно повторить
+# (ошибки аутентификации и сервера)
+RETRYABLE_STATUSES = (401, 403)
+
+
+def _get_scope(request):
+    if request.user.is_authenticated:
+        return f"user:{request.user.pk}"
+    return "anonymous"
+
+
+def _get_key(request, key):
+    return hashlib.sha256(
+        f"{_get_scope(request)}\n{request.method}\n{request.path}\n{key}".encode()
+    ).hexdigest()
+
+
+def _claim(key, fingerprint, record, now):
+    """
+    Занимает ключ для выполнения запроса: создаёт запись или перехватывает
+    просроченную. Возвращает False, если ключ успел занять другой запрос
+    """
+    expires_at = now + datetime.timedelta(seconds=IDEMPOTENCY_LOCK_TIMEOUT)
+    if record is None:
+        try:
+            with transaction.atomic():
+                IdempotencyKey.objects.create(key=key, fingerprint=fingerprint, expires_at=expires_at)
+        except IntegrityError:
+            return False
+        return True
+    return bool(IdempotencyKey.objects.filter(pk=record.pk, expires_at=record.expires_at).update(
+        fingerprint=fingerprint, state=IdempotencyKey.IN_FLIGHT, status=None,
+        content=b"", headers={}, cookies="", created_at=now, expires_at=expires_at,
+    ))
+
+
+def _store(key, response):
+    IdempotencyKey.objects.filter(key=key).update(
+        state=IdempotencyKey.DONE,
+        status=response.status_code,
+        content=response.content,
+        headers={name: response[name] for name in REPLAYED_HEADERS if response.has_header(name)},
+        cookies=response.cookies.output(header="", sep="\n"),
+        expires_at=timezone.now() + datetime.timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL),
+    )
+
+
+def _replay(record):
+    response = HttpResponse(bytes(record.content), status=record.status)
+    for name, value in record.headers.items():
+        response[name] = value
+    response.cookies.load(record.cookies)
+    response["Idempotent-Replayed"] = "true"
+    return response
+
+
+def delete_expired_keys(now=None):
+    """Удаляет просроченные ключи, возвращает их количество"""
+    deleted, _ = IdempotencyKey.objects.filter(expires_at__lte=now or timezone.now()).delete()
+    return deleted
+
+
+class _EarlyResponse(Exception):
+    """Ответ на запрос с ключом идемпотентности, отданный без выполнения запроса"""
+
+    def __init__(self, response):
+        super().__init__(response)
+        self.response = response
+
+
+class IdempotencyMixin:
+    """
+    Примесь к APIView: запросы методов idempotent_methods
+    с заголовком Idempotency-Key выполняются не больше одного раза.
+    Ключ проверяется после аутентификации DRF, поэтому ключи клиентов,
+    вошедших по сессии или по Basic, хранятся отдельно
+    """
+    idempotent_methods = ("POST", "PUT", "PATCH", "DELETE")
+
+    def dispatch(self, request, *args, **kwargs):
+        self._idempotency_key = None
+        # тело читается до DRF: после разбора multipart оно уже недоступно
+        self._idempotency_fingerprint = None
+        if request.META.get(IDEMPOTENCY_HEADER) and request.method in self.idempotent_methods:
+            self._idempotency_fingerprint = hashlib.sha256(request.body).hexdigest()
+        return super().dispatch(request, *args, **kwargs)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if self._idempotency_fingerprint is None:
+            return
+        header = request.META[IDEMPOTENCY_HEADER]
+        if len(header) > IDEMPOTENCY_KEY_MAX_LENGTH:
+            raise _EarlyResponse(JsonResponse({"error": "Слишком длинный ключ идемпотентности"}, status=400))
+
+        key = _get_key(request, header)
+        fingerprint = self._idempotency_fingerprint
+        now = timezone.now()
+        record = IdempotencyKey.objects.filter(key=key).first()
+        if record is None or record.expires_at <= now:
+            if _claim(key, fingerprint, record, now):
+                self._idempotency_key = key
+                return
+            # ключ только что занял другой запрос
+            record = IdempotencyKey.objects.filter(key=key).first()
+        if record is not None and record.fingerprint != fingerprint:
+            raise _EarlyResponse(JsonResponse(
+                {"error": "Ключ идемпотентности уже использован с другим запросом"}, status=422
+            ))
+        if record is None or record.state == IdempotencyKey.IN_FLIGHT:
+            raise _EarlyResponse(JsonResponse({"error": "Запрос с этим ключом ещё выполняется"}, status=409))
+        raise _EarlyResponse(_replay(record))
+
+    def handle_exception(self, exc):
+        if isinstance(exc, _EarlyResponse):
+            return exc.response
+        try:
+            return super().handle_exception(exc)
+        except Exception:
+            # необработанная ошибка (ответ 500): запрос можно повторить
+            self._release_key(None)
+            raise
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if self._idempotency_key is not None:
+            if hasattr(response, "render") and not response.is_rendered:
+                response.render()
+            self._release_key(response)
+        return response
+
+    def _release_key(self, response):
+        """Сохраняет ответ под занятым ключом или освобождает ключ"""
+        key, self._idempotency_key = self._idempotency_key, None
+        if key is None:
+            return
+        if (response is not None and response.status_code < 500
+                and response.status_code not in RETRYABLE_STATUSES):
+            _store(key, response)
+        else:
+            IdempotencyKey.objects.filter(key=key).delete()
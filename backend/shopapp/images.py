@@ -0,0 +1,65 @@
+"""
+Общее для обработки картинок товаров, категорий и аватаров.
+
+Фоновые задания (построение уменьшенных копий, удаление ненужных
+файлов) выполняются в одном пуле из IMAGE_WORKERS потоков, чтобы
+обработка картинок не занимала больше потоков, чем задано.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait as wait_futures
+
+from django.db import connection
+from PIL import Image
+
+from .storage import delete_unreferenced
+
+IMAGE_WORKERS = 2
+
+_executor = ThreadPoolExecutor(max_workers=IMAGE_WORKERS, thread_name_prefix="images")
+_pending = set()
+_pending_lock = threading.Lock()
+
+
+def to_rgb(image):
+    """
+    Переводит картинку в RGB (или RGBA, если у неё есть прозрачность),
+    с которыми работают resize и кодировщики WebP и JPEG
+    """
+    if image.mode in ("RGB", "RGBA"):
+        return image
+    return image.convert("RGBA" if "transparency" in image.info or "A" in image.getbands() else "RGB")
+
+
+def _forget(future):
+    with _pending_lock:
+        _pending.discard(future)
+
+
+def _run(func, *args):
+    try:
+        return func(*args)
+    finally:
+        # потоки пула живут долго, соединение не должно оставаться открытым
+        connection.close()
+
+
+def submit(func, *args):
+    """Выполняет func(*args) в фоновом потоке пула"""
+    future = _executor.submit(_run, func, *args)
+    with _pending_lock:
+        _pending.add(future)
+    future.add_done_callback(_forget)
+    return future
+
+
+def delete_files_later(storage, names):
+    """Удаляет в фоне файлы names, на которые больше нет ссылок"""
+    if names:
+        return submit(delete_unreferenced, storage, names)
+
+
+def wait():
+    """Дожидается выполнения заданий, уже поставленных в очередь"""
+    with _pending_lock:
+        pending = list(_pending)
+    wait_futures(pending)
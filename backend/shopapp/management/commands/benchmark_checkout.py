@@ -0,0 +1,130 @@
+import random
+import threading
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection
+from django.db.models import Count
+
+from myauth.models import ProfileUser
+from shopapp.basket import upsert_items
+from shopapp.models import Basket, BasketItem, Category, Order, OrderItem, Product, SubCategory
+from shopapp.orders import create_order
+from shopapp.payments import enqueue_payment, run_pending_jobs
+from shopapp.stock import InsufficientStock
+
+# сколько раз повторять оформление, если SQLite ответил "database is locked"
+LOCK_RETRIES = 20
+
+
+class Command(BaseCommand):
+    help = (
+        "Нагрузочный тест оформления и оплаты заказов в нескольких потоках "
+        "на временной тестовой базе данных: проверяет, что товары не продаются "
+        "сверх остатка, и измеряет пропускную способность"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, default=8)
+        parser.add_argument("--checkouts", type=int, default=50, help="заказов на поток")
+        parser.add_argument("--products", type=int, default=5)
+        parser.add_argument("--stock", type=int, default=100, help="остаток каждого товара")
+        parser.add_argument("--max-quantity", type=int, default=3)
+
+    def handle(self, *args, **options):
+        old_name = connection.settings_dict["NAME"]
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            self.run(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def run(self, options):
+        category = Category.objects.create(title="Benchmark")
+        subcategory = SubCategory.objects.create(title="Benchmark", category=category)
+        products = Product.objects.bulk_create([
+            Product(category=category, subcategory=subcategory, title=f"Товар {number}",
+                    price=100, count=options["stock"])
+            for number in range(options["products"])
+        ])
+        product_ids = [product.pk for product in products]
+        users = User.objects.bulk_create([
+            User(username=f"buyer{number}") for number in range(options["threads"])
+        ])
+        profiles = ProfileUser.objects.bulk_create([ProfileUser(user=user) for user in users])
+        baskets = Basket.objects.bulk_create([Basket(user=user) for user in users])
+
+        stats = {"ordered": 0, "insufficient": 0, "retries": 0}
+        errors = []
+        lock = threading.Lock()
+        barrier = threading.Barrier(options["threads"])
+
+        def checkout(profile, basket, rng, worker_name):
+            for attempt in range(LOCK_RETRIES):
+                try:
+                    BasketItem.objects.filter(basket=basket).delete()
+                    upsert_items(basket, {
+                        product_id: rng.randint(1, options["max_quantity"])
+                        for product_id in rng.sample(product_ids, rng.randint(1, len(product_ids)))
+                    })
+                    order = create_order(profile, basket)
+                    Order.change_status(order.pk, Order.ACCEPTED)
+                    enqueue_payment(order, "12345678", "12.30")
+                    # поток выполняет одно задание из общей очереди, как отдельный обработчик
+                    run_pending_jobs(worker_name, limit=1)
+                    return "ordered"
+                except InsufficientStock:
+                    return "insufficient"
+                except OperationalError:
+                    with lock:
+                        stats["retries"] += 1
+                    time.sleep(rng.random() / 100)
+            raise CommandError("База данных заблокирована слишком долго")
+
+        def worker(number):
+            rng = random.Random(number)
+            worker_name = f"benchmark-{number}"
+            try:
+                barrier.wait()
+                for _ in range(options["checkouts"]):
+                    result = checkout(profiles[number], baskets[number], rng, worker_name)
+                    with lock:
+                        stats[result] += 1
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=worker, args=(number,)) for number in range(options["threads"])]
+        started = time.perf_counter()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        if errors:
+            raise CommandError(errors[0])
+        # задания, оставшиеся в очереди после остановки потоков
+        run_pending_jobs("benchmark")
+        statuses = dict(Order.objects.values_list("status").annotate(count=Count("id")))
+
+        remaining = dict(Product.objects.filter(pk__in=product_ids).values_list("pk", "count"))
+        sold = {product_id: 0 for product_id in product_ids}
+        for product_id, quantity in OrderItem.objects.filter(order__status="paid").values_list("product_id", "quantity"):
+            sold[product_id] += quantity
+        oversold = [
+            product_id for product_id in product_ids
+            if remaining[product_id] < 0 or remaining[product_id] + sold[product_id] != options["stock"]
+        ]
+
+        total = stats["ordered"] + stats["insufficient"]
+        self.stdout.write(
+            f"Оформлено заказов: {stats['ordered']}, оплачено: {statuses.get(Order.PAID, 0)}, "
+            f"отказов из-за остатков: {stats['insufficient']}, повторов из-за блокировок: {stats['retries']}"
+        )
+        self.stdout.write(f"Продано единиц: {sum(sold.values())} из {options['stock'] * len(product_ids)}")
+        self.stdout.write(f"Время: {elapsed:.2f} с, {total / elapsed:.1f} оформлений/с")
+        if oversold:
+            raise CommandError(f"Остатки не сходятся с продажами для товаров {oversold}")
+        self.stdout.write(self.style.SUCCESS("Товары не проданы сверх остатка"))
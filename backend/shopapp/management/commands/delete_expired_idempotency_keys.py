@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from shopapp.idempotency import delete_expired_keys
+
+
+class Command(BaseCommand):
+    help = (
+        "Удаляет просроченные ключи идемпотентности и сохранённые ответы "
+        "(запускается периодически, например раз в час)"
+    )
+
+    def handle(self, *args, **options):
+        count = delete_expired_keys()
+        self.stdout.write(self.style.SUCCESS(f"Удалено ключей: {count}"))
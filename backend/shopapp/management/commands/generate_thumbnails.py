@@ -0,0 +1,40 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from shopapp.thumbnails import IMAGE_MODELS, generate_variants, needs_variants
+
+
+class Command(BaseCommand):
+    help = (
+        "Строит уменьшенные копии картинок товаров, категорий и подкатегорий, "
+        "у которых их ещё нет (например, загруженных до появления копий). "
+        "Картинки обрабатываются параллельно в нескольких потоках"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+        parser.add_argument("--force", action="store_true",
+                            help="построить копии заново для всех картинок")
+
+    def handle(self, *args, **options):
+        def generate(model, instance):
+            try:
+                return generate_variants(model, instance.pk, instance.image.name or "", instance.image_variants)
+            finally:
+                connection.close()
+
+        tasks = [
+            (model, instance)
+            for model in IMAGE_MODELS
+            for instance in model.objects.only("pk", "image", "image_variants").iterator()
+            if (options["force"] and instance.image) or needs_variants(instance)
+        ]
+        # Pillow отпускает GIL при декодировании и сжатии, потоки работают параллельно
+        with ThreadPoolExecutor(max_workers=options["workers"]) as executor:
+            results = list(executor.map(lambda task: generate(*task), tasks))
+        self.stdout.write(self.style.SUCCESS(
+            f"Обработано картинок: {sum(results)} из {len(tasks)}"
+        ))
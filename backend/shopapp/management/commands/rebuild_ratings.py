@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Avg, Count
+
+from shopapp.models import Product
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает рейтинг и количество отзывов всех продуктов"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        products = Product.objects.order_by("pk").annotate(
+            average=Avg("reviews__rate"), number=Count("reviews")
+        ).only("pk")
+        updated = 0
+        last_pk = 0
+        while True:
+            # продукты обрабатываются пачками по первичному ключу,
+            # на каждую пачку - один агрегирующий запрос и один bulk_update
+            batch = list(products.filter(pk__gt=last_pk)[:batch_size])
+            if not batch:
+                break
+            for product in batch:
+                product.rating = Product.calculate_rating(product.average)
+                product.reviews_count = product.number
+            Product.objects.bulk_update(batch, ["rating", "reviews_count"])
+            updated += len(batch)
+            last_pk = batch[-1].pk
+        self.stdout.write(self.style.SUCCESS(f"Обновлён рейтинг {updated} продуктов"))
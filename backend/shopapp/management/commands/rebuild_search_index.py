@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from shopapp.search import is_supported, rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = "Полностью перестраивает полнотекстовый индекс товаров"
+
+    def handle(self, *args, **options):
+        if not is_supported():
+            self.stdout.write("Полнотекстовый индекс доступен только на SQLite")
+            return
+        rebuild_search_index()
+        self.stdout.write(self.style.SUCCESS("Поисковый индекс перестроен"))
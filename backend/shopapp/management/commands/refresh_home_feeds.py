@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from shopapp.feeds import refresh_feed
+from shopapp.models import HomeFeed
+
+
+class Command(BaseCommand):
+    help = "Перестраивает подборки товаров главной страницы"
+
+    def handle(self, *args, **options):
+        for name in (HomeFeed.BANNERS, HomeFeed.POPULAR, HomeFeed.LIMITED):
+            items = refresh_feed(name)
+            self.stdout.write(f"{name}: {len(items)} товаров")
+        self.stdout.write(self.style.SUCCESS("Подборки обновлены"))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from shopapp.stock import release_expired_reservations
+
+
+class Command(BaseCommand):
+    help = (
+        "Снимает просроченные резервы неоплаченных заказов и возвращает товары "
+        "на склад (запускается периодически, например раз в минуту)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--limit", type=int, default=None)
+
+    def handle(self, *args, **options):
+        count = release_expired_reservations(limit=options["limit"])
+        self.stdout.write(self.style.SUCCESS(f"Снято резервов: {count}"))
@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from shopapp.payments import get_worker_name, run_pending_jobs
+
+
+class Command(BaseCommand):
+    help = (
+        "Обработчик очереди оплаты заказов. Обработчиков можно запустить "
+        "несколько, каждое задание выполнит только один из них"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--poll-interval", type=float, default=1.0,
+                            help="пауза в секундах, когда очередь пуста")
+        parser.add_argument("--once", action="store_true",
+                            help="выполнить накопившиеся задания и завершиться")
+
+    def handle(self, *args, **options):
+        worker_name = get_worker_name()
+        self.stdout.write(f"Обработчик {worker_name} запущен")
+        while True:
+            close_old_connections()
+            count = run_pending_jobs(worker_name)
+            if count:
+                self.stdout.write(f"Выполнено заданий: {count}")
+            if options["once"]:
+                break
+            time.sleep(options["poll_interval"])
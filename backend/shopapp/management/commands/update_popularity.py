@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from shopapp import cache
+from shopapp.popularity import recompute_popularity
+
+
+class Command(BaseCommand):
+    help = (
+        "Пересчитывает популярность товаров по продажам за скользящее окно "
+        "с затуханием по времени (запускается периодически, например раз в сутки)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--window-days", type=int, default=None)
+        parser.add_argument("--half-life-days", type=float, default=None)
+
+    def handle(self, *args, **options):
+        count = recompute_popularity(
+            window_days=options["window_days"],
+            half_life_days=options["half_life_days"],
+        )
+        cache.bump_version(cache.HOME_FEEDS)
+        self.stdout.write(self.style.SUCCESS(f"Популярность пересчитана, продававшихся товаров: {count}"))
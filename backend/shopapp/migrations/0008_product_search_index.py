@@ -0,0 +1,22 @@
+from django.db import migrations
+
+from shopapp.search import rebuild_search_index, uninstall_search_index
+
+
+def create_search_index(apps, schema_editor):
+    rebuild_search_index(schema_editor.connection)
+
+
+def drop_search_index(apps, schema_editor):
+    uninstall_search_index(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0007_alter_deliveryprice_options_alter_basketitem_basket_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.5 on 2026-10-18 08:59
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import Avg, Count
+
+
+def fill_rating(apps, schema_editor):
+    Product = apps.get_model('shopapp', 'Product')
+    products = list(Product.objects.annotate(average=Avg('reviews__rate'), number=Count('reviews')))
+    for product in products:
+        product.rating = Decimal(str(round(product.average or 0, 2)))
+        product.reviews_count = product.number
+    Product.objects.bulk_update(products, ['rating', 'reviews_count'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0008_product_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='reviews_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Количество отзывов'),
+        ),
+        migrations.RunPython(fill_rating, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.5 on 2026-10-18 09:01
+
+from django.db import migrations, models
+import rest_framework.utils.encoders
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0009_product_reviews_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HomeFeed',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('items', models.JSONField(default=list, encoder=rest_framework.utils.encoders.JSONEncoder)),
+                ('version', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Подборка главной страницы',
+                'verbose_name_plural': 'Подборки главной страницы',
+            },
+        ),
+    ]
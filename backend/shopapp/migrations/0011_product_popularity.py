@@ -0,0 +1,55 @@
+# Generated by Django 4.2.5 on 2026-10-18 09:02
+
+from django.db import migrations, models
+from django.db.models import F
+import django.db.models.deletion
+
+
+def fill_popularity(apps, schema_editor):
+    Product = apps.get_model('shopapp', 'Product')
+    Product.objects.update(popularity=F('count_of_orders'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0010_homefeed'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductDailySales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('quantity', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Продажи товара за день',
+                'verbose_name_plural': 'Продажи товаров по дням',
+            },
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='popularity',
+            field=models.FloatField(default=0, verbose_name='Популярность'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['-popularity', 'id'], name='shopapp_product_popularity'),
+        ),
+        migrations.AddField(
+            model_name='productdailysales',
+            name='product',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_sales', to='shopapp.product'),
+        ),
+        migrations.AddIndex(
+            model_name='productdailysales',
+            index=models.Index(fields=['day'], name='shopapp_daily_sales_day'),
+        ),
+        migrations.AddConstraint(
+            model_name='productdailysales',
+            constraint=models.UniqueConstraint(fields=('product', 'day'), name='shopapp_product_daily_sales_unique'),
+        ),
+        migrations.RunPython(fill_popularity, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.5 on 2026-10-18 09:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0011_product_popularity'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['product', '-date', '-id'], name='shopapp_review_product_date'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.5 on 2026-10-18 09:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0012_review_product_date_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='sale',
+            index=models.Index(fields=['date_to', 'id'], name='shopapp_sale_date_to'),
+        ),
+    ]
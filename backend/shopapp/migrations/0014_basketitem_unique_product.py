@@ -0,0 +1,33 @@
+# Generated by Django 4.2.5 on 2026-10-18 09:07
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicate_items(apps, schema_editor):
+    """Объединяет повторяющиеся строки одного товара в корзине"""
+    BasketItem = apps.get_model('shopapp', 'BasketItem')
+    duplicates = (
+        BasketItem.objects.values('basket_id', 'product_id')
+        .annotate(number=Count('id'), first_id=Min('id'), total=Sum('quantity'))
+        .filter(number__gt=1)
+    )
+    for duplicate in duplicates:
+        items = BasketItem.objects.filter(basket_id=duplicate['basket_id'], product_id=duplicate['product_id'])
+        items.filter(id=duplicate['first_id']).update(quantity=duplicate['total'])
+        items.exclude(id=duplicate['first_id']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0013_sale_date_to_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_items, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='basketitem',
+            constraint=models.UniqueConstraint(fields=('basket', 'product'), name='shopapp_basketitem_unique_product'),
+        ),
+    ]
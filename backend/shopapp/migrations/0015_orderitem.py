@@ -0,0 +1,74 @@
+# Generated by Django 4.2.5 on 2026-10-18 09:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_order_items(apps, schema_editor):
+    """
+    Копирует в уже оформленные заказы товары их корзин -
+    то, что до сих пор показывалось в заказе
+    """
+    Order = apps.get_model('shopapp', 'Order')
+    OrderItem = apps.get_model('shopapp', 'OrderItem')
+    BasketItem = apps.get_model('shopapp', 'BasketItem')
+    items_by_basket = {}
+    basket_items = BasketItem.objects.select_related('product').prefetch_related(
+        'product__images', 'product__tags'
+    )
+    for item in basket_items.iterator(chunk_size=500):
+        product = item.product
+        items_by_basket.setdefault(item.basket_id, []).append(dict(
+            product_id=product.pk,
+            category_id=product.category_id,
+            title=product.title,
+            description=product.description,
+            price=product.price,
+            quantity=item.quantity,
+            date=product.date,
+            freeDelivery=product.freeDelivery,
+            images=[{"src": image.image.url, "alt": image.image.name} for image in product.images.all()],
+            tags=[{"id": tag.pk, "name": tag.name} for tag in product.tags.all()],
+            reviews=product.reviews_count,
+            rating=product.rating,
+        ))
+    order_items = [
+        OrderItem(order_id=order_id, **fields)
+        for order_id, basket_id in Order.objects.values_list('id', 'basket_id').iterator()
+        for fields in items_by_basket.get(basket_id, [])
+    ]
+    OrderItem.objects.bulk_create(order_items, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0014_basketitem_unique_product'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(max_length=200, verbose_name='Название продукта')),
+                ('description', models.TextField(blank=True)),
+                ('price', models.DecimalField(decimal_places=2, max_digits=8, verbose_name='Цена')),
+                ('quantity', models.PositiveIntegerField(verbose_name='Количество')),
+                ('date', models.DateTimeField(verbose_name='Дата создания продукта')),
+                ('freeDelivery', models.BooleanField(default=True)),
+                ('images', models.JSONField(default=list)),
+                ('tags', models.JSONField(default=list)),
+                ('reviews', models.PositiveIntegerField(default=0)),
+                ('rating', models.DecimalField(decimal_places=2, default=0.0, max_digits=3)),
+                ('category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='shopapp.category')),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='shopapp.order')),
+                ('product', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='order_items', to='shopapp.product')),
+            ],
+            options={
+                'verbose_name': 'Товар заказа',
+                'verbose_name_plural': 'Товары заказа',
+            },
+        ),
+        migrations.RunPython(fill_order_items, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.5 on 2026-10-18 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0015_orderitem'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['full_name', '-created_at', '-id'], name='shopapp_order_history'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.5 on 2026-10-18 09:14
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0016_order_history_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockReservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('state', models.CharField(choices=[('reserved', 'Зарезервирован'), ('confirmed', 'Подтверждён оплатой'), ('released', 'Снят')], default='reserved', max_length=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('expires_at', models.DateTimeField(verbose_name='Действует до')),
+                ('order', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='reservation', to='shopapp.order')),
+            ],
+            options={
+                'verbose_name': 'Резерв товаров',
+                'verbose_name_plural': 'Резервы товаров',
+                'indexes': [models.Index(fields=['state', 'expires_at'], name='shopapp_reservation_expiry')],
+            },
+        ),
+    ]
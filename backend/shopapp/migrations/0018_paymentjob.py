@@ -0,0 +1,41 @@
+# Generated by Django 4.2.5 on 2026-10-18 09:17
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0017_stockreservation'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='order',
+            name='status',
+            field=models.CharField(choices=[('inProgress', 'Оформляется'), ('accepted', 'Подтверждён'), ('processing', 'Оплачивается'), ('paid', 'Оплачен'), ('failed', 'Ошибка оплаты')], default='inProgress', max_length=255),
+        ),
+        migrations.CreateModel(
+            name='PaymentJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('card_number', models.CharField(max_length=16)),
+                ('validity_period', models.CharField(max_length=20)),
+                ('state', models.CharField(choices=[('queued', 'В очереди'), ('running', 'Выполняется'), ('done', 'Выполнено'), ('failed', 'Ошибка')], default='queued', max_length=20)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('available_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('locked_by', models.CharField(blank=True, default='', max_length=100)),
+                ('locked_at', models.DateTimeField(blank=True, null=True)),
+                ('error', models.CharField(blank=True, default='', max_length=255)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='payment_jobs', to='shopapp.order')),
+            ],
+            options={
+                'verbose_name': 'Задание на оплату',
+                'verbose_name_plural': 'Задания на оплату',
+                'indexes': [models.Index(fields=['state', 'available_at', 'id'], name='shopapp_paymentjob_queue')],
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.5 on 2026-10-18 09:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0019_image_variants'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IdempotencyKey',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True)),
+                ('fingerprint', models.CharField(max_length=64)),
+                ('state', models.CharField(choices=[('in-flight', 'Выполняется'), ('done', 'Выполнен')], default='in-flight', max_length=20)),
+                ('status', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('content', models.BinaryField(default=b'')),
+                ('headers', models.JSONField(default=dict)),
+                ('cookies', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('expires_at', models.DateTimeField()),
+            ],
+            options={
+                'verbose_name': 'Ключ идемпотентности',
+                'verbose_name_plural': 'Ключи идемпотентности',
+                'indexes': [models.Index(fields=['expires_at'], name='shopapp_idempotency_expiry')],
+            },
+        ),
+    ]
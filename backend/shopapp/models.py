@@ -1,15 +1,62 @@
+from decimal import Decimal
+
 from django.db import models
+from django.db.models import Avg, Count
+from django.utils import timezone
 from django.core.validators import MinValueValidator, MaxValueValidator
+from rest_framework.utils.encoders import JSONEncoder
 
 from myauth.models import ProfileUser
 from django.contrib.auth.models import User
 
 
+class ImageVariantsModel(models.Model):
+    """
+    Модель с картинкой image и её уменьшенными копиями разной ширины
+    (см. shopapp.thumbnails). image_variants хранит имя исходного файла,
+    из которого построены копии, его ширину и имена копий по ширине:
+    {"source": имя, "width": 1600, "widths": {"320": имя копии, ...}}
+    """
+    class Meta:
+        abstract = True
+
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
+
+    def get_variants(self):
+        """Уменьшенные копии текущей картинки: {ширина: имя файла}"""
+        if not self.image or self.image_variants.get("source") != self.image.name:
+            return {}
+        return {int(width): name for width, name in self.image_variants.get("widths", {}).items()}
+
+    def get_srcset(self):
+        """Значение srcset для тега img: копии и исходная картинка с их ширинами"""
+        storage = self.image.storage
+        candidates = [
+            f"{storage.url(name)} {width}w" for width, name in sorted(self.get_variants().items())
+        ]
+        if candidates and self.image_variants.get("width"):
+            candidates.append(f"{self.image.url} {self.image_variants['width']}w")
+        return ", ".join(candidates)
+
+    def get_image(self, alt=None):
+        """Картинка для ответа API; srcset есть, только если копии уже построены"""
+        image = {
+            "src": self.image.url,
+            "alt": self.image.name if alt is None else alt,
+        }
+        srcset = self.get_srcset()
+        if srcset:
+            image["srcset"] = srcset
+        return image
+
+
+# upload_to задаёт только каталог: хранилище заменяет имя файла
+# хэшем его содержимого (см. shopapp.storage)
 def category_image_directory_path(instance: "Category", filename: str):
-    return f"categories/category_{instance.pk}/image/{filename}"
+    return f"categories/{filename}"
 
 
-class Category(models.Model):
+class Category(ImageVariantsModel):
     class Meta:
         verbose_name = "Категория"
         verbose_name_plural = "Категории"
@@ -21,19 +68,12 @@ class Category(models.Model):
         upload_to=category_image_directory_path
     )
 
-    def get_image(self):
-        image = {
-            "src": self.image.url,
-            "alt": self.image.name,
-        }
-        return image
-
 
 def subcategory_image_directory_path(instance: "SubCategory", filename: str):
-    return f"subcategories/subcategory_{instance.pk}/image/{filename}"
+    return f"subcategories/{filename}"
 
 
-class SubCategory(models.Model):
+class SubCategory(ImageVariantsModel):
     class Meta:
         verbose_name = "Подкатегория"
         verbose_name_plural = "Подкатегории"
@@ -50,16 +90,9 @@ class SubCategory(models.Model):
         null=True,
     )
 
-    def get_image(self):
-        image = {
-            "src": self.image.url,
-            "alt": self.image.name,
-        }
-        return image
-
 
 def product_images_directory_path(instance: "Product", filename: str) -> str:
-    return f"products/product_{instance.pk}/image/{filename}"
+    return f"products/{filename}"
 
 
 class Tag(models.Model):
@@ -77,6 +110,10 @@ class Product(models.Model):
         ordering = ['title', 'price']
         verbose_name = "Продукт"
         verbose_name_plural = "Продукты"
+        indexes = [
+            # "самые популярные товары" читаются по индексу, без сортировки таблицы
+            models.Index(fields=['-popularity', 'id'], name='shopapp_product_popularity'),
+        ]
 
     category = models.ForeignKey(Category, on_delete=models.CASCADE)
     subcategory = models.ForeignKey(SubCategory, on_delete=models.CASCADE)
@@ -97,43 +134,83 @@ class Product(models.Model):
         default=0.00,
         validators=[MinValueValidator(0), MaxValueValidator(5)],
     )
+    reviews_count = models.PositiveIntegerField(default=0, verbose_name="Количество отзывов")
     count_of_orders = models.IntegerField(default=0)
+    # количество проданных единиц товара с затуханием по времени (см. shopapp.popularity)
+    popularity = models.FloatField(default=0, verbose_name="Популярность")
 
     def get_image(self):
         """
-        Данный метод возвращает список словарей с адресами картинок продукта
+        Данный метод возвращает список словарей с адресами картинок продукта,
+        использует prefetch_related('images'), если он был выполнен
         """
-        images = ProductImage.objects.filter(product_id=self.pk)
-        return [
-            {"src": image.image.url, "alt": image.image.name} for image in images
-        ]
+        return [image.get_image() for image in self.images.all()]
 
     def get_rating(self):
-        """Метод получения рейтинга продукта по количеству отзывов и их оценок"""
-        reviews = Review.objects.filter(product_id=self.pk).values_list(
-            "rate", flat=True
+        """
+        Метод получения рейтинга продукта. Рейтинг хранится в модели
+        и пересчитывается при каждом изменении отзывов (см. update_rating)
+        """
+        return float(self.rating)
+
+    @staticmethod
+    def calculate_rating(average):
+        """Приводит среднюю оценку к формату поля rating"""
+        return Decimal(str(round(average or 0, 2)))
+
+    @staticmethod
+    def update_rating(product_id):
+        """
+        Пересчитывает рейтинг и количество отзывов продукта
+        одним агрегирующим запросом по его отзывам
+        """
+        aggregate = Review.objects.filter(product_id=product_id).aggregate(
+            average=Avg("rate"), count=Count("id")
+        )
+        Product.objects.filter(pk=product_id).update(
+            rating=Product.calculate_rating(aggregate["average"]),
+            reviews_count=aggregate["count"],
         )
-        if reviews.count() == 0:
-            rating = 0
-            return rating
-        rating = sum(reviews) / reviews.count()
-        return rating
 
     def __str__(self):
         return self.title
 
 
-class ProductImage(models.Model):
+class ProductImage(ImageVariantsModel):
     product = models.ForeignKey(
         Product, on_delete=models.CASCADE, related_name="images"
     )
     image = models.ImageField(upload_to=product_images_directory_path)
 
 
+class ProductDailySales(models.Model):
+    """
+    Количество проданных единиц товара за день.
+    Используется для расчёта популярности за скользящее окно
+    """
+    class Meta:
+        verbose_name = "Продажи товара за день"
+        verbose_name_plural = "Продажи товаров по дням"
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'day'], name='shopapp_product_daily_sales_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['day'], name='shopapp_daily_sales_day'),
+        ]
+
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="daily_sales")
+    day = models.DateField()
+    quantity = models.PositiveIntegerField(default=0)
+
+
 class Review(models.Model):
     class Meta:
         verbose_name = "Отзыв"
         verbose_name_plural = "Отзывы"
+        indexes = [
+            # постраничный вывод отзывов товара, начиная с новых
+            models.Index(fields=['product', '-date', '-id'], name='shopapp_review_product_date'),
+        ]
 
     author = models.ForeignKey(ProfileUser, on_delete=models.CASCADE)
     text = models.TextField(blank=True, null=True)
@@ -162,11 +239,28 @@ class Specification(models.Model):
         return f"{self.name}: {self.value}"
 
 
+class SaleQuerySet(models.QuerySet):
+    def active(self, day=None):
+        """
+        Распродажи, действующие в указанный день (по умолчанию - сегодня).
+        Выбираются по индексу (date_to, id) без просмотра закончившихся
+        """
+        day = day or timezone.localdate()
+        return self.filter(date_to__gte=day, date_from__lte=day)
+
+
 class Sale(models.Model):
     """
     Модель товаров, подлежащих распродаже с какого-то по какое-то числа,
     с такой-то скидкой
     """
+    class Meta:
+        indexes = [
+            models.Index(fields=['date_to', 'id'], name='shopapp_sale_date_to'),
+        ]
+
+    objects = SaleQuerySet.as_manager()
+
     product = models.OneToOneField(Product, on_delete=models.CASCADE, related_name='sale_info')
     date_from = models.DateField()
     date_to = models.DateField()
@@ -188,6 +282,12 @@ class BasketItem(models.Model):
         Модель корзины с товарами, имеющая какое-то количество товаров,
         по умолчанию - 1 товар.
     """
+    class Meta:
+        constraints = [
+            # одна строка на товар в корзине, на этом индексе строится UPSERT
+            models.UniqueConstraint(fields=['basket', 'product'], name='shopapp_basketitem_unique_product'),
+        ]
+
     basket = models.ForeignKey(Basket, on_delete=models.CASCADE, related_name="baskets")
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="products")
     quantity = models.PositiveIntegerField(default=1)
@@ -197,6 +297,10 @@ class Order(models.Model):
     class Meta:
         verbose_name = "Заказ"
         verbose_name_plural = "Заказы"
+        indexes = [
+            # история заказов покупателя читается по индексу от новых к старым
+            models.Index(fields=['full_name', '-created_at', '-id'], name='shopapp_order_history'),
+        ]
     DELIVERY_OPTIONS = (
         ("delivery", "Доставка"),
         ("express", "Экспресс доставка"),
@@ -206,6 +310,25 @@ class Order(models.Model):
         ("online_any", "Онлайн оплата со случайного счета"),
 
     )
+    IN_PROGRESS = "inProgress"
+    ACCEPTED = "accepted"
+    PROCESSING = "processing"
+    PAID = "paid"
+    FAILED = "failed"
+    STATUS_OPTIONS = (
+        (IN_PROGRESS, "Оформляется"),
+        (ACCEPTED, "Подтверждён"),
+        (PROCESSING, "Оплачивается"),
+        (PAID, "Оплачен"),
+        (FAILED, "Ошибка оплаты"),
+    )
+    # допустимые переходы: новый статус -> статусы, из которых в него можно перейти
+    STATUS_TRANSITIONS = {
+        ACCEPTED: (IN_PROGRESS, ACCEPTED),
+        PROCESSING: (ACCEPTED, FAILED),
+        PAID: (PROCESSING,),
+        FAILED: (PROCESSING,),
+    }
 
     full_name = models.ForeignKey(ProfileUser, on_delete=models.CASCADE, verbose_name="Покупатель")
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")
@@ -220,12 +343,80 @@ class Order(models.Model):
         decimal_places=2,
         verbose_name="Итоговая сумма заказа",
     )
-    status = models.CharField(max_length=255, default="inProgress")
+    status = models.CharField(max_length=255, choices=STATUS_OPTIONS, default=IN_PROGRESS)
     basket = models.ForeignKey(
         Basket, on_delete=models.CASCADE, related_name="orders", default=None
     )
     payment_error = models.CharField(max_length=255, blank=True, default="")
 
+    @classmethod
+    def change_status(cls, order_id, status, **fields):
+        """
+        Переводит заказ в новый статус (и обновляет fields) одним условным
+        UPDATE, если текущий статус это допускает. Возвращает False,
+        если переход недопустим, в том числе когда статус заказа
+        одновременно изменил другой запрос или обработчик
+        """
+        return bool(cls.objects.filter(
+            pk=order_id, status__in=cls.STATUS_TRANSITIONS[status]
+        ).update(status=status, **fields))
+
+
+class OrderItem(models.Model):
+    """
+    Товар заказа: копия данных товара и его количества на момент
+    оформления заказа. Заказ показывается по этим данным, поэтому
+    не меняется вместе с каталогом и после очистки корзины.
+    """
+    class Meta:
+        verbose_name = "Товар заказа"
+        verbose_name_plural = "Товары заказа"
+
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name="items")
+    product = models.ForeignKey(
+        Product, on_delete=models.SET_NULL, null=True, blank=True, related_name="order_items"
+    )
+    category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True, blank=True)
+    title = models.CharField(max_length=200, verbose_name="Название продукта")
+    description = models.TextField(blank=True)
+    price = models.DecimalField(max_digits=8, decimal_places=2, verbose_name="Цена")
+    quantity = models.PositiveIntegerField(verbose_name="Количество")
+    date = models.DateTimeField(verbose_name="Дата создания продукта")
+    freeDelivery = models.BooleanField(default=True)
+    images = models.JSONField(default=list)
+    tags = models.JSONField(default=list)
+    reviews = models.PositiveIntegerField(default=0)
+    rating = models.DecimalField(max_digits=3, decimal_places=2, default=0.00)
+
+
+class StockReservation(models.Model):
+    """
+    Резерв товаров заказа на складе. Товары списываются со склада при
+    оформлении заказа; если заказ не оплачен до expires_at, резерв
+    снимается и товары возвращаются на склад (см. shopapp.stock)
+    """
+    RESERVED = "reserved"
+    CONFIRMED = "confirmed"
+    RELEASED = "released"
+    STATES = (
+        (RESERVED, "Зарезервирован"),
+        (CONFIRMED, "Подтверждён оплатой"),
+        (RELEASED, "Снят"),
+    )
+
+    class Meta:
+        verbose_name = "Резерв товаров"
+        verbose_name_plural = "Резервы товаров"
+        indexes = [
+            # поиск просроченных резервов
+            models.Index(fields=['state', 'expires_at'], name='shopapp_reservation_expiry'),
+        ]
+
+    order = models.OneToOneField(Order, on_delete=models.CASCADE, related_name="reservation")
+    state = models.CharField(max_length=20, choices=STATES, default=RESERVED)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(verbose_name="Действует до")
+
 
 class DeliveryPrice(models.Model):
     class Meta:
@@ -258,3 +449,100 @@ class Payment(models.Model):
     card_number = models.CharField(max_length=16)
     validity_period = models.CharField(max_length=20)
     success = models.BooleanField(default=False)
+
+
+class PaymentJob(models.Model):
+    """
+    Задание на оплату заказа в очереди, хранящейся в базе данных.
+    Задания выполняются командой run_payment_worker (см. shopapp.payments)
+    """
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATES = (
+        (QUEUED, "В очереди"),
+        (RUNNING, "Выполняется"),
+        (DONE, "Выполнено"),
+        (FAILED, "Ошибка"),
+    )
+
+    class Meta:
+        verbose_name = "Задание на оплату"
+        verbose_name_plural = "Задания на оплату"
+        indexes = [
+            # выбор следующего задания из очереди
+            models.Index(fields=['state', 'available_at', 'id'], name='shopapp_paymentjob_queue'),
+        ]
+
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name="payment_jobs")
+    card_number = models.CharField(max_length=16)
+    validity_period = models.CharField(max_length=20)
+    state = models.CharField(max_length=20, choices=STATES, default=QUEUED)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # задание не выбирается из очереди раньше этого времени (повтор после ошибки)
+    available_at = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=100, blank=True, default="")
+    locked_at = models.DateTimeField(null=True, blank=True)
+    error = models.CharField(max_length=255, blank=True, default="")
+
+
+class IdempotencyKey(models.Model):
+    """
+    Запрос с заголовком Idempotency-Key и сохранённый ответ на него
+    (см. shopapp.idempotency). Хранится в базе данных, чтобы повтор
+    запроса, попавший в другой процесс, получил тот же ответ
+    """
+    class Meta:
+        verbose_name = "Ключ идемпотентности"
+        verbose_name_plural = "Ключи идемпотентности"
+        indexes = [
+            # удаление просроченных ключей
+            models.Index(fields=['expires_at'], name='shopapp_idempotency_expiry'),
+        ]
+
+    IN_FLIGHT = "in-flight"
+    DONE = "done"
+    STATES = [
+        (IN_FLIGHT, "Выполняется"),
+        (DONE, "Выполнен"),
+    ]
+
+    # хэш пользователя, метода, адреса и ключа из заголовка
+    key = models.CharField(max_length=64, unique=True)
+    # хэш тела запроса
+    fingerprint = models.CharField(max_length=64)
+    state = models.CharField(max_length=20, choices=STATES, default=IN_FLIGHT)
+    status = models.PositiveSmallIntegerField(null=True, blank=True)
+    content = models.BinaryField(default=b"")
+    headers = models.JSONField(default=dict)
+    cookies = models.TextField(blank=True, default="")
+    created_at = models.DateTimeField(auto_now_add=True)
+    # выполняющийся запрос - время, после которого ключ можно занять заново,
+    # выполненный - время, до которого повторяется ответ
+    expires_at = models.DateTimeField()
+
+
+class HomeFeed(models.Model):
+    """
+    Предварительно рассчитанная подборка товаров для главной страницы
+    (баннеры, популярные и ограниченные товары) в виде готового ответа API.
+    Снимок перестраивается, если версия данных каталога изменилась
+    с момента его построения (см. shopapp.feeds).
+    """
+    class Meta:
+        verbose_name = "Подборка главной страницы"
+        verbose_name_plural = "Подборки главной страницы"
+
+    BANNERS = "banners"
+    POPULAR = "popular"
+    LIMITED = "limited"
+
+    name = models.CharField(max_length=50, unique=True)
+    items = models.JSONField(default=list, encoder=JSONEncoder)
+    version = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.name
@@ -0,0 +1,118 @@
+"""
+Оформление заказов.
+
+Заказ создаётся одной транзакцией за постоянное число запросов,
+не зависящее от количества товаров в корзине: товары корзины копируются
+в OrderItem одним bulk_create, списываются со склада в резерв заказа
+одним условным UPDATE (см. shopapp.stock), сумма заказа считается
+в базе данных. Заказ затем читается только из OrderItem и не зависит
+от последующих изменений каталога и корзины.
+
+Транзакция начинается с записи (INSERT заказа): SQLite не может
+повысить читающую транзакцию до пишущей, пока пишет другой процесс,
+и сразу завершает такую транзакцию ошибкой "database is locked".
+"""
+from django.db import transaction
+from django.db.models import DecimalField, F, Sum
+
+from . import cache
+from .config import get_delivery_price
+from .models import BasketItem, Order, OrderItem, Payment
+from .popularity import record_sales
+from .stock import confirm_reservation, get_order_quantities, reserve_stock
+
+
+class PaymentConflict(Exception):
+    """
+    Исключение, возникающее при оплате заказа, резерв товаров
+    которого уже подтверждён другой оплатой
+    """
+
+
+def get_order_total(order):
+    """Стоимость товаров заказа, посчитанная в базе данных"""
+    total = OrderItem.objects.filter(order=order).aggregate(
+        total=Sum(
+            F('quantity') * F('price'),
+            output_field=DecimalField(max_digits=10, decimal_places=2),
+        )
+    )['total']
+    return total or 0
+
+
+def get_delivery_cost(total_cost, delivery_price):
+    """Стоимость обычной доставки: бесплатно начиная с минимальной суммы"""
+    if total_cost > delivery_price.delivery_free_minimum_cost:
+        return 0
+    return delivery_price.delivery_cost
+
+
+def snapshot_item(order, basket_item):
+    """Копия товара корзины для заказа"""
+    product = basket_item.product
+    return OrderItem(
+        order=order,
+        product=product,
+        category_id=product.category_id,
+        title=product.title,
+        description=product.description,
+        price=product.price,
+        quantity=basket_item.quantity,
+        date=product.date,
+        freeDelivery=product.freeDelivery,
+        images=product.get_image(),
+        tags=[{"id": tag.pk, "name": tag.name} for tag in product.tags.all()],
+        reviews=product.reviews_count,
+        rating=product.rating,
+    )
+
+
+def create_order(profile, basket):
+    """
+    Создаёт заказ из товаров корзины и резервирует их на складе.
+    Если товаров не хватает, выбрасывает InsufficientStock,
+    и заказ не создаётся
+    """
+    with transaction.atomic():
+        order = Order.objects.create(full_name=profile, basket=basket)
+        basket_items = BasketItem.objects.filter(basket=basket).select_related('product').prefetch_related(
+            'product__images', 'product__tags'
+        )
+        order_items = OrderItem.objects.bulk_create(
+            [snapshot_item(order, item) for item in basket_items]
+        )
+        Order.products.through.objects.bulk_create([
+            Order.products.through(order_id=order.pk, product_id=item.product_id)
+            for item in order_items
+        ])
+        reserve_stock(order, {item.product_id: item.quantity for item in order_items})
+        total_cost = get_order_total(order)
+        order.totalCost = total_cost + get_delivery_cost(total_cost, get_delivery_price())
+        Order.objects.filter(pk=order.pk).update(totalCost=order.totalCost)
+    return order
+
+
+def pay_order(order, card_number, validity_period):
+    """
+    Оплачивает заказ в статусе "processing": переводит его в статус
+    "paid", подтверждает резерв товаров, сохраняет платёж и учитывает
+    продажи. Возвращает платёж или None, если заказ не ожидает оплаты
+    (например, уже оплачен). Если резерв истёк и товаров больше
+    не хватает, выбрасывает InsufficientStock, если резерв уже
+    подтверждён - PaymentConflict; в обоих случаях статус не меняется
+    """
+    quantities = get_order_quantities(order.pk)
+    with transaction.atomic():
+        if not Order.change_status(order.pk, Order.PAID):
+            return None
+        order.status = Order.PAID
+        if not confirm_reservation(order, quantities):
+            # исключение откатывает смену статуса
+            raise PaymentConflict(order.pk)
+        payment = Payment.objects.create(
+            order=order, card_number=card_number, validity_period=validity_period, success=True
+        )
+        # учитываем продажи в популярности товаров
+        record_sales(quantities)
+    cache.bump_version(cache.HOME_FEEDS)
+    return payment
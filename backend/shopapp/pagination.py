@@ -0,0 +1,121 @@
+"""
+Курсорная (keyset) пагинация.
+
+В отличие от django.core.paginator.Paginator не выполняет COUNT(*)
+и не использует OFFSET: следующая страница выбирается условием
+"строго после последней записи предыдущей страницы" по полям сортировки,
+поэтому глубокие страницы обходятся так же дёшево, как первая.
+"""
+import base64
+import binascii
+import datetime
+import json
+
+from django.core.exceptions import FieldError, ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from rest_framework import exceptions
+
+# диапазон целых чисел, которые принимает база (BigIntegerField)
+MIN_INTEGER = -2 ** 63
+MAX_INTEGER = 2 ** 63 - 1
+
+
+class InvalidCursor(exceptions.ValidationError):
+    """
+    Исключение, возникающее при разборе повреждённого курсора.
+    DRF превращает его в ответ 400
+    """
+    default_detail = "Некорректный курсор"
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    """
+    DjangoJSONEncoder округляет время до миллисекунд, а курсору
+    нужно точное значение, иначе записи на границе страниц теряются
+    """
+
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def encode_cursor(values):
+    """Упаковывает значения полей сортировки в строку курсора"""
+    data = json.dumps(values, cls=CursorEncoder).encode()
+    return base64.urlsafe_b64encode(data).decode()
+
+
+def decode_cursor(cursor):
+    """Распаковывает строку курсора в список значений полей сортировки"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, UnicodeError, ValueError):
+        raise InvalidCursor()
+    if not isinstance(values, list):
+        raise InvalidCursor()
+    for value in values:
+        # вложенные списки и словари не подходят ни к одному полю, а слишком
+        # большие числа проходят filter() и ломают запрос при подстановке в SQL
+        if isinstance(value, (list, dict)):
+            raise InvalidCursor()
+        if isinstance(value, int) and not MIN_INTEGER <= value <= MAX_INTEGER:
+            raise InvalidCursor()
+    return values
+
+
+class KeysetPaginator:
+    """
+    Пагинатор, выбирающий страницы по курсору.
+
+    ordering - список полей сортировки в формате order_by
+    ("-price", "-id"), последнее поле должно быть уникальным,
+    чтобы порядок записей был однозначным.
+    """
+
+    def __init__(self, queryset, ordering, limit):
+        self.queryset = queryset.order_by(*ordering)
+        self.ordering = ordering
+        # пустая страница не даёт курсора, а отрицательный срез не поддерживается
+        self.limit = max(1, limit)
+
+    def _after(self, values):
+        """
+        Условие "запись идёт после записи с values":
+        (f1 > v1) OR (f1 = v1 AND f2 > v2) OR ...
+        """
+        if len(values) != len(self.ordering):
+            raise InvalidCursor()
+        condition = Q()
+        equal = Q()
+        for field, value in zip(self.ordering, values):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= equal & Q(**{f"{name}__{lookup}": value})
+            equal &= Q(**{name: value})
+        return condition
+
+    def _values(self, obj):
+        return [getattr(obj, field.lstrip('-')) for field in self.ordering]
+
+    def get_page(self, cursor=None):
+        """
+        Возвращает записи страницы и курсор следующей страницы
+        (None, если страница последняя)
+        """
+        queryset = self.queryset
+        if cursor:
+            try:
+                queryset = queryset.filter(self._after(decode_cursor(cursor)))
+            except (ValidationError, ValueError, TypeError, FieldError):
+                # значения курсора не подходят к типам полей сортировки
+                # (строка вместо числа, null и т.д.)
+                raise InvalidCursor()
+        # берем на одну запись больше, чтобы узнать, есть ли следующая страница
+        items = list(queryset[:self.limit + 1])
+        next_cursor = None
+        if len(items) > self.limit:
+            items = items[:self.limit]
+            next_cursor = encode_cursor(self._values(items[-1]))
+        return items, next_cursor
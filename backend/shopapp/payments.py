@@ -0,0 +1,145 @@
+"""
+Асинхронная оплата заказов.
+
+Запрос на оплату только проверяет данные карты, переводит заказ
+в статус "processing" и ставит задание PaymentJob в очередь, хранящуюся
+в базе данных, после чего сразу возвращает ответ. Задания выполняет
+команда run_payment_worker; обработчиков можно запустить сколько угодно
+в разных процессах и на разных машинах: задание забирается условным
+UPDATE по его состоянию, поэтому каждое выполняется одним обработчиком.
+
+Статусы заказа: inProgress -> accepted -> processing -> paid/failed,
+из failed заказ можно снова отправить на оплату (см. Order.STATUS_TRANSITIONS).
+"""
+import logging
+import os
+import socket
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import BasketItem, Order, PaymentJob
+from .orders import PaymentConflict, pay_order
+from .stock import InsufficientStock, get_order_quantities
+
+log = logging.getLogger(__name__)
+
+
+class PaymentDeclined(Exception):
+    """Исключение, возникающее, когда платёж отклонён"""
+
+
+def get_worker_name():
+    """Имя обработчика для поля PaymentJob.locked_by"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def enqueue_payment(order, card_number, validity_period):
+    """
+    Отправляет заказ на оплату. Возвращает задание или None,
+    если в текущем статусе заказ оплатить нельзя
+    """
+    with transaction.atomic():
+        if not Order.change_status(order.pk, Order.PROCESSING, payment_error=""):
+            return None
+        return PaymentJob.objects.create(
+            order=order, card_number=card_number, validity_period=validity_period
+        )
+
+
+def claim_payment_job(worker_name, now=None):
+    """
+    Забирает следующее задание из очереди. Задание, обработчик
+    которого не отчитался за settings.PAYMENT_JOB_TIMEOUT секунд,
+    считается брошенным и выдаётся снова. Возвращает None,
+    если очередь пуста
+    """
+    now = now or timezone.now()
+    stale = now - timedelta(seconds=settings.PAYMENT_JOB_TIMEOUT)
+    available = (
+        Q(state=PaymentJob.QUEUED, available_at__lte=now)
+        | Q(state=PaymentJob.RUNNING, locked_at__lt=stale)
+    )
+    while True:
+        candidate = PaymentJob.objects.filter(available).order_by('available_at', 'id').values_list(
+            'pk', 'state', 'locked_at'
+        ).first()
+        if candidate is None:
+            return None
+        job_id, state, locked_at = candidate
+        # задание достаётся тому, чей UPDATE застал его в прежнем состоянии
+        claimed = PaymentJob.objects.filter(pk=job_id, state=state, locked_at=locked_at).update(
+            state=PaymentJob.RUNNING, locked_by=worker_name, locked_at=now, attempts=F('attempts') + 1,
+        )
+        if claimed:
+            return PaymentJob.objects.select_related('order').get(pk=job_id)
+
+
+def authorize_payment(job):
+    """
+    Проверка платежа на стороне банка. Учебный банк отклоняет
+    нечётные номера карт длиннее восьми цифр
+    """
+    card_number = job.card_number.strip()
+    if len(card_number) > 8 and int(card_number) % 2 != 0:
+        raise PaymentDeclined("Неверный номер банковской карты")
+
+
+def fail_payment(job, error):
+    with transaction.atomic():
+        Order.change_status(job.order_id, Order.FAILED, payment_error=error)
+        PaymentJob.objects.filter(pk=job.pk).update(state=PaymentJob.FAILED, error=error)
+
+
+def process_payment_job(job):
+    """Выполняет забранное из очереди задание на оплату"""
+    try:
+        authorize_payment(job)
+        payment = pay_order(job.order, job.card_number, job.validity_period)
+    except PaymentDeclined as error:
+        fail_payment(job, str(error))
+        return
+    except InsufficientStock:
+        fail_payment(job, "Недостаточно товаров в наличии")
+        return
+    except PaymentConflict:
+        # заказ уже оплачен другим платежом, его статус не трогаем
+        log.error("Резерв товаров заказа %s уже подтверждён", job.order_id)
+        PaymentJob.objects.filter(pk=job.pk).update(
+            state=PaymentJob.FAILED, error="Заказ уже оплачен"
+        )
+        return
+    except Exception as error:
+        log.exception("Ошибка при оплате заказа %s", job.order_id)
+        if job.attempts >= settings.PAYMENT_JOB_MAX_ATTEMPTS:
+            fail_payment(job, "Ошибка при оплате")
+        else:
+            # повторяем позже, задержка растёт с каждой попыткой
+            PaymentJob.objects.filter(pk=job.pk).update(
+                state=PaymentJob.QUEUED,
+                available_at=timezone.now() + timedelta(seconds=2 ** job.attempts),
+                error=str(error)[:255],
+            )
+        return
+    if payment is not None:
+        # убираем из корзины оплаченные товары
+        BasketItem.objects.filter(
+            basket_id=job.order.basket_id, product_id__in=get_order_quantities(job.order_id)
+        ).delete()
+    PaymentJob.objects.filter(pk=job.pk).update(state=PaymentJob.DONE)
+
+
+def run_pending_jobs(worker_name=None, limit=None):
+    """Выполняет задания из очереди, пока она не опустеет, возвращает их количество"""
+    worker_name = worker_name or get_worker_name()
+    count = 0
+    while limit is None or count < limit:
+        job = claim_payment_job(worker_name)
+        if job is None:
+            break
+        process_payment_job(job)
+        count += 1
+    return count
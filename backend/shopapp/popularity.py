@@ -0,0 +1,70 @@
+"""
+Популярность товаров по реальному объёму продаж.
+
+При оплате заказа количество проданных единиц атомарно добавляется
+к счётчикам товара (count_of_orders, popularity) и к дневной статистике
+ProductDailySales. Команда update_popularity периодически пересчитывает
+popularity по скользящему окну с экспоненциальным затуханием, так что
+старые продажи постепенно теряют вес. Список популярных товаров
+читается по индексу (-popularity, id).
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .db import add_per_row
+from .models import Product, ProductDailySales
+
+
+def record_sales(quantities, day=None):
+    """
+    Учитывает продажу товаров: quantities - словарь {id товара: количество}.
+    Все счётчики увеличиваются выражениями F() в одной транзакции,
+    поэтому одновременные оплаты не теряют продажи друг друга.
+    """
+    quantities = {product_id: quantity for product_id, quantity in quantities.items() if quantity > 0}
+    if not quantities:
+        return
+    day = day or timezone.localdate()
+    with transaction.atomic():
+        Product.objects.filter(pk__in=quantities).update(
+            count_of_orders=add_per_row('count_of_orders', quantities),
+            popularity=add_per_row('popularity', quantities),
+        )
+        ProductDailySales.objects.bulk_create(
+            [ProductDailySales(product_id=product_id, day=day) for product_id in quantities],
+            ignore_conflicts=True,
+        )
+        ProductDailySales.objects.filter(day=day, product_id__in=quantities).update(
+            quantity=add_per_row('quantity', quantities, key='product_id')
+        )
+
+
+def recompute_popularity(today=None, window_days=None, half_life_days=None):
+    """
+    Пересчитывает popularity всех товаров по продажам за последние
+    window_days дней. Продажа, сделанная half_life_days дней назад,
+    весит вдвое меньше сегодняшней (без затухания, если период не задан).
+    Возвращает количество товаров с ненулевой популярностью.
+    """
+    today = today or timezone.localdate()
+    if window_days is None:
+        window_days = settings.POPULARITY_WINDOW_DAYS
+    if half_life_days is None:
+        half_life_days = settings.POPULARITY_HALF_LIFE_DAYS
+
+    sales = ProductDailySales.objects.filter(
+        day__gt=today - timedelta(days=window_days)
+    ).values_list('product_id', 'day', 'quantity')
+    scores = {}
+    for product_id, day, quantity in sales.iterator():
+        weight = 0.5 ** ((today - day).days / half_life_days) if half_life_days else 1
+        scores[product_id] = scores.get(product_id, 0) + quantity * weight
+
+    products = [Product(pk=product_id, popularity=score) for product_id, score in scores.items()]
+    with transaction.atomic():
+        Product.objects.filter(popularity__gt=0).update(popularity=0)
+        Product.objects.bulk_update(products, ['popularity'], batch_size=500)
+    return len(products)
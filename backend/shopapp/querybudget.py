@@ -0,0 +1,44 @@
+"""
+Контроль количества SQL-запросов, выполняемых участком кода.
+
+Проверка включается настройкой QUERY_BUDGET_ENABLED (в тестах и
+на staging-сервере), в боевом режиме контекстный менеджер ничего
+не делает и не влияет на производительность.
+"""
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection
+
+
+class QueryBudgetExceeded(AssertionError):
+    """
+    Исключение, возникающее если участок кода выполнил
+    больше запросов, чем ему разрешено
+    """
+
+
+@contextmanager
+def query_budget(limit, label="query budget"):
+    """
+    Контекстный менеджер, подсчитывающий запросы к базе данных
+    и выбрасывающий QueryBudgetExceeded при превышении limit.
+    Возвращает список выполненных SQL-запросов.
+    """
+    executed = []
+    if not getattr(settings, "QUERY_BUDGET_ENABLED", False):
+        yield executed
+        return
+
+    def count_queries(execute, sql, params, many, context):
+        executed.append(sql)
+        return execute(sql, params, many, context)
+
+    with connection.execute_wrapper(count_queries):
+        yield executed
+
+    if len(executed) > limit:
+        raise QueryBudgetExceeded(
+            f"{label}: выполнено {len(executed)} запросов при лимите {limit}:\n"
+            + "\n".join(executed)
+        )
@@ -0,0 +1,178 @@
+"""
+Полнотекстовый поиск товаров.
+
+На SQLite используется виртуальная таблица FTS5 по названию, описанию
+и тегам товара. Индекс поддерживается триггерами базы данных, поэтому
+остаётся согласованным при любой записи в Product, Tag и связь товара
+с тегами (в том числе из админки и через bulk-операции).
+На остальных СУБД поиск сводится к icontains.
+"""
+import re
+
+from django.db import connection, connections
+from django.db.models import Q
+
+FTS_TABLE = "shopapp_product_fts"
+
+# тексты тегов товара, склеенные через пробел
+_PRODUCT_TAGS_SQL = (
+    "SELECT group_concat(shopapp_tag.name, ' ') FROM shopapp_tag "
+    "JOIN shopapp_product_tags ON shopapp_product_tags.tag_id = shopapp_tag.id "
+    "WHERE shopapp_product_tags.product_id = {product_id}"
+)
+
+INSTALL_SQL = [
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        title, description, tags,
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '2 3'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_product_insert
+    AFTER INSERT ON shopapp_product BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, title, description, tags)
+        VALUES (new.id, new.title, new.description, '');
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_product_update
+    AFTER UPDATE OF title, description ON shopapp_product BEGIN
+        UPDATE {FTS_TABLE} SET title = new.title, description = new.description
+        WHERE rowid = new.id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_product_delete
+    AFTER DELETE ON shopapp_product BEGIN
+        DELETE FROM {FTS_TABLE} WHERE rowid = old.id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_product_tags_insert
+    AFTER INSERT ON shopapp_product_tags BEGIN
+        UPDATE {FTS_TABLE}
+        SET tags = coalesce(({_PRODUCT_TAGS_SQL.format(product_id="new.product_id")}), '')
+        WHERE rowid = new.product_id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_product_tags_delete
+    AFTER DELETE ON shopapp_product_tags BEGIN
+        UPDATE {FTS_TABLE}
+        SET tags = coalesce(({_PRODUCT_TAGS_SQL.format(product_id="old.product_id")}), '')
+        WHERE rowid = old.product_id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_tag_update
+    AFTER UPDATE OF name ON shopapp_tag BEGIN
+        UPDATE {FTS_TABLE}
+        SET tags = coalesce(({_PRODUCT_TAGS_SQL.format(product_id=f"{FTS_TABLE}.rowid")}), '')
+        WHERE rowid IN (
+            SELECT product_id FROM shopapp_product_tags WHERE tag_id = new.id
+        );
+    END
+    """,
+]
+
+UNINSTALL_SQL = [
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_product_insert",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_product_update",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_product_delete",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_product_tags_insert",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_product_tags_delete",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_tag_update",
+    f"DROP TABLE IF EXISTS {FTS_TABLE}",
+]
+
+REBUILD_SQL = [
+    f"DELETE FROM {FTS_TABLE}",
+    f"""
+    INSERT INTO {FTS_TABLE}(rowid, title, description, tags)
+    SELECT shopapp_product.id, shopapp_product.title, shopapp_product.description,
+           coalesce(({_PRODUCT_TAGS_SQL.format(product_id="shopapp_product.id")}), '')
+    FROM shopapp_product
+    """,
+]
+
+
+def is_supported(using=connection):
+    return using.vendor == "sqlite"
+
+
+def install_search_index(using=connection):
+    """
+    Создаёт таблицу индекса и триггеры, если их ещё нет.
+    Вызывается после каждой миграции: SQLite пересоздаёт таблицу
+    при изменении её схемы, и триггеры на старой таблице теряются.
+    """
+    if not is_supported(using):
+        return
+    tables = using.introspection.table_names()
+    if "shopapp_product" not in tables or "shopapp_product_tags" not in tables:
+        return
+    with using.cursor() as cursor:
+        for sql in INSTALL_SQL:
+            cursor.execute(sql)
+
+
+def install_search_index_after_migrate(sender, using, **kwargs):
+    """Обработчик сигнала post_migrate"""
+    install_search_index(connections[using])
+
+
+def uninstall_search_index(using=connection):
+    """Удаляет таблицу индекса и триггеры"""
+    if not is_supported(using):
+        return
+    with using.cursor() as cursor:
+        for sql in UNINSTALL_SQL:
+            cursor.execute(sql)
+
+
+def rebuild_search_index(using=connection):
+    """Полностью перестраивает индекс по текущему содержимому таблиц"""
+    if not is_supported(using):
+        return
+    install_search_index(using)
+    with using.cursor() as cursor:
+        for sql in REBUILD_SQL:
+            cursor.execute(sql)
+
+
+def build_match_query(text):
+    """
+    Превращает пользовательский ввод в запрос FTS5: каждое слово
+    ищется по префиксу, все слова должны присутствовать.
+    Спецсимволы синтаксиса FTS5 при этом отбрасываются.
+    """
+    words = re.findall(r"\w+", text)
+    return " ".join(f'"{word}"*' for word in words)
+
+
+def search_products(products, text):
+    """
+    Фильтрует queryset товаров по поисковому запросу и добавляет
+    к каждому товару релевантность search_rank (меньше - лучше),
+    по которой можно сортировать вместе с остальными фильтрами каталога.
+    Возвращает пару (queryset, применён ли поиск): в запросе без единого
+    слова (например, "!!!") искать нечего, и search_rank не добавляется
+    """
+    match = build_match_query(text)
+    if not match:
+        return products, False
+    if not is_supported():
+        return products.filter(
+            Q(title__icontains=text) | Q(description__icontains=text)
+        ).extra(select={"search_rank": "0"}), True
+    return products.extra(
+        select={"search_rank": f"{FTS_TABLE}.rank"},
+        tables=[FTS_TABLE],
+        where=[
+            f"{FTS_TABLE}.rowid = shopapp_product.id",
+            f"{FTS_TABLE} MATCH %s",
+        ],
+        params=[match],
+    ), True
@@ -1,33 +1,42 @@
 from rest_framework import serializers
+from .pagination import KeysetPaginator
 from .models import (
     Product, Tag, Review, ProductImage, Specification, BasketItem, Order
 )
 
 
+# отзывы выводятся начиная с новых
+REVIEWS_ORDERING = ['-date', '-id']
+ORDERS_ORDERING = ['-created_at', '-id']
+
+
 class ProductSerializer(serializers.ModelSerializer):
+    """
+    Сериализатор продукта. Картинки, теги и характеристики берутся
+    через связанные менеджеры, поэтому для списка продуктов следует
+    выполнять prefetch_related('images', 'tags', 'specification')
+    """
     class Meta:
         model = Product
         fields = "__all__"
 
     def to_representation(self, instance):
         rep = super().to_representation(instance)
-        reviews = Review.objects.filter(product_id=instance.id).values_list(
-            "rate", flat=True
-        )
-        tags = Tag.objects.filter(tags__id=instance.id)
-        if reviews.count() == 0:
+        tags = instance.tags.all()
+        # рейтинг и количество отзывов хранятся в модели продукта
+        if instance.reviews_count == 0:
             rating = "Пока нет отзывов"
         else:
-            rating = sum(reviews) / reviews.count()
+            rating = instance.get_rating()
         rep['title'] = instance.title
         rep['price'] = instance.price
         rep['images'] = instance.get_image()
         rep['tags'] = [{"id": tag.pk, "name": tag.name} for tag in tags]
-        rep['reviews'] = reviews.count()
+        rep['reviews'] = instance.reviews_count
         rep['rating'] = rating
 
         rep['id'] = instance.pk
-        rep["category"] = instance.category.pk
+        rep["category"] = instance.category_id
         rep['count'] = instance.count
         rep['date'] = instance.date.strftime("%Y.%m.%d %H:%M")
         rep['description'] = instance.description
@@ -35,6 +44,32 @@ class ProductSerializer(serializers.ModelSerializer):
         return rep
 
 
+class CatalogItemSerializer(serializers.ModelSerializer):
+    """
+    Сериализатор карточки товара в каталоге.
+    Рассчитан на queryset с prefetch_related('images', 'tags'),
+    поэтому не выполняет дополнительных запросов на каждый товар.
+    """
+    class Meta:
+        model = Product
+        fields = "__all__"
+
+    def to_representation(self, instance):
+        return {
+            "id": instance.pk,
+            "category": instance.category_id,
+            "price": instance.price,
+            "count": instance.count,
+            "date": instance.date,
+            "title": instance.title,
+            "description": instance.description,
+            "freeDelivery": instance.freeDelivery,
+            "images": [image.get_image(alt=instance.title) for image in instance.images.all()],
+            "tags": [tag.name for tag in instance.tags.all()],
+            "rating": float(instance.rating),
+        }
+
+
 class ProductImageSerializer(serializers.ModelSerializer):
     class Meta:
         model = ProductImage
@@ -57,29 +92,54 @@ class TagListSerializer(serializers.ModelSerializer):
         fields = ["id", "name"]
 
 
+class ReviewSerializer(serializers.ModelSerializer):
+    """
+    Сериализатор отзыва. Автор отзыва должен быть загружен
+    заранее через select_related('author')
+    """
+    class Meta:
+        model = Review
+        fields = ('author', 'text', 'rate', 'date')
+
+    def to_representation(self, instance):
+        return {
+            'author': f'{instance.author.name} {instance.author.surname}',
+            'email': instance.author.email,
+            'text': instance.text,
+            'rate': instance.rate,
+            'date': instance.date.strftime("%Y.%m.%d %H:%M"),
+        }
+
+
 class DetailsSerializer(ProductSerializer):
+    """
+    Сериализатор карточки товара. Для загрузки фиксированным числом
+    запросов используется shopapp.details.load_product_details
+    """
+    # количество отзывов, встраиваемых в карточку товара,
+    # остальные загружаются постранично через product/<id>/reviews
+    embedded_reviews = 5
+
     def to_representation(self, instance):
         rep = super().to_representation(instance)
-        specifications = Specification.objects.filter(pk=instance.id)
-        reviews = Review.objects.filter(product_id=instance.id)
+        specifications = instance.specification.all()
+        reviews, next_cursor = KeysetPaginator(
+            Review.objects.filter(product_id=instance.id).select_related('author'),
+            REVIEWS_ORDERING,
+            self.embedded_reviews,
+        ).get_page()
 
         rep['specifications'] = [{'name': spec.name, 'value': spec.value} for spec in specifications]
-        rep['reviews'] = [
-            {
-                'author': f'{review.author.name} {review.author.surname}',
-                'email': review.author.email,
-                'text': review.text,
-                'rate': review.rate,
-                'date': review.date.strftime("%Y.%m.%d %H:%M"),
-            }
-            for review in reviews
-        ]
+        rep['reviews'] = ReviewSerializer(reviews, many=True).data
+        rep['reviewsNextCursor'] = next_cursor
         return rep
 
 
 class BasketItemSerializer(serializers.ModelSerializer):
     """
-    Сериализатор для представления корзины и продуктов в ней
+    Сериализатор для представления корзины и продуктов в ней.
+    Рассчитан на queryset из shopapp.basket.get_basket_items:
+    продукт присоединён, картинки и теги загружены заранее
     """
     class Meta:
         model = BasketItem
@@ -88,9 +148,47 @@ class BasketItemSerializer(serializers.ModelSerializer):
         )
 
     def to_representation(self, instance):
-        data = ProductSerializer(instance.product).data
-        data['count'] = instance.quantity
-        return data
+        product = instance.product
+        return {
+            "id": product.pk,
+            "category": product.category_id,
+            "price": product.price,
+            "count": instance.quantity,
+            "date": product.date.strftime("%Y.%m.%d %H:%M"),
+            "title": product.title,
+            "description": product.description,
+            "freeDelivery": product.freeDelivery,
+            "images": product.get_image(),
+            "tags": [{"id": tag.pk, "name": tag.name} for tag in product.tags.all()],
+            "reviews": product.reviews_count,
+            "rating": product.get_rating(),
+        }
+
+
+class OrderSummarySerializer(serializers.ModelSerializer):
+    """
+    Краткое представление заказа для истории заказов,
+    без покупателя и товаров
+    """
+    fields_to_load = (
+        'id', 'created_at', 'delivery_type', 'payment_type', 'totalCost', 'status', 'city', 'delivery_address'
+    )
+
+    class Meta:
+        model = Order
+        fields = '__all__'
+
+    def to_representation(self, instance):
+        return {
+            "id": instance.pk,
+            "createdAt": instance.created_at.strftime("%Y.%m.%d %H:%M"),
+            "deliveryType": instance.delivery_type,
+            "paymentType": instance.payment_type,
+            "totalCost": instance.totalCost,
+            "status": instance.status,
+            "city": instance.city,
+            "address": instance.delivery_address,
+        }
 
 
 class OrderSerializer(serializers.ModelSerializer):
@@ -99,8 +197,11 @@ class OrderSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
     def to_representation(self, instance):
+        """
+        Товары заказа берутся из сохранённых при оформлении копий
+        (OrderItem), для заказа достаточно prefetch_related('items')
+        """
         profile = instance.full_name
-        products = instance.basket.baskets.all()
 
         data = {
             "id": instance.pk,
@@ -115,19 +216,19 @@ class OrderSerializer(serializers.ModelSerializer):
             "city": instance.city,
             "address": instance.delivery_address,
             "products": [{
-                "id": item.product.pk,
-                "category": item.product.category.pk,
-                "price": item.product.price,
-                "count": item.product.count,
-                "data": item.product.date.strftime("%Y.%m.%d %H:%M"),
-                "title": item.product.title,
-                "description": item.product.description,
-                "freeDelivery": item.product.freeDelivery,
-                "images": item.product.get_image(),
-                "tags": [{"id": tag.pk, "name": tag.name} for tag in item.product.tags.all()],
-                "reviews": Review.objects.filter(product_id=item.product.id).count(),
-                "rating": float(item.product.rating),
-            } for item in products],
+                "id": item.product_id,
+                "category": item.category_id,
+                "price": item.price,
+                "count": item.quantity,
+                "data": item.date.strftime("%Y.%m.%d %H:%M"),
+                "title": item.title,
+                "description": item.description,
+                "freeDelivery": item.freeDelivery,
+                "images": item.images,
+                "tags": item.tags,
+                "reviews": item.reviews,
+                "rating": float(item.rating),
+            } for item in instance.items.all()],
 
         }
         return data
@@ -0,0 +1,141 @@
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from . import cache, thumbnails
+from myauth.models import ProfileUser
+from .models import (
+    Category, SubCategory, Product, ProductImage, Tag, Review, Specification, DeliveryPrice, StockReservation,
+)
+from .stock import get_order_quantities, return_stock
+
+
+@receiver(pre_save, sender=Review)
+def remember_review_product(sender, instance, **kwargs):
+    """
+    Запоминаем, к какому продукту относился отзыв до редактирования,
+    чтобы при переносе отзыва обновить рейтинг обоих продуктов
+    """
+    instance._previous_product_id = None
+    if instance.pk:
+        instance._previous_product_id = (
+            Review.objects.filter(pk=instance.pk).values_list("product_id", flat=True).first()
+        )
+
+
+@receiver(post_save, sender=Review)
+def update_rating_on_review_save(sender, instance, **kwargs):
+    Product.update_rating(instance.product_id)
+    previous_product_id = getattr(instance, "_previous_product_id", None)
+    if previous_product_id and previous_product_id != instance.product_id:
+        Product.update_rating(previous_product_id)
+
+
+@receiver(post_delete, sender=Review)
+def update_rating_on_review_delete(sender, instance, **kwargs):
+    Product.update_rating(instance.product_id)
+
+
+@receiver([post_save, post_delete], sender=Category)
+@receiver([post_save, post_delete], sender=SubCategory)
+def invalidate_category_tree(sender, **kwargs):
+    cache.bump_version(cache.CATEGORIES)
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=SubCategory)
+def generate_image_variants(sender, instance, **kwargs):
+    """Уменьшенные копии новой картинки строятся в фоне (см. shopapp.thumbnails)"""
+    if thumbnails.needs_variants(instance):
+        thumbnails.schedule_variants(instance)
+
+
+@receiver(post_delete, sender=ProductImage)
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=SubCategory)
+def delete_image_variants(sender, instance, **kwargs):
+    thumbnails.delete_variants_later(instance)
+
+
+@receiver(pre_delete, sender=StockReservation)
+def return_reserved_stock(sender, instance, **kwargs):
+    """
+    При удалении действующего резерва (например, вместе с заказом)
+    товары возвращаются на склад
+    """
+    if instance.state == StockReservation.RESERVED:
+        return_stock(get_order_quantities(instance.order_id))
+
+
+@receiver([post_save, post_delete], sender=DeliveryPrice)
+def invalidate_shop_config(sender, **kwargs):
+    cache.bump_version(cache.SHOP_CONFIG)
+
+
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=ProductImage)
+@receiver([post_save, post_delete], sender=Tag)
+@receiver([post_save, post_delete], sender=Review)
+@receiver(m2m_changed, sender=Product.tags.through)
+def invalidate_home_feeds(sender, **kwargs):
+    cache.bump_version(cache.HOME_FEEDS)
+
+
+def invalidate_product_details(product_ids):
+    for product_id in product_ids:
+        cache.bump_version(cache.product_namespace(product_id))
+
+
+def get_linked_product_ids(instance):
+    """id продуктов, связанных с тегом или характеристикой"""
+    if isinstance(instance, Tag):
+        through = Product.tags.through
+    else:
+        through = Product.specification.through
+    return through.objects.filter(
+        **{instance._meta.model_name: instance}
+    ).values_list("product_id", flat=True)
+
+
+@receiver([post_save, post_delete], sender=Product)
+def invalidate_details_on_product_change(sender, instance, **kwargs):
+    invalidate_product_details([instance.pk])
+
+
+@receiver([post_save, post_delete], sender=ProductImage)
+@receiver([post_save, post_delete], sender=Review)
+def invalidate_details_on_related_change(sender, instance, **kwargs):
+    invalidate_product_details([instance.product_id])
+
+
+@receiver(post_save, sender=ProfileUser)
+def invalidate_details_on_author_change(sender, instance, update_fields=None, **kwargs):
+    """
+    Отзывы в подробностях продукта показывают имя и email автора.
+    При удалении профиля удаляются и его отзывы, их обработчики сбрасывают кэш сами
+    """
+    if update_fields is not None and not {"name", "surname", "email"} & set(update_fields):
+        return
+    invalidate_product_details(
+        Review.objects.filter(author=instance).values_list("product_id", flat=True).distinct()
+    )
+
+
+@receiver(post_save, sender=Tag)
+@receiver(pre_delete, sender=Tag)
+@receiver(post_save, sender=Specification)
+@receiver(pre_delete, sender=Specification)
+def invalidate_details_on_linked_change(sender, instance, **kwargs):
+    invalidate_product_details(get_linked_product_ids(instance))
+
+
+@receiver(m2m_changed, sender=Product.tags.through)
+@receiver(m2m_changed, sender=Product.specification.through)
+def invalidate_details_on_m2m_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action.startswith("post_"):
+            invalidate_product_details([instance.pk])
+    elif action == "pre_clear":
+        invalidate_product_details(get_linked_product_ids(instance))
+    elif action in ("post_add", "post_remove"):
+        invalidate_product_details(pk_set)
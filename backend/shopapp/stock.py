@@ -0,0 +1,147 @@
+"""
+Резервирование товаров на складе.
+
+Товары заказа списываются со склада при оформлении заказа одним условным
+запросом UPDATE ... SET count = count - n WHERE count >= n: если хотя бы
+одного товара не хватает, не списывается ничего. Списанные товары
+принадлежат резерву заказа (StockReservation) до оплаты. Резерв,
+не оплаченный до истечения срока, снимается, и товары возвращаются
+на склад - командой release_expired_reservations или сразу, когда
+для нового заказа не хватает товаров, занятых просроченными резервами.
+
+Переходы состояний резерва выполняются условными UPDATE по текущему
+состоянию, поэтому оплата и снятие одного резерва в разных процессах
+не могут вернуть или списать товары дважды.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import cache
+from .db import add_per_row
+from .models import OrderItem, Product, StockReservation
+
+
+class InsufficientStock(Exception):
+    """Исключение, возникающее, когда товаров на складе меньше, чем в заказе"""
+
+
+def get_order_quantities(order_id):
+    """Количество товаров заказа: {id товара: количество}"""
+    quantities = {}
+    items = OrderItem.objects.filter(order_id=order_id, product__isnull=False)
+    for product_id, quantity in items.values_list('product_id', 'quantity'):
+        quantities[product_id] = quantities.get(product_id, 0) + quantity
+    return quantities
+
+
+def _change_count(quantities, sign):
+    """Выражение F('count') +/- количество, своё для каждого товара"""
+    return add_per_row('count', {product_id: sign * quantity for product_id, quantity in quantities.items()})
+
+
+def _invalidate_products(quantities):
+    # остаток товара показывается в карточке товара и в подборках главной страницы
+    for product_id in quantities:
+        cache.bump_version(cache.product_namespace(product_id))
+    cache.bump_version(cache.HOME_FEEDS)
+
+
+def take_stock(quantities):
+    """
+    Списывает товары со склада одним запросом. Если хотя бы одного
+    товара не хватает, не списывает ничего и выбрасывает InsufficientStock
+    """
+    if not quantities:
+        return
+    enough = Q()
+    for product_id, quantity in quantities.items():
+        enough |= Q(pk=product_id, count__gte=quantity)
+    with transaction.atomic():
+        updated = Product.objects.filter(enough).update(count=_change_count(quantities, -1))
+        if updated != len(quantities):
+            # исключение откатывает списание остальных товаров
+            raise InsufficientStock(quantities)
+    _invalidate_products(quantities)
+
+
+def return_stock(quantities):
+    """Возвращает товары на склад"""
+    if not quantities:
+        return
+    Product.objects.filter(pk__in=quantities).update(count=_change_count(quantities, 1))
+    _invalidate_products(quantities)
+
+
+def reserve_stock(order, quantities, ttl=None):
+    """
+    Резервирует товары заказа на ttl секунд (по умолчанию
+    settings.STOCK_RESERVATION_TTL). Если товаров не хватает,
+    сначала снимает просроченные резервы этих товаров,
+    затем выбрасывает InsufficientStock
+    """
+    if ttl is None:
+        ttl = settings.STOCK_RESERVATION_TTL
+    # частичное списание откатывает сама take_stock, отдельная точка сохранения не нужна
+    with transaction.atomic(savepoint=False):
+        try:
+            take_stock(quantities)
+        except InsufficientStock:
+            if not release_expired_reservations(product_ids=list(quantities)):
+                raise
+            take_stock(quantities)
+        return StockReservation.objects.create(
+            order=order, expires_at=timezone.now() + timedelta(seconds=ttl)
+        )
+
+
+def confirm_reservation(order, quantities):
+    """
+    Подтверждает резерв при оплате заказа. Если резерв уже снят,
+    списывает товары заново (InsufficientStock, если их не хватает).
+    Возвращает False, если резерв был подтверждён раньше
+    """
+    reservations = StockReservation.objects.filter(order=order)
+    with transaction.atomic():
+        # просроченный, но ещё не снятый резерв тоже подходит: товары всё ещё списаны
+        if reservations.filter(state=StockReservation.RESERVED).update(state=StockReservation.CONFIRMED):
+            return True
+        if reservations.filter(state=StockReservation.CONFIRMED).exists():
+            return False
+        if not reservations.filter(state=StockReservation.RELEASED).update(state=StockReservation.CONFIRMED):
+            # заказ оформлен без резерва
+            StockReservation.objects.create(
+                order=order, state=StockReservation.CONFIRMED, expires_at=timezone.now()
+            )
+        take_stock(quantities)
+        return True
+
+
+def release_reservation(reservation_id):
+    """Снимает резерв и возвращает товары на склад, если резерв ещё действует"""
+    with transaction.atomic():
+        released = StockReservation.objects.filter(
+            pk=reservation_id, state=StockReservation.RESERVED
+        ).update(state=StockReservation.RELEASED)
+        if not released:
+            return False
+        order_id = StockReservation.objects.filter(pk=reservation_id).values_list('order_id', flat=True).get()
+        return_stock(get_order_quantities(order_id))
+        return True
+
+
+def release_expired_reservations(now=None, product_ids=None, limit=None):
+    """
+    Снимает резервы, срок которых истёк к моменту now (если задано
+    product_ids - только резервы с этими товарами), возвращает их количество
+    """
+    expired = StockReservation.objects.filter(
+        state=StockReservation.RESERVED, expires_at__lte=now or timezone.now()
+    )
+    if product_ids is not None:
+        expired = expired.filter(order__items__product_id__in=product_ids).distinct()
+    reservation_ids = list(expired.order_by('expires_at').values_list('pk', flat=True)[:limit])
+    return sum(release_reservation(reservation_id) for reservation_id in reservation_ids)
@@ -0,0 +1,117 @@
+"""
+Хранилище медиафайлов с адресацией по содержимому.
+
+Файл сохраняется под именем, составленным из SHA-256 его содержимого:
+каталог из upload_to, первые два символа хэша и сам хэш с исходным
+расширением (products/ab/ab12...ef.jpg). Содержимое файла по такому
+адресу никогда не меняется, поэтому его можно отдавать с заголовком
+Cache-Control: immutable, и браузеры и CDN кэшируют его навсегда.
+Одинаковые загрузки хранятся одним файлом.
+
+В режиме разработки (DEBUG) медиафайлы отдаёт serve_media. В рабочем
+окружении их отдаёт веб-сервер или CDN, и заголовок для путей вида
+CONTENT_ADDRESSED_NAME настраивается там (пример для nginx - в README).
+
+Так как один файл может использоваться несколькими объектами, удалять
+файлы следует через delete_unreferenced: файл удаляется, только если
+на него больше не ссылается ни одна запись из FILE_REFERENCES.
+"""
+import hashlib
+import logging
+import os
+import re
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.db.models import TextField
+from django.db.models.functions import Cast
+from django.utils.deconstruct import deconstructible
+from django.views.static import serve
+
+log = logging.getLogger(__name__)
+
+HASH_CHUNK_SIZE = 64 * 1024
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+CONTENT_ADDRESSED_NAME = re.compile(r"(^|/)([0-9a-f]{2})/\2[0-9a-f]{62}(\.\w+)?$")
+
+# поля, в которых хранятся имена медиафайлов (в JSON-полях - внутри значения)
+FILE_REFERENCES = (
+    ("shopapp.ProductImage", "image"),
+    ("shopapp.ProductImage", "image_variants"),
+    ("shopapp.Category", "image"),
+    ("shopapp.Category", "image_variants"),
+    ("shopapp.SubCategory", "image"),
+    ("shopapp.SubCategory", "image_variants"),
+    # снимки товаров в заказах хранят адреса картинок
+    ("shopapp.OrderItem", "images"),
+    ("myauth.ProfileUser", "avatar"),
+    ("myauth.ProfileUser", "avatar_variants"),
+)
+
+
+def get_content_hash(content):
+    digest = hashlib.sha256()
+    content.seek(0)
+    for chunk in content.chunks(HASH_CHUNK_SIZE):
+        digest.update(chunk)
+    content.seek(0)
+    return digest.hexdigest()
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    FileSystemStorage, сохраняющий файлы под именем из хэша содержимого.
+    Если такой файл уже есть, он не перезаписывается
+    """
+
+    def get_content_name(self, name, content):
+        directory, filename = os.path.split(name)
+        digest = get_content_hash(content)
+        extension = os.path.splitext(filename)[1].lower()
+        return os.path.join(directory, digest[:2], digest + extension)
+
+    def _save(self, name, content):
+        name = self.get_content_name(name, content)
+        if self.exists(name):
+            return name
+        return super()._save(name, content)
+
+
+def is_referenced(name):
+    """Ссылается ли на файл name хотя бы одна запись"""
+    for model_name, field_name in FILE_REFERENCES:
+        model = apps.get_model(model_name)
+        field = model._meta.get_field(field_name)
+        if field.get_internal_type() == "JSONField":
+            queryset = model.objects.annotate(
+                _file_references=Cast(field_name, TextField())
+            ).filter(_file_references__contains=name)
+        else:
+            queryset = model.objects.filter(**{field_name: name})
+        if queryset.exists():
+            return True
+    return False
+
+
+def delete_unreferenced(storage, names):
+    """Удаляет файлы names, на которые больше нет ссылок"""
+    for name in names:
+        if is_referenced(name):
+            continue
+        try:
+            storage.delete(name)
+        except OSError:
+            log.warning("Не удалось удалить файл %s", name, exc_info=True)
+
+
+def serve_media(request, path, document_root=None):
+    """
+    Отдаёт медиафайл в режиме разработки (как django.views.static.serve);
+    файлы с адресом по содержимому разрешено кэшировать без ограничения срока
+    """
+    response = serve(request, path, document_root=document_root or settings.MEDIA_ROOT)
+    if CONTENT_ADDRESSED_NAME.search(path):
+        response["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+    return response
@@ -1,3 +1,1002 @@
-from django.test import TestCase
+import base64
+import datetime
+import io
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+from decimal import Decimal
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import connection
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from PIL import Image
+
+from myauth.models import ProfileUser
+from .models import (
+    Category, SubCategory, Product, ProductImage, ProductDailySales, Tag, Review, Specification, Sale,
+    Basket, BasketItem, DeliveryPrice, Order, OrderItem, StockReservation, Payment, PaymentJob, IdempotencyKey,
+)
+from .basket import add_item, remove_item
+from .config import get_delivery_price
+from .orders import PaymentConflict, create_order, pay_order
+from .pagination import encode_cursor
+from .storage import serve_media
+from .payments import claim_payment_job, run_pending_jobs
+from .stock import InsufficientStock, release_expired_reservations, take_stock
+from .popularity import record_sales, recompute_popularity
+from . import cache as versioned_cache, thumbnails
+
+
+def create_products(count, category=None, subcategory=None, **kwargs):
+    """Создаёт count товаров с картинкой и двумя тегами у каждого"""
+    category = category or Category.objects.create(title="Категория")
+    subcategory = subcategory or SubCategory.objects.create(
+        title="Подкатегория", category=category
+    )
+    tags = [Tag.objects.create(name="popular"), Tag.objects.create(name="limited")]
+    products = []
+    for number in range(count):
+        product = Product.objects.create(
+            category=category,
+            subcategory=subcategory,
+            title=f"Товар {number}",
+            price=100 + number,
+            count=10,
+            **kwargs,
+        )
+        product.tags.set(tags)
+        ProductImage.objects.create(product=product, image=f"products/{number}.png")
+        products.append(product)
+    return products
+
+
+def run_in_threads(target, threads):
+    """Запускает target одновременно в нескольких потоках и дожидается их"""
+    errors = []
+    barrier = threading.Barrier(threads)
+
+    def worker(number):
+        try:
+            barrier.wait()
+            target(number)
+        except Exception as error:
+            errors.append(error)
+        finally:
+            connection.close()
+
+    workers = [threading.Thread(target=worker, args=(number,)) for number in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return errors
+
+
+def bump_version_in_subprocess(namespace):
+    """Меняет версию пространства имён (выражение namespace) из отдельного процесса"""
+    subprocess.run(
+        [sys.executable, "manage.py", "shell", "-c",
+         f"from shopapp import cache; cache.bump_version({namespace})"],
+        cwd=settings.BASE_DIR, check=True, capture_output=True,
+    )
+
+
+def create_profile(username="buyer"):
+    user = User.objects.create_user(username=username, password="password")
+    return ProfileUser.objects.create(user=user, name="Иван", surname="Иванов", email=f"{username}@example.com")
+
+
+@override_settings(QUERY_BUDGET_ENABLED=True)
+class CatalogListAPIViewTestCase(TestCase):
+    def test_query_count_does_not_depend_on_page_size(self):
+        create_products(30)
+        for limit in (1, 10, 30):
+            with self.assertNumQueries(4):
+                response = self.client.get("/api/catalog", {"limit": limit})
+            self.assertEqual(len(response.data["items"]), limit)
+
+    def test_item_representation(self):
+        product = create_products(1)[0]
+        response = self.client.get("/api/catalog")
+        item = response.data["items"][0]
+        self.assertEqual(item["id"], product.pk)
+        self.assertEqual(item["category"], product.category_id)
+        self.assertEqual(item["images"], [{"src": "/media/products/0.png", "alt": product.title}])
+        self.assertEqual(sorted(item["tags"]), ["limited", "popular"])
+
+    def test_cursor_pagination_walks_all_products(self):
+        products = create_products(7)
+        seen = []
+        params = {"limit": 3, "sort": "price", "sortType": "dec", "cursor": ""}
+        while True:
+            with self.assertNumQueries(3):
+                response = self.client.get("/api/catalog", params)
+            seen += [item["id"] for item in response.data["items"]]
+            if response.data["nextCursor"] is None:
+                break
+            params["cursor"] = response.data["nextCursor"]
+        self.assertEqual(seen, [product.pk for product in reversed(products)])
+
+    def test_invalid_cursor(self):
+        response = self.client.get("/api/catalog", {"cursor": "not a cursor"})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data, ["Некорректный курсор"])
+        # курсор разбирается, но значения не подходят к полю сортировки
+        for values in (["x"], [None]):
+            response = self.client.get("/api/catalog", {"cursor": encode_cursor(values)})
+            self.assertEqual(response.status_code, 400)
+        # значения, которые база не может принять в запросе
+        for values in ([10 ** 30], [[1]], [{"id": 1}]):
+            response = self.client.get("/api/catalog", {"cursor": encode_cursor(values)})
+            self.assertEqual(response.status_code, 400)
+
+    def test_cursor_mode_with_non_positive_limit(self):
+        create_products(2)
+        response = self.client.get("/api/catalog", {"cursor": "", "limit": 0})
+        self.assertEqual(len(response.data["items"]), 1)
+        self.assertIsNotNone(response.data["nextCursor"])
+
+
+class ProductSearchTestCase(TestCase):
+    def setUp(self):
+        self.phone, self.laptop, self.case = create_products(3)
+        self.phone.title = "Смартфон Galaxy"
+        self.phone.description = "Телефон с большим экраном"
+        self.phone.save()
+        self.laptop.title = "Ноутбук"
+        self.laptop.description = "Подходит для работы, не телефон"
+        self.laptop.save()
+
+    def search(self, text, **params):
+        response = self.client.get("/api/catalog", {"filter[name]": text, **params})
+        return [item["id"] for item in response.data["items"]]
+
+    def test_search_by_title_and_description(self):
+        self.assertEqual(self.search("смарт"), [self.phone.pk])
+        self.assertEqual(self.search("телефон"), [self.phone.pk, self.laptop.pk])
+        self.assertEqual(self.search("телефон", **{"filter[maxPrice]": 100}), [self.phone.pk])
+
+    def test_index_follows_writes(self):
+        tag = Tag.objects.create(name="чехол")
+        self.case.tags.add(tag)
+        self.assertEqual(self.search("чехол"), [self.case.pk])
+        tag.name = "бампер"
+        tag.save()
+        self.assertEqual(self.search("чехол"), [])
+        self.assertEqual(self.search("бампер"), [self.case.pk])
+        self.case.tags.remove(tag)
+        self.assertEqual(self.search("бампер"), [])
+        self.phone.delete()
+        self.assertEqual(self.search("смарт"), [])
+
+    def test_query_syntax_is_escaped(self):
+        self.assertEqual(self.search('"смарт" (*'), [self.phone.pk])
+
+    def test_query_without_words(self):
+        # искать нечего - выводится весь каталог в обычном порядке
+        everything = [self.phone.pk, self.laptop.pk, self.case.pk]
+        for text in ("!!!", "-", "?"):
+            self.assertEqual(self.search(text), everything)
+            self.assertEqual(self.search(text, sort="relevance"), everything)
+
+
+class ProductRatingTestCase(TestCase):
+    def setUp(self):
+        self.product, self.other = create_products(2)
+        self.author = create_profile()
+
+    def assertRating(self, product, rating, count):
+        product.refresh_from_db()
+        self.assertEqual(product.rating, Decimal(rating))
+        self.assertEqual(product.reviews_count, count)
+
+    def test_rating_follows_review_changes(self):
+        first = Review.objects.create(author=self.author, product=self.product, rate=5)
+        second = Review.objects.create(author=self.author, product=self.product, rate=2)
+        self.assertRating(self.product, "3.50", 2)
+        second.rate = 3
+        second.save()
+        self.assertRating(self.product, "4.00", 2)
+        second.product = self.other
+        second.save()
+        self.assertRating(self.product, "5.00", 1)
+        self.assertRating(self.other, "3.00", 1)
+        first.delete()
+        self.assertRating(self.product, "0.00", 0)
+
+    def test_rebuild_ratings_command(self):
+        Review.objects.create(author=self.author, product=self.product, rate=4)
+        Product.objects.update(rating=0, reviews_count=0)
+        call_command("rebuild_ratings", batch_size=1, stdout=open(os.devnull, "w"))
+        self.assertRating(self.product, "4.00", 1)
+        self.assertRating(self.other, "0.00", 0)
+
+
+class CategoryListViewTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(title="Телефоны", image="categories/phones.png")
+        SubCategory.objects.create(title="Смартфоны", category=self.category, image="sub/smart.png")
+
+    def test_tree_is_cached_and_invalidated(self):
+        response = self.client.get("/api/categories")
+        self.assertEqual(response.json()[0]["subcategories"][0]["title"], "Смартфоны")
+        etag = response["ETag"]
+        with self.assertNumQueries(0):
+            response = self.client.get("/api/categories", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        with self.assertNumQueries(0):
+            self.client.get("/api/categories")
+
+        self.category.title = "Смартфоны и телефоны"
+        # версия меняется после фиксации транзакции
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category.save()
+        response = self.client.get("/api/categories", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(response.json()[0]["title"], "Смартфоны и телефоны")
+
+
+    def test_version_changes_after_commit(self):
+        version = versioned_cache.get_version(versioned_cache.CATEGORIES)
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.category.save()
+        # до фиксации другие процессы не должны перестраивать дерево по старым данным
+        self.assertEqual(versioned_cache.get_version(versioned_cache.CATEGORIES), version)
+        for callback in callbacks:
+            callback()
+        self.assertNotEqual(versioned_cache.get_version(versioned_cache.CATEGORIES), version)
+
+
+class HomeFeedTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.products = create_products(3)
+        author = create_profile()
+        for product in self.products[:2]:
+            Review.objects.create(author=author, product=product, rate=4)
+
+    def test_feed_is_served_from_snapshot(self):
+        response = self.client.get("/api/products/popular")
+        self.assertEqual(len(response.json()), 3)
+        with self.assertNumQueries(1):
+            response = self.client.get("/api/products/popular")
+        self.assertEqual(response.json()[0]["tags"][0]["name"], "popular")
+
+    def test_feed_is_rebuilt_after_changes(self):
+        self.assertEqual(len(self.client.get("/api/banners").json()), 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            Review.objects.create(author=create_profile("critic"), product=self.products[2], rate=5)
+        banners = self.client.get("/api/banners").json()
+        self.assertEqual([item["id"] for item in banners][0], self.products[2].pk)
+        self.assertEqual(banners[0]["reviews"], 1)
+
+    def test_feed_is_rebuilt_after_stock_changes(self):
+        self.client.get("/api/products/popular")
+        with self.captureOnCommitCallbacks(execute=True):
+            take_stock({self.products[0].pk: 4})
+        counts = {item["id"]: item["count"] for item in self.client.get("/api/products/popular").json()}
+        self.assertEqual(counts[self.products[0].pk], 6)
+
+
+class PopularityTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.first, self.second, self.third = create_products(3)
+
+    def test_sales_are_accumulated(self):
+        record_sales({self.first.pk: 2, self.second.pk: 1})
+        record_sales({self.first.pk: 3})
+        self.first.refresh_from_db()
+        self.assertEqual(self.first.count_of_orders, 5)
+        self.assertEqual(self.first.popularity, 5)
+        self.assertEqual(ProductDailySales.objects.get(product=self.first).quantity, 5)
+        popular = [item["id"] for item in self.client.get("/api/products/popular").json()]
+        self.assertEqual(popular, [self.first.pk, self.second.pk, self.third.pk])
+
+    def test_old_sales_decay(self):
+        today = datetime.date(2024, 1, 31)
+        record_sales({self.first.pk: 8}, day=today - datetime.timedelta(days=14))
+        record_sales({self.second.pk: 3}, day=today)
+        record_sales({self.third.pk: 100}, day=today - datetime.timedelta(days=60))
+        recompute_popularity(today=today, window_days=30, half_life_days=7)
+        popularity = dict(Product.objects.values_list("pk", "popularity"))
+        self.assertEqual(popularity[self.first.pk], 2)
+        self.assertEqual(popularity[self.second.pk], 3)
+        self.assertEqual(popularity[self.third.pk], 0)
+        self.assertEqual(Product.objects.get(pk=self.third.pk).count_of_orders, 100)
+
+
+class ProductReviewsTestCase(TestCase):
+    def setUp(self):
+        self.product = create_products(1)[0]
+        self.reviews = [
+            Review.objects.create(author=create_profile(f"user{number}"), product=self.product, rate=5)
+            for number in range(7)
+        ]
+
+    def test_reviews_are_paginated_by_cursor(self):
+        seen = []
+        params = {"limit": 3}
+        while True:
+            with self.assertNumQueries(2):
+                response = self.client.get(f"/api/product/{self.product.pk}/reviews", params)
+            seen += [item["email"] for item in response.data["items"]]
+            if response.data["nextCursor"] is None:
+                break
+            params["cursor"] = response.data["nextCursor"]
+        self.assertEqual(seen, [review.author.email for review in reversed(self.reviews)])
+
+    def test_invalid_cursor(self):
+        cursor = encode_cursor(["2020-01-01T00:00:00", "x"])
+        response = self.client.get(f"/api/product/{self.product.pk}/reviews", {"cursor": cursor})
+        self.assertEqual(response.status_code, 400)
+
+    def test_details_embed_first_reviews(self):
+        data = self.client.get(f"/api/product/{self.product.pk}").json()
+        self.assertEqual(len(data["reviews"]), 5)
+        self.assertEqual(data["reviews"][0]["email"], "user6@example.com")
+        response = self.client.get(
+            f"/api/product/{self.product.pk}/reviews", {"cursor": data["reviewsNextCursor"]}
+        )
+        self.assertEqual([item["email"] for item in response.data["items"]],
+                         ["user1@example.com", "user0@example.com"])
+
+
+class ProductDetailsTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.product = create_products(1)[0]
+        self.product.specification.add(Specification.objects.create(name="Цвет", value="Синий"))
+        Specification.objects.create(pk=self.product.pk + 100, name="Чужая", value="-")
+        Review.objects.create(author=create_profile(), product=self.product, rate=4)
+
+    def test_details_are_loaded_and_cached(self):
+        with self.assertNumQueries(5):
+            data = self.client.get(f"/api/product/{self.product.pk}").json()
+        self.assertEqual(data["specifications"], [{"name": "Цвет", "value": "Синий"}])
+        self.assertEqual(data["rating"], 4.0)
+        with self.assertNumQueries(0):
+            self.client.get(f"/api/product/{self.product.pk}")
+
+    def test_cache_is_invalidated_on_writes(self):
+        self.client.get(f"/api/product/{self.product.pk}")
+        with self.captureOnCommitCallbacks(execute=True):
+            Specification.objects.filter(name="Цвет").first().delete()
+        self.assertEqual(self.client.get(f"/api/product/{self.product.pk}").json()["specifications"], [])
+        with self.captureOnCommitCallbacks(execute=True):
+            Tag.objects.get(name="popular").delete()
+        tags = self.client.get(f"/api/product/{self.product.pk}").json()["tags"]
+        self.assertEqual([tag["name"] for tag in tags], ["limited"])
+        with self.captureOnCommitCallbacks(execute=True):
+            Review.objects.create(author=create_profile("critic"), product=self.product, rate=2)
+        self.assertEqual(self.client.get(f"/api/product/{self.product.pk}").json()["rating"], 3.0)
+
+    def test_cache_is_invalidated_on_author_change(self):
+        self.client.get(f"/api/product/{self.product.pk}")
+        author = Review.objects.get(product=self.product).author
+        author.name = "Пётр"
+        author.email = "petr@example.com"
+        with self.captureOnCommitCallbacks(execute=True):
+            author.save()
+        review = self.client.get(f"/api/product/{self.product.pk}").json()["reviews"][0]
+        self.assertEqual(review["author"], "Пётр Иванов")
+        self.assertEqual(review["email"], "petr@example.com")
+
+    def test_cache_is_invalidated_by_another_process(self):
+        self.client.get(f"/api/product/{self.product.pk}")
+        # остаток изменён так, как это делает обработчик оплаты в другом процессе
+        Product.objects.filter(pk=self.product.pk).update(count=1)
+        self.assertEqual(self.client.get(f"/api/product/{self.product.pk}").json()["count"], 10)
+        bump_version_in_subprocess(f"cache.product_namespace({self.product.pk})")
+        self.assertEqual(self.client.get(f"/api/product/{self.product.pk}").json()["count"], 1)
+
+    def test_missing_product(self):
+        self.assertEqual(self.client.get("/api/product/100500").status_code, 404)
+
+
+class SalesListAPIViewTestCase(TestCase):
+    def test_only_active_sales_are_listed(self):
+        today = datetime.date.today()
+        day = datetime.timedelta(days=1)
+        products = create_products(4)
+        Sale.objects.create(product=products[0], date_from=today - day, date_to=today + 3 * day, discount=10)
+        Sale.objects.create(product=products[1], date_from=today - 2 * day, date_to=today - day, discount=10)
+        Sale.objects.create(product=products[2], date_from=today + day, date_to=today + 2 * day, discount=10)
+        Sale.objects.create(product=products[3], date_from=today, date_to=today, discount=5)
+        with self.assertNumQueries(3):
+            response = self.client.get("/api/sales")
+        self.assertEqual([item["id"] for item in response.data["items"]], [products[3].pk, products[0].pk])
+        self.assertEqual(response.data["items"][1]["salePrice"], products[0].price - 10)
+        self.assertEqual(response.data["lastPage"], 1)
+
+
+class GuestBasketTestCase(TestCase):
+    def setUp(self):
+        self.first, self.second = create_products(2)
+
+    def test_guest_basket_is_kept_in_cookie(self):
+        self.client.post("/api/basket", {"id": self.first.pk, "count": 1}, content_type="application/json")
+        response = self.client.post(
+            "/api/basket", {"id": self.first.pk, "count": 2}, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([(item["id"], item["count"]) for item in response.data], [(self.first.pk, 3)])
+        response = self.client.delete("/api/basket", {"id": self.first.pk, "count": 1}, content_type="application/json")
+        self.assertEqual(response.data[0]["count"], 2)
+        self.assertFalse(Basket.objects.exists())
+        self.assertFalse(BasketItem.objects.exists())
+
+    def test_guest_basket_is_merged_on_sign_in(self):
+        profile = create_profile()
+        basket = Basket.objects.create(user=profile.user)
+        BasketItem.objects.create(basket=basket, product=self.first, quantity=1)
+        for product in (self.first, self.second):
+            self.client.post("/api/basket", {"id": product.pk, "count": 2}, content_type="application/json")
+
+        response = self.client.post(
+            "/api/sign-in", {"username": "buyer", "password": "password"}, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.cookies["basket"].value, "")
+        self.assertEqual(
+            dict(basket.baskets.values_list("product_id", "quantity")),
+            {self.first.pk: 3, self.second.pk: 2},
+        )
+        self.assertEqual(len(self.client.get("/api/basket").data), 2)
+
+
+class BasketAPIViewTestCase(TestCase):
+    def setUp(self):
+        self.products = create_products(30)
+        self.profile = create_profile()
+        self.client.force_login(self.profile.user)
+
+    def batch(self, operations, **params):
+        query = "?response=delta" if params.get("delta") else ""
+        return self.client.post(
+            f"/api/basket/batch{query}", {"operations": operations}, content_type="application/json"
+        )
+
+    def test_batch_and_basket_query_count(self):
+        response = self.batch([{"action": "add", "id": product.pk, "count": 2} for product in self.products])
+        self.assertEqual(response.status_code, 200)
+        # сессия и пользователь, товары корзины с продуктами, картинки, теги
+        with self.assertNumQueries(5):
+            response = self.client.get("/api/basket")
+        self.assertEqual(len(response.data), 30)
+        self.assertEqual(response.data[0]["count"], 2)
+
+    def test_batch_is_atomic(self):
+        first, second = self.products[:2]
+        response = self.batch([
+            {"action": "add", "id": first.pk, "count": 1},
+            {"action": "remove", "id": second.pk, "count": 1},
+        ])
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(BasketItem.objects.exists())
+
+    def test_delta_response(self):
+        first, second = self.products[:2]
+        self.batch([{"action": "add", "id": product.pk, "count": 1} for product in self.products[:5]])
+        response = self.batch([
+            {"action": "add", "id": first.pk, "count": 2},
+            {"action": "remove", "id": second.pk, "count": 1},
+        ], delta=True)
+        self.assertEqual(
+            [(item["id"], item["count"]) for item in response.data],
+            [(first.pk, 3), (second.pk, 0)],
+        )
+
+
+class CreateOrderAPIViewTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.profile = create_profile()
+        self.client.force_login(self.profile.user)
+        self.basket = Basket.objects.create(user=self.profile.user)
+        DeliveryPrice.objects.create(
+            id=1, delivery_cost=Decimal("200"), delivery_express_cost=Decimal("500"),
+            delivery_free_minimum_cost=Decimal("2000"),
+        )
+        # настройки магазина загружаются один раз и дальше берутся из памяти
+        get_delivery_price()
+
+    def test_query_count_does_not_depend_on_basket_size(self):
+        for size in (1, 30):
+            BasketItem.objects.all().delete()
+            products = create_products(size)
+            BasketItem.objects.bulk_create([
+                BasketItem(basket=self.basket, product=product, quantity=2) for product in products
+            ])
+            # сессия и пользователь, профиль, корзина и в транзакции
+            # (начало и конец): заказ, товары корзины с картинками
+            # и тегами, копии товаров, связи, списание товаров (в своей
+            # точке сохранения), резерв, сумма заказа и её сохранение
+            with self.assertNumQueries(18):
+                response = self.client.post("/api/orders")
+            order = Order.objects.get(pk=response.json()["orderId"])
+            self.assertEqual(order.products.count(), size)
+
+    def test_total_cost(self):
+        cheap, expensive = create_products(2)
+        Product.objects.update(count=100)
+        add_item(self.basket, cheap.pk, 2)
+        response = self.client.post("/api/orders")
+        order = Order.objects.get(pk=response.json()["orderId"])
+        self.assertEqual(order.totalCost, 2 * cheap.price + 200)
+
+        add_item(self.basket, expensive.pk, 20)
+        response = self.client.post("/api/orders")
+        order = Order.objects.get(pk=response.json()["orderId"])
+        self.assertEqual(order.totalCost, 2 * cheap.price + 20 * expensive.price)
+
+    def test_delivery_price_change(self):
+        product, = create_products(1)
+        add_item(self.basket, product.pk, 1)
+        delivery_price = DeliveryPrice.objects.get(pk=1)
+        delivery_price.delivery_cost = Decimal("300")
+        with self.captureOnCommitCallbacks(execute=True):
+            delivery_price.save()
+        response = self.client.post("/api/orders")
+        order = Order.objects.get(pk=response.json()["orderId"])
+        self.assertEqual(order.totalCost, product.price + 300)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            delivery_price.delete()
+        response = self.client.post("/api/orders")
+        order = Order.objects.get(pk=response.json()["orderId"])
+        self.assertEqual(order.totalCost, product.price)
+
+    def test_order_keeps_products_after_catalog_and_basket_change(self):
+        products = create_products(3)
+        for product in products:
+            add_item(self.basket, product.pk, 2)
+        order_id = self.client.post("/api/orders").json()["orderId"]
+
+        Product.objects.filter(pk=products[0].pk).update(price=1, title="Новое название")
+        products[1].delete()
+        BasketItem.objects.all().delete()
+
+        # сессия и пользователь, заказ с покупателем, товары заказа
+        with self.assertNumQueries(4):
+            response = self.client.get(f"/api/order/{order_id}")
+        items = response.json()["products"]
+        self.assertEqual(
+            [(item["title"], Decimal(item["price"]), item["count"]) for item in items],
+            [(product.title, product.price, 2) for product in products],
+        )
+        self.assertIsNone(items[1]["id"])
+        self.assertEqual(items[0]["tags"], [{"id": tag.pk, "name": tag.name} for tag in products[0].tags.all()])
+        self.assertEqual(OrderItem.objects.filter(order_id=order_id).count(), 3)
+
+
+class ShopConfigTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        DeliveryPrice.objects.create(pk=1, delivery_cost=200)
+
+    def test_change_from_another_process(self):
+        self.assertEqual(get_delivery_price().delivery_cost, 200)
+        # цену изменил администратор, запрос которого обработал другой процесс
+        DeliveryPrice.objects.filter(pk=1).update(delivery_cost=300)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_delivery_price().delivery_cost, 200)
+        bump_version_in_subprocess("cache.SHOP_CONFIG")
+        self.assertEqual(get_delivery_price().delivery_cost, 300)
+
+    def test_process_memory_and_shared_cache(self):
+        get_delivery_price()
+        DeliveryPrice.objects.filter(pk=1).update(delivery_cost=300)
+        # новый процесс: памяти процесса нет, значение берётся из общего кэша
+        versioned_cache._local_cache.clear()
+        with self.assertNumQueries(0):
+            self.assertEqual(get_delivery_price().delivery_cost, 200)
+        # версии вытеснены из общего кэша: значение перечитывается из базы
+        cache.clear()
+        self.assertEqual(get_delivery_price().delivery_cost, 300)
+
+
+class OrderHistoryTestCase(TestCase):
+    def setUp(self):
+        self.profile = create_profile()
+        basket = Basket.objects.create(user=self.profile.user)
+        self.orders = [Order.objects.create(full_name=self.profile, basket=basket) for _ in range(25)]
+        other = create_profile("other")
+        Order.objects.create(full_name=other, basket=Basket.objects.create(user=other.user))
+        self.client.force_login(self.profile.user)
+
+    def test_pages(self):
+        # сессия и пользователь, заказы
+        with self.assertNumQueries(3):
+            response = self.client.get("/api/orders", {"limit": 10})
+        ids = [order["id"] for order in response.json()]
+        while "Link" in response:
+            url = response["Link"].split(">")[0].lstrip("<")
+            response = self.client.get(url)
+            ids += [order["id"] for order in response.json()]
+        self.assertEqual(ids, [order.pk for order in reversed(self.orders)])
+
+    def test_invalid_cursor(self):
+        cursor = encode_cursor(["2020-01-01T00:00:00", "x"])
+        self.assertEqual(self.client.get("/api/orders", {"cursor": cursor}).status_code, 400)
+
+    def test_summary(self):
+        order = self.client.get("/api/orders").json()[0]
+        self.assertEqual(
+            set(order),
+            {"id", "createdAt", "deliveryType", "paymentType", "totalCost", "status", "city", "address"},
+        )
+
+    def test_anonymous(self):
+        self.client.logout()
+        self.assertEqual(self.client.get("/api/orders").status_code, 403)
+
+
+class StockReservationTestCase(TestCase):
+    def setUp(self):
+        self.profile = create_profile()
+        self.basket = Basket.objects.create(user=self.profile.user)
+        self.first, self.second = create_products(2)
+
+    def order(self, **quantities):
+        BasketItem.objects.filter(basket=self.basket).delete()
+        add_item(self.basket, self.first.pk, quantities.get("first", 0) or 1)
+        if quantities.get("second"):
+            add_item(self.basket, self.second.pk, quantities["second"])
+        return create_order(self.profile, self.basket)
+
+    def pay(self, order):
+        Order.objects.filter(pk=order.pk).update(status=Order.PROCESSING)
+        return pay_order(order, "12345678", "12.30")
+
+    def counts(self):
+        return list(Product.objects.filter(pk__in=[self.first.pk, self.second.pk]).values_list("count", flat=True))
+
+    def test_reservation_is_all_or_nothing(self):
+        self.order(first=4, second=6)
+        self.assertEqual(self.counts(), [6, 4])
+        with self.assertRaises(InsufficientStock):
+            self.order(first=1, second=5)
+        self.assertEqual(self.counts(), [6, 4])
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_payment_confirms_reservation(self):
+        order = self.order(first=3)
+        self.assertIsNotNone(self.pay(order))
+        self.assertIsNone(pay_order(order, "12345678", "12.30"))
+        self.assertEqual(self.counts(), [7, 10])
+        self.assertEqual(Order.objects.get(pk=order.pk).status, "paid")
+
+        # резерв уже подтверждён: оплата откатывается целиком
+        with self.assertRaises(PaymentConflict):
+            self.pay(order)
+        self.assertEqual(Order.objects.get(pk=order.pk).status, Order.PROCESSING)
+        self.assertEqual(Payment.objects.filter(order=order).count(), 1)
+        self.assertEqual(self.counts(), [7, 10])
+        self.assertEqual(release_expired_reservations(now=timezone.now() + datetime.timedelta(days=1)), 0)
+
+    def test_expired_reservation_is_released(self):
+        order = self.order(first=10)
+        later = timezone.now() + datetime.timedelta(seconds=settings.STOCK_RESERVATION_TTL + 1)
+        self.assertEqual(release_expired_reservations(now=later), 1)
+        self.assertEqual(self.counts(), [10, 10])
+        self.assertEqual(StockReservation.objects.get(order=order).state, StockReservation.RELEASED)
+
+        # оплата после снятия резерва списывает товары заново
+        self.pay(order)
+        self.assertEqual(self.counts(), [0, 10])
+        with self.assertRaises(InsufficientStock):
+            self.order(first=1)
+
+    def test_expired_reservations_are_released_when_stock_runs_out(self):
+        stale = self.order(first=10)
+        StockReservation.objects.filter(order=stale).update(expires_at=timezone.now())
+        self.order(first=5)
+        self.assertEqual(self.counts(), [5, 10])
+        with self.assertRaises(InsufficientStock):
+            self.pay(stale)
+        self.assertEqual(Order.objects.get(pk=stale.pk).status, Order.PROCESSING)
+
+    def test_deleting_order_returns_stock(self):
+        order = self.order(first=4)
+        order.delete()
+        self.assertEqual(self.counts(), [10, 10])
+
+
+class PaymentAPIViewTestCase(TestCase):
+    card = {"number": "12345678", "month": "12", "year": "99", "code": "123", "name": "Иванов"}
+
+    def setUp(self):
+        self.profile = create_profile()
+        self.client.force_login(self.profile.user)
+        self.basket = Basket.objects.create(user=self.profile.user)
+        self.product, = create_products(1)
+        add_item(self.basket, self.product.pk, 2)
+        self.order = create_order(self.profile, self.basket)
+
+    def accept(self):
+        return self.client.post(f"/api/order/{self.order.pk}", {
+            "deliveryType": "delivery", "paymentType": "online", "city": "Москва", "address": "ул. Ленина, 1",
+        })
+
+    def status(self):
+        return self.client.get(f"/api/payment/{self.order.pk}").json()["status"]
+
+    def test_payment_is_processed_by_worker(self):
+        self.assertEqual(self.client.post(f"/api/payment/{self.order.pk}", self.card).status_code, 409)
+        self.assertEqual(self.accept().status_code, 200)
+        response = self.client.post(f"/api/payment/{self.order.pk}", self.card)
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(self.status(), Order.PROCESSING)
+        # повторная оплата и изменение заказа во время оплаты невозможны
+        self.assertEqual(self.client.post(f"/api/payment/{self.order.pk}", self.card).status_code, 409)
+        self.assertEqual(self.accept().status_code, 409)
+
+        self.assertEqual(run_pending_jobs("test"), 1)
+        self.assertEqual(self.status(), Order.PAID)
+        self.assertEqual(PaymentJob.objects.get().state, PaymentJob.DONE)
+        self.assertFalse(BasketItem.objects.exists())
+        self.assertEqual(Product.objects.get(pk=self.product.pk).count_of_orders, 2)
+
+    def test_declined_payment_can_be_retried(self):
+        self.accept()
+        self.client.post(f"/api/payment/{self.order.pk}", dict(self.card, number="123456789"))
+        run_pending_jobs("test")
+        response = self.client.get(f"/api/payment/{self.order.pk}").json()
+        self.assertEqual(response, {"status": Order.FAILED, "error": "Неверный номер банковской карты"})
+
+        self.assertEqual(self.client.post(f"/api/payment/{self.order.pk}", self.card).status_code, 202)
+        run_pending_jobs("test")
+        self.assertEqual(self.status(), Order.PAID)
+
+    def test_job_is_claimed_once(self):
+        self.accept()
+        self.client.post(f"/api/payment/{self.order.pk}", self.card)
+        self.assertIsNotNone(claim_payment_job("first"))
+        self.assertIsNone(claim_payment_job("second"))
+        # задание зависшего обработчика выдаётся снова
+        later = timezone.now() + datetime.timedelta(seconds=settings.PAYMENT_JOB_TIMEOUT + 1)
+        job = claim_payment_job("second", now=later)
+        self.assertEqual((job.locked_by, job.attempts), ("second", 2))
+
+
+class IdempotencyTestCase(TestCase):
+    def setUp(self):
+        self.profile = create_profile()
+        self.client.force_login(self.profile.user)
+        self.basket = Basket.objects.create(user=self.profile.user)
+        self.product, = create_products(1)
+        add_item(self.basket, self.product.pk, 1)
+
+    def test_retried_order_is_created_once(self):
+        first = self.client.post("/api/orders", HTTP_IDEMPOTENCY_KEY="order-1")
+        # повтор отдаётся из сохранённого ответа: сессия, пользователь и ключ,
+        # без запросов к заказам и товарам
+        with self.assertNumQueries(3):
+            retry = self.client.post("/api/orders", HTTP_IDEMPOTENCY_KEY="order-1")
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertEqual(Order.objects.count(), 1)
+
+        self.client.post("/api/orders", HTTP_IDEMPOTENCY_KEY="order-2")
+        self.assertEqual(Order.objects.count(), 2)
+
+    def test_key_reused_with_other_body(self):
+        data = {"id": self.product.pk, "count": 1}
+        self.client.post("/api/basket", data, content_type="application/json", HTTP_IDEMPOTENCY_KEY="add")
+        self.client.post("/api/basket", data, content_type="application/json", HTTP_IDEMPOTENCY_KEY="add")
+        self.assertEqual(BasketItem.objects.get().quantity, 2)
+
+        response = self.client.post(
+            "/api/basket", dict(data, count=5), content_type="application/json", HTTP_IDEMPOTENCY_KEY="add"
+        )
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(BasketItem.objects.get().quantity, 2)
+
+    def test_replay_keeps_guest_basket_cookie(self):
+        self.client.logout()
+        data = {"id": self.product.pk, "count": 3}
+        first = self.client.post("/api/basket", data, content_type="application/json", HTTP_IDEMPOTENCY_KEY="guest")
+        retry = self.client.post("/api/basket", data, content_type="application/json", HTTP_IDEMPOTENCY_KEY="guest")
+        self.assertEqual(retry.cookies["basket"].value, first.cookies["basket"].value)
+        self.assertEqual(retry.json()[0]["count"], 3)
+
+    def test_key_survives_cache_loss(self):
+        first = self.client.post("/api/orders", HTTP_IDEMPOTENCY_KEY="order")
+        # ключ не зависит от кэша, который может быть вытеснен или принадлежать другому процессу
+        cache.clear()
+        retry = self.client.post("/api/orders", HTTP_IDEMPOTENCY_KEY="order")
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_in_flight_and_expired_keys(self):
+        day = datetime.timedelta(days=1)
+        self.client.post("/api/orders", HTTP_IDEMPOTENCY_KEY="order")
+        key = IdempotencyKey.objects.get()
+        IdempotencyKey.objects.update(state=IdempotencyKey.IN_FLIGHT, expires_at=timezone.now() + day)
+        self.assertEqual(self.client.post("/api/orders", HTTP_IDEMPOTENCY_KEY="order").status_code, 409)
+
+        # ключ истёк: запрос выполняется заново, просроченные ключи удаляются командой
+        IdempotencyKey.objects.update(expires_at=timezone.now() - day)
+        self.assertNotIn("Idempotent-Replayed", self.client.post("/api/orders", HTTP_IDEMPOTENCY_KEY="order"))
+        self.assertEqual(Order.objects.count(), 2)
+        IdempotencyKey.objects.filter(pk=key.pk).update(expires_at=timezone.now() - day)
+        call_command("delete_expired_idempotency_keys", stdout=io.StringIO())
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+    def test_keys_are_per_user(self):
+        self.client.post("/api/orders", HTTP_IDEMPOTENCY_KEY="order")
+        other = create_profile("other")
+        Basket.objects.create(user=other.user)
+        self.client.force_login(other.user)
+        self.client.post("/api/orders", HTTP_IDEMPOTENCY_KEY="order")
+        self.assertEqual(Order.objects.filter(full_name=other).count(), 1)
+
+    def test_keys_are_per_basic_auth_user(self):
+        # пользователь Basic известен только после аутентификации DRF
+        self.client.logout()
+        other = create_profile("other")
+        Basket.objects.create(user=other.user)
+        for profile in (self.profile, other):
+            credentials = base64.b64encode(f"{profile.user.username}:password".encode()).decode()
+            self.client.post(
+                "/api/orders", HTTP_IDEMPOTENCY_KEY="order", HTTP_AUTHORIZATION=f"Basic {credentials}"
+            )
+        self.assertEqual(Order.objects.filter(full_name=self.profile).count(), 1)
+        self.assertEqual(Order.objects.filter(full_name=other).count(), 1)
+
+
+class CheckoutConcurrencyTestCase(TransactionTestCase):
+    threads = 8
+    checkouts = 4
+
+    def test_no_oversell(self):
+        product, = create_products(1)
+        profiles = [create_profile(f"buyer{number}") for number in range(self.threads)]
+        baskets = [Basket.objects.create(user=profile.user) for profile in profiles]
+        paid = []
+
+        def checkout(number):
+            for _ in range(self.checkouts):
+                BasketItem.objects.filter(basket=baskets[number]).delete()
+                add_item(baskets[number], product.pk, 1)
+                try:
+                    order = create_order(profiles[number], baskets[number])
+                except InsufficientStock:
+                    continue
+                Order.objects.filter(pk=order.pk).update(status=Order.PROCESSING)
+                paid.append(pay_order(order, "12345678", "12.30"))
+
+        self.assertEqual(run_in_threads(checkout, self.threads), [])
+        self.assertEqual(len(paid), 10)
+        self.assertEqual(Product.objects.get(pk=product.pk).count, 0)
+
+
+class BasketConcurrencyTestCase(TransactionTestCase):
+    threads = 8
+    repeats = 25
+
+    def setUp(self):
+        self.product, self.other = create_products(2)
+        self.basket = Basket.objects.create(user=create_profile().user)
+
+    def test_concurrent_additions_are_not_lost(self):
+        def add(number):
+            for _ in range(self.repeats):
+                add_item(self.basket, self.product.pk, 1)
+
+        self.assertEqual(run_in_threads(add, self.threads), [])
+        item = BasketItem.objects.get(basket=self.basket, product=self.product)
+        self.assertEqual(item.quantity, self.threads * self.repeats)
+
+    def test_concurrent_additions_and_removals(self):
+        add_item(self.basket, self.other.pk, 1000)
+
+        def change(number):
+            for _ in range(self.repeats):
+                if number % 2:
+                    add_item(self.basket, self.other.pk, 3)
+                else:
+                    remove_item(self.basket, self.other.pk, 1)
+
+        self.assertEqual(run_in_threads(change, self.threads), [])
+        removed = adds = self.threads // 2 * self.repeats
+        item = BasketItem.objects.get(basket=self.basket, product=self.other)
+        self.assertEqual(item.quantity, 1000 + adds * 3 - removed)
+
+
+def make_image(size=(1600, 1000)):
+    content = io.BytesIO()
+    Image.new("RGB", size, "blue").save(content, "JPEG")
+    return ContentFile(content.getvalue(), name="photo.jpg")
+
+
+class ThumbnailsTestCase(TransactionTestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        self.product, = create_products(1)
+        self.product.images.all().delete()
+
+    def get_widths(self, image):
+        widths = {}
+        for width, name in image.get_variants().items():
+            with default_storage.open(name) as file, Image.open(file) as variant:
+                widths[width] = variant.size
+        return widths
+
+    def test_variants_are_generated_after_save(self):
+        image = ProductImage.objects.create(product=self.product, image=make_image())
+        thumbnails.wait()
+        image.refresh_from_db()
+        self.assertEqual(self.get_widths(image), {320: (320, 200), 640: (640, 400), 1024: (1024, 640)})
+
+        item, = self.client.get("/api/catalog").json()["items"]
+        srcset = item["images"][0]["srcset"].split(", ")
+        self.assertEqual(len(srcset), 4)
+        self.assertEqual(srcset[0], f"{default_storage.url(image.get_variants()[320])} 320w")
+        self.assertEqual(srcset[-1], f"{image.image.url} 1600w")
+
+        old_files = thumbnails.get_variant_files(image.image_variants)
+        image.image = make_image((800, 800))
+        image.save()
+        thumbnails.wait()
+        image.refresh_from_db()
+        # копии не шире исходной картинки
+        self.assertEqual(self.get_widths(image), {320: (320, 320), 640: (640, 640)})
+        self.assertFalse(any(default_storage.exists(name) for name in old_files))
+
+    def test_backfill_command(self):
+        image = ProductImage(product=self.product)
+        image.image.save("photo.jpg", make_image(), save=False)
+        # bulk_create не отправляет сигналы, как у картинок, загруженных до появления копий
+        ProductImage.objects.bulk_create([image])
+        self.assertEqual(ProductImage.objects.get().get_variants(), {})
+        call_command("generate_thumbnails", workers=2, stdout=io.StringIO())
+        self.assertEqual(set(ProductImage.objects.get().get_variants()), {320, 640, 1024})
+
+
+class ContentAddressedStorageTestCase(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+
+    def test_identical_uploads_are_stored_once(self):
+        product, = create_products(1)
+        first = ProductImage.objects.create(product=product, image=make_image())
+        second = ProductImage.objects.create(product=product, image=make_image())
+        other = ProductImage.objects.create(product=product, image=make_image((800, 800)))
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertNotEqual(first.image.name, other.image.name)
+        self.assertRegex(first.image.name, r"^products/[0-9a-f]{2}/[0-9a-f]{64}\.jpg$")
+
+    def test_media_cache_control(self):
+        # медиафайлы отдаёт Django только в режиме разработки
+        name = default_storage.save("products/photo.jpg", make_image())
+        self.assertEqual(self.client.get(default_storage.url(name)).status_code, 404)
+
+        request = RequestFactory().get(default_storage.url(name))
+        response = serve_media(request, name, document_root=self.media_root)
+        self.assertEqual(response["Cache-Control"], "public, max-age=31536000, immutable")
+
+        with open(os.path.join(self.media_root, "legacy.png"), "wb") as file:
+            file.write(b"image")
+        response = serve_media(request, "legacy.png", document_root=self.media_root)
+        self.assertFalse(response.has_header("Cache-Control"))
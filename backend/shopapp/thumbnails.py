@@ -0,0 +1,153 @@
+"""
+Уменьшенные копии картинок товаров, категорий и подкатегорий.
+
+Для каждой картинки строятся копии в формате WebP шириной THUMBNAIL_WIDTHS
+(только меньше исходной ширины), копии сохраняются рядом с исходным
+файлом, а их имена - в поле image_variants (см. ImageVariantsModel).
+Сериализаторы отдают их в srcset, и браузер выбирает подходящую копию
+вместо исходной фотографии.
+
+Копии строятся в фоновых потоках (см. shopapp.images) после фиксации
+транзакции, в которой была сохранена картинка. Результат записывается
+условным UPDATE, только если картинка за это время не изменилась, после
+чего сбрасываются кэши, в которых хранятся адреса картинок. Картинки, сохранённые до появления
+копий, обрабатываются командой generate_thumbnails.
+"""
+import io
+import logging
+import os
+
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models import Q
+from PIL import ExifTags, Image, ImageOps, UnidentifiedImageError
+
+from . import cache, images
+from .models import Category, SubCategory, ProductImage
+from .storage import delete_unreferenced
+
+log = logging.getLogger(__name__)
+
+THUMBNAIL_WIDTHS = (320, 640, 1024)
+THUMBNAIL_OPTIONS = {"format": "WEBP", "quality": 80, "method": 4}
+THUMBNAIL_EXTENSION = "webp"
+
+# модели с картинками и уменьшенными копиями
+IMAGE_MODELS = (ProductImage, Category, SubCategory)
+
+
+def get_variant_name(name, width):
+    root, _ = os.path.splitext(name)
+    return f"{root}_w{width}.{THUMBNAIL_EXTENSION}"
+
+
+def render_variants(file):
+    """
+    Исходная ширина картинки и её уменьшенные копии: {ширина: содержимое файла}.
+    Копии шире исходной картинки не строятся
+    """
+    with Image.open(file) as image:
+        # ширина с учётом поворота из EXIF, который применяется ниже
+        rotated = image.getexif().get(ExifTags.Base.Orientation) in (5, 6, 7, 8)
+        source_width = image.height if rotated else image.width
+        # JPEG декодируется сразу в уменьшенном виде, если это возможно
+        scale = max(THUMBNAIL_WIDTHS) / source_width
+        if scale < 1:
+            image.draft("RGB", (round(image.width * scale), round(image.height * scale)))
+        image = ImageOps.exif_transpose(image)
+        image.load()
+    image = images.to_rgb(image)
+    variants = {}
+    for width in sorted(THUMBNAIL_WIDTHS, reverse=True):
+        if width >= source_width:
+            continue
+        # каждая следующая копия уменьшается из предыдущей, так быстрее
+        image = image.resize((width, max(1, round(image.height * width / image.width))), Image.LANCZOS)
+        output = io.BytesIO()
+        image.save(output, **THUMBNAIL_OPTIONS)
+        variants[width] = output.getvalue()
+    return source_width, variants
+
+
+def get_variant_files(image_variants):
+    return set(image_variants.get("widths", {}).values())
+
+
+def invalidate_image_caches(model, pk):
+    """Сбрасывает кэши, в которых хранятся адреса картинки"""
+    if model is ProductImage:
+        product_id = ProductImage.objects.filter(pk=pk).values_list("product_id", flat=True).first()
+        if product_id is not None:
+            cache.bump_version(cache.product_namespace(product_id))
+        cache.bump_version(cache.HOME_FEEDS)
+    else:
+        cache.bump_version(cache.CATEGORIES)
+
+
+def generate_variants(model, pk, name, old_variants=None):
+    """
+    Строит копии картинки name объекта model с ключом pk и сохраняет их,
+    если картинка объекта не изменилась. Возвращает True, если копии сохранены
+    """
+    storage = model._meta.get_field("image").storage
+    old_files = get_variant_files(old_variants or {})
+    if not name:
+        image_variants = {}
+        saved = set()
+    else:
+        try:
+            with storage.open(name) as file:
+                source_width, variants = render_variants(file)
+        except FileNotFoundError:
+            log.info("Картинка %s не найдена, копии не построены", name)
+            return False
+        except (OSError, UnidentifiedImageError, Image.DecompressionBombError, SyntaxError):
+            log.warning("Не удалось построить копии картинки %s", name, exc_info=True)
+            return False
+        widths = {
+            str(width): storage.save(get_variant_name(name, width), ContentFile(content))
+            for width, content in variants.items()
+        }
+        image_variants = {"source": name, "width": source_width, "widths": widths}
+        saved = set(widths.values())
+    current = Q(image=name) if name else Q(image="") | Q(image__isnull=True)
+    updated = model.objects.filter(current, pk=pk).update(image_variants=image_variants)
+    if not updated:
+        # картинка изменилась или объект удалён - копии уже не нужны
+        delete_unreferenced(storage, saved)
+        return False
+    delete_unreferenced(storage, old_files - saved)
+    invalidate_image_caches(model, pk)
+    return True
+
+
+def _run(model, pk, name, old_variants):
+    try:
+        return generate_variants(model, pk, name, old_variants)
+    except Exception:
+        log.exception("Ошибка при построении копий картинки %s", name)
+        raise
+
+
+def schedule_variants(instance):
+    """Ставит построение копий картинки объекта в очередь после фиксации транзакции"""
+    model, pk, name = type(instance), instance.pk, instance.image.name or ""
+    old_variants = instance.image_variants
+    transaction.on_commit(lambda: images.submit(_run, model, pk, name, old_variants))
+
+
+def needs_variants(instance):
+    """Нужно ли строить (или удалить) копии текущей картинки объекта"""
+    return (instance.image.name or "") != instance.image_variants.get("source", "")
+
+
+def delete_variants_later(instance):
+    """Удаляет копии картинки удалённого объекта после фиксации транзакции"""
+    storage, names = instance.image.storage, get_variant_files(instance.image_variants)
+    if names:
+        transaction.on_commit(lambda: images.delete_files_later(storage, names))
+
+
+def wait():
+    """Дожидается выполнения заданий, уже поставленных в очередь"""
+    images.wait()
@@ -1,12 +1,13 @@
 import datetime
 import json
 
-from django.contrib.auth.models import User
 from django_filters.rest_framework import DjangoFilterBackend
-from django.conf import settings
-from django.http import JsonResponse, HttpResponse
+from django.http import JsonResponse, Http404
 from django.core.paginator import Paginator
+from django.db import transaction
 from django.shortcuts import get_object_or_404
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
 
 from rest_framework.generics import ListAPIView
 from rest_framework.views import APIView
@@ -14,45 +15,77 @@ from rest_framework.generics import RetrieveAPIView
 from rest_framework.response import Response
 from rest_framework.filters import OrderingFilter
 from rest_framework.permissions import AllowAny
+from rest_framework.exceptions import NotAuthenticated, NotFound, ValidationError
 
-from .models import Category, Product, Review, Tag, Sale, Basket, BasketItem, DeliveryPrice, Order, Payment
+from . import cache, feeds
+from .models import (
+    Category, Product, Review, Tag, Sale, Basket, Order, HomeFeed
+)
+from .basket import GuestBasket, add_item, remove_item, get_basket_items
+from .config import get_delivery_price
+from .details import load_product_details
+from .idempotency import IdempotencyMixin
+from .orders import create_order
+from .payments import enqueue_payment
+from .pagination import KeysetPaginator
+from .querybudget import query_budget
+from .search import search_products
+from .stock import InsufficientStock
 from .serializers import (
+    REVIEWS_ORDERING,
+    ORDERS_ORDERING,
+    ReviewSerializer,
+    CatalogItemSerializer,
     DetailsSerializer,
     TagListSerializer,
     ProductSerializer,
     BasketItemSerializer,
     OrderSerializer,
+    OrderSummarySerializer,
 )
 from myauth.models import ProfileUser
 
 
-class CategoryListView(APIView):
+def build_category_tree():
     """
-    Класс, отвечающий за обработку категорий и подкатегорий продуктов
-    которые будут отображаться по нажатию на кнопку "All Departments"
+    Сериализует все категории вместе с подкатегориями
+    двумя запросами к базе данных
     """
-
-    def get(self, request):
-        categories = Category.objects.all()
-        categories_data = []
-        for category in categories:
-            subcategories = category.subcategory_set.all()
-            subcategories_data = []
-            for subcategory in subcategories:
-                data_sub = {
+    categories = Category.objects.prefetch_related('subcategory_set')
+    return [
+        {
+            "id": category.pk,
+            "title": category.title,
+            "image": category.get_image(),
+            "subcategories": [
+                {
                     "id": subcategory.pk,
                     "title": subcategory.title,
                     "image": subcategory.get_image(),
                 }
-                subcategories_data.append(data_sub)
-            data_cat = {
-                "id": category.pk,
-                "title": category.title,
-                "image": category.get_image(),
-                "subcategories": subcategories_data,
-            }
-            categories_data.append(data_cat)
+                for subcategory in category.subcategory_set.all()
+            ],
+        }
+        for category in categories
+    ]
+
+
+def category_tree_etag(request):
+    return f'"categories-{cache.get_version(cache.CATEGORIES)}"'
+
+
+class CategoryListView(APIView):
+    """
+    Класс, отвечающий за обработку категорий и подкатегорий продуктов
+    которые будут отображаться по нажатию на кнопку "All Departments".
+    Дерево категорий кэшируется и перестраивается только после
+    изменения категорий или подкатегорий, клиент получает ETag
+    и при неизменном дереве - ответ 304.
+    """
 
+    @method_decorator(condition(etag_func=category_tree_etag))
+    def get(self, request):
+        version, categories_data = cache.get_or_build(cache.CATEGORIES, build_category_tree)
         return JsonResponse(categories_data, safe=False)
 
 
@@ -77,65 +110,103 @@ class CatalogListAPIView(APIView):
         'title',
         'freeDelivery',
         'rating',
+        'reviews_count',
     ]
 
+    # параметры сортировки фронтенда, не совпадающие с именами полей
+    sort_aliases = {
+        'reviews': 'reviews_count',
+    }
+
+    # поля, по которым доступна курсорная пагинация (параметр cursor)
+    keyset_fields = [
+        'id',
+        'price',
+        'count',
+        'date',
+        'title',
+        'freeDelivery',
+        'rating',
+        'reviews_count',
+    ]
+
+    # COUNT(*) для пагинации, страница товаров, картинки и теги
+    query_budget = 4
+
     def filter_queryset(self, products):
         category_id = self.request.GET.get('category')
         min_price = float(self.request.GET.get('filter[minPrice]', 0))
-        max_price = float(self.request.GET.get('filter[maxPrice]', float('inf')))
+        max_price = self.request.GET.get('filter[maxPrice]')
         free_delivery = self.request.GET.get('filter[freeDelivery]', '').lower() == 'true'
         available = self.request.GET.get('filter[available]', '').lower() == 'true'
         name = self.request.GET.get('filter[name]', '').strip()
         tags = self.request.GET.getlist('tags[]')
-        sort_field = self.request.GET.get('sort', 'id')
+        # при поиске по названию по умолчанию сортируем по релевантности
+        sort_field = self.request.GET.get('sort') or ('relevance' if name else 'id')
+        sort_field = self.sort_aliases.get(sort_field, sort_field)
         sort_type = self.request.GET.get('sortType', 'inc')
 
         if category_id:
             products = products.filter(category__id=category_id)
-        products = products.filter(price__gte=min_price, price__lte=max_price)
+        products = products.filter(price__gte=min_price)
+        if max_price:
+            products = products.filter(price__lte=float(max_price))
         if free_delivery:
             products = products.filter(freeDelivery=True)
         if available:
             products = products.filter(count__gt=0)
+        searched = False
         if name:
-            products = products.filter(title__icontains=name)
+            products, searched = search_products(products, name)
         for tag in tags:
             products = products.filter(tags__name=tag)
-        if sort_type == 'inc':
+        if sort_field == 'relevance':
+            if searched:
+                products = products.order_by('search_rank', 'id')
+            else:
+                products = products.order_by('id')
+        elif sort_type == 'inc':
             products = products.order_by(sort_field)
         else:
             products = products.order_by('-' + sort_field)
 
         return products
 
+    def get_keyset_ordering(self):
+        """
+        Сортировка для курсорной пагинации: активное поле сортировки
+        и id, чтобы порядок товаров был однозначным
+        """
+        sort_field = self.request.GET.get('sort', 'id')
+        sort_field = self.sort_aliases.get(sort_field, sort_field)
+        if sort_field not in self.keyset_fields:
+            sort_field = 'id'
+        prefix = '' if self.request.GET.get('sortType', 'inc') == 'inc' else '-'
+        if sort_field == 'id':
+            return [prefix + 'id']
+        return [prefix + sort_field, prefix + 'id']
+
     def get(self, request):
-        products = Product.objects.all()
+        # категории берутся из category_id, картинки и теги товаров
+        # всей страницы загружаются двумя запросами, независимо от её размера
+        products = Product.objects.prefetch_related('images', 'tags')
         filtered_products = self.filter_queryset(products)
-        page_number = int(request.GET.get('currentPage', 1))
         limit = int(request.GET.get('limit', 20))
-        paginator = Paginator(filtered_products, limit)
-        page = paginator.get_page(page_number)
-        products_list = []
-        for product in page:
-            products_list.append(
-                {
-                    "id": product.pk,
-                    "category": product.category.pk,
-                    "price": product.price,
-                    "count": product.count,
-                    "date": product.date,
-                    "title": product.title,
-                    "description": product.description,
-                    "freeDelivery": product.freeDelivery,
-                    "images": [{
-                        "src": settings.MEDIA_URL + str(image.image),
-                        "alt": product.title
-                    }
-                        for image in product.images.all()],
-                    "tags": list(product.tags.values_list('name', flat=True)),
-                    "rating": float(product.rating),
-                }
-            )
+
+        # курсорный режим: без COUNT(*) и OFFSET, используется,
+        # если в запросе передан параметр cursor (пустой - первая страница)
+        if 'cursor' in request.GET:
+            paginator = KeysetPaginator(filtered_products, self.get_keyset_ordering(), limit)
+            with query_budget(self.query_budget - 1, "CatalogListAPIView"):
+                page, next_cursor = paginator.get_page(request.GET['cursor'])
+                products_list = CatalogItemSerializer(page, many=True).data
+            return Response({"items": products_list, "nextCursor": next_cursor})
+
+        page_number = int(request.GET.get('currentPage', 1))
+        with query_budget(self.query_budget, "CatalogListAPIView"):
+            paginator = Paginator(filtered_products, limit)
+            page = paginator.get_page(page_number)
+            products_list = CatalogItemSerializer(page, many=True).data
         catalog_data = {
             "items": products_list,
             "currentPage": page_number,
@@ -144,60 +215,77 @@ class CatalogListAPIView(APIView):
         return Response(catalog_data)
 
 
-class BannerListAPIView(ListAPIView):
+class HomeFeedListAPIView(ListAPIView):
+    """
+    Базовый класс подборок главной страницы, отдающий
+    заранее построенный снимок подборки (см. shopapp.feeds)
+    """
     serializer_class = ProductSerializer
-
-    def get_queryset(self):
-        """
-        Выведем на главную страницу магазина три продукта с
-        самым большим рейтингом.
-        """
-        return Product.objects.filter(rating__gt=0).order_by('-rating')[:3]
+    feed_name = None
 
     def list(self, request, *args, **kwargs):
-        queryset = self.get_queryset()
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
+        return Response(feeds.get_feed(self.feed_name))
 
 
-class PopularListAPIView(ListAPIView):
-    serializer_class = ProductSerializer
-
-    def get_queryset(self):
-        """
-        Выведем на главную страницу заказы, имеющие тег "popular"
-        """
-        # после реализации заказов подставить - .order_by("-countOfOrders")[:8]
-        return Product.objects.filter(tags__name__in=['popular'])[:8]
-
-    def list(self, request, *args, **kwargs):
-        queryset = self.get_queryset()
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
+class BannerListAPIView(HomeFeedListAPIView):
+    """
+    Выведем на главную страницу магазина три продукта с
+    самым большим рейтингом.
+    """
+    feed_name = HomeFeed.BANNERS
 
 
-class LimitedListAPIView(ListAPIView):
-    serializer_class = ProductSerializer
+class PopularListAPIView(HomeFeedListAPIView):
+    """
+    Выведем на главную страницу самые продаваемые товары
+    """
+    feed_name = HomeFeed.POPULAR
 
-    def get_queryset(self):
-        """
-        Выведем на главную страницу заказы, имеющие тег "limited"
-        """
-        return Product.objects.filter(tags__name__in=['limited'])[:16]
 
-    def list(self, request, *args, **kwargs):
-        queryset = self.get_queryset()
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
+class LimitedListAPIView(HomeFeedListAPIView):
+    """
+    Выведем на главную страницу заказы, имеющие тег "limited"
+    """
+    feed_name = HomeFeed.LIMITED
 
 
 class ProductDetailsAPIView(RetrieveAPIView):
+    """
+    Класс, отвечающий за вывод карточки товара
+    (загрузка и кэширование - shopapp.details)
+    """
     queryset = Product.objects.all()
     serializer_class = DetailsSerializer
     lookup_url_kwarg = "id"
 
+    def retrieve(self, request, *args, **kwargs):
+        try:
+            details = load_product_details(kwargs[self.lookup_url_kwarg])
+        except Product.DoesNotExist:
+            raise Http404
+        return Response(details)
+
+
+class ProductReviewAPIView(APIView):
+    """
+    Класс, отвечающий за постраничный вывод отзывов о товаре
+    (курсорная пагинация, от новых к старым) и добавление отзыва
+    """
+    default_limit = 10
+    max_limit = 50
+
+    def get(self, request, **kwargs):
+        product = get_object_or_404(Product.objects.only('pk'), pk=kwargs['id'])
+        limit = min(int(request.GET.get('limit', self.default_limit)), self.max_limit)
+        paginator = KeysetPaginator(
+            product.reviews.select_related('author'), REVIEWS_ORDERING, limit
+        )
+        reviews, next_cursor = paginator.get_page(request.GET.get('cursor'))
+        return Response({
+            "items": ReviewSerializer(reviews, many=True).data,
+            "nextCursor": next_cursor,
+        })
 
-class ProductReviewAPIView(ProductDetailsAPIView):
     def post(self, request, **kwargs):
         if request.user.is_authenticated:
             profile = ProfileUser.objects.get(user=request.user)
@@ -230,149 +318,201 @@ class TagsListAPIView(ListAPIView):
 
 
 class SalesListAPIView(APIView):
-    def get(self, request):
-        page_number = int(request.GET.get('currentPage', 1))
-        limit = int(request.GET.get('limit', 20))
-        obj_list = []
-        for obj in Sale.objects.all():
-            obj_list.append(obj)
-        paginator = Paginator(obj_list, limit)
-        page = paginator.get_page(page_number)
-        serialized_data = []
+    """
+    Класс, отвечающий за вывод действующих распродаж, начиная
+    с заканчивающихся раньше. Страница выбирается в базе данных,
+    товары и их картинки загружаются вместе с ней.
+    """
+    ordering = ['date_to', 'id']
 
-        for sale in page:
-            serialized_data.append({
+    def serialize_sales(self, sales):
+        return [
+            {
                 "id": sale.product.id,
                 "price": sale.product.price,
                 "salePrice": sale.product.price - sale.discount,
                 "dateFrom": sale.date_from,
                 "dateTo": sale.date_to,
                 "title": sale.product.title,
-                "images": [
-                    {
-                        "src": settings.MEDIA_URL + str(image.image),
-                        "alt": sale.product.title,
-                    }
-                    for image in
-                    sale.product.images.all()],
-            })
+                "images": [image.get_image(alt=sale.product.title) for image in sale.product.images.all()],
+            }
+            for sale in sales
+        ]
+
+    def get(self, request):
+        limit = int(request.GET.get('limit', 20))
+        sales = Sale.objects.active().select_related('product').prefetch_related('product__images')
+
+        # курсорный режим, аналогичный каталогу товаров
+        if 'cursor' in request.GET:
+            paginator = KeysetPaginator(sales, self.ordering, limit)
+            page, next_cursor = paginator.get_page(request.GET['cursor'])
+            return Response({"items": self.serialize_sales(page), "nextCursor": next_cursor})
+
+        page_number = int(request.GET.get('currentPage', 1))
+        paginator = Paginator(sales.order_by(*self.ordering), limit)
+        page = paginator.get_page(page_number)
         response_data = {
-            "items": serialized_data,
+            "items": self.serialize_sales(page),
             "currentPage": page_number,
             "lastPage": paginator.num_pages
         }
         return Response(response_data)
 
 
-class BasketAPIView(APIView):
+class BasketAPIView(IdempotencyMixin, APIView):
+    """
+    Класс, отвечающий за корзину. Корзина вошедшего пользователя
+    хранится в базе данных, анонимного посетителя - в подписанной
+    cookie (см. shopapp.basket) и переносится в базу при входе.
+    С параметром ?response=delta в ответе возвращаются только
+    изменённые товары (удалённые - с count, равным 0).
+    """
 
-    def get(self, request):
+    def parse_operation(self, action, data):
+        try:
+            product_id = int(data['id'])
+            count = int(data['count'])
+        except (KeyError, TypeError, ValueError):
+            raise ValidationError("Ожидаются числовые поля id и count")
+        if count <= 0:
+            raise ValidationError("Количество товара должно быть положительным")
+        return action, product_id, count
+
+    def serialize(self, items, changed_ids=None):
+        data = list(BasketItemSerializer(items, many=True).data)
+        if changed_ids is not None:
+            present = {item["id"] for item in data}
+            data += [{"id": product_id, "count": 0} for product_id in changed_ids if product_id not in present]
+        return data
+
+    def check_products(self, operations):
+        """Проверяет одним запросом, что добавляемые товары существуют"""
+        product_ids = {product_id for action, product_id, count in operations if action == "add"}
+        found = set(Product.objects.filter(pk__in=product_ids).values_list('pk', flat=True))
+        if product_ids - found:
+            raise NotFound("Товар не найден")
+
+    def apply(self, request, operations, status=200):
         """
-        Вывод информации о товарах в корзине
+        Применяет к корзине список операций (действие, id товара, количество):
+        либо все, либо ни одной
         """
+        changed_ids = None
+        if request.GET.get('response') == 'delta':
+            changed_ids = list(dict.fromkeys(product_id for action, product_id, count in operations))
+        self.check_products(operations)
 
+        # корзина анонимного посетителя хранится в cookie
         if request.user.is_anonymous:
-            anon_user = User.objects.get(username="anonymous")
-            request.user = User.objects.get(id=anon_user.id)
-
-        queryset = BasketItem.objects.filter(basket__user=request.user)
-        serializer = BasketItemSerializer(queryset, many=True)
+            guest_basket = GuestBasket(request)
+            for action, product_id, count in operations:
+                if action == "add" and not guest_basket.add(product_id, count):
+                    raise ValidationError("Корзина переполнена")
+                if action == "remove" and not guest_basket.remove(product_id, count):
+                    raise NotFound("Товары в корзине не найдены")
+            response = Response(self.serialize(guest_basket.get_items(changed_ids), changed_ids), status=status)
+            guest_basket.save(response)
+            return response
+
+        with transaction.atomic():
+            basket, created = Basket.objects.get_or_create(user=request.user)
+            for action, product_id, count in operations:
+                if action == "add":
+                    add_item(basket, product_id, count)
+                elif not remove_item(basket, product_id, count):
+                    raise NotFound("Товары в корзине не найдены")
+        items = get_basket_items(request.user, changed_ids)
+        return Response(self.serialize(items, changed_ids), status=status)
 
-        return Response(serializer.data)
+    def get(self, request):
+        """
+        Вывод информации о товарах в корзине
+        """
+        if request.user.is_anonymous:
+            return Response(self.serialize(GuestBasket(request).get_items()))
+        return Response(self.serialize(get_basket_items(request.user)))
 
     def post(self, request):
-        # принимаем данные, об id товара и его количестве из запроса
-        id = request.data['id']
-        count = request.data['count']
-
-        # если вход не осуществлен, то назначаем пользователя по-умолчанию
-        if request.user.is_anonymous:
-            anon_user = User.objects.get(username="anonymous")
-            basket, created = Basket.objects.update_or_create(user=anon_user)
-            basket = Basket.objects.get(user=anon_user)
-        else:
-            try:
-                basket = request.user.basket
-            except Basket.DoesNotExist:
-                basket = Basket.objects.create(user=request.user)
-
-        # получаем объект продукта по его id
-        product = Product.objects.get(id=id)
-        # создаем объект продукта в корзине если его еще нет
-        basket_item, created = BasketItem.objects.get_or_create(basket=basket, product=product)
-        if not created:
-            basket_item.quantity += count
-            basket_item.save()
-
-        # получаем обновленные данные корзины, передаем в сериализатор
-        # где они обрабатываются и возвращаются для отображения на страничке
-        basket_items = BasketItem.objects.filter(basket=basket)
-        serializer = BasketItemSerializer(basket_items, many=True)
-
-        return Response(serializer.data, status=201)
+        """
+        Добавление товара в корзину: {"id": id товара, "count": количество}
+        """
+        return self.apply(request, [self.parse_operation("add", request.data)], status=201)
 
     def delete(self, request):
-        id = request.data['id']
-        count = request.data['count']
+        """
+        Удаление товара из корзины: {"id": id товара, "count": количество}
+        """
+        return self.apply(request, [self.parse_operation("remove", request.data)])
 
-        try:
-            if request.user.is_anonymous:
-                anon_user = User.objects.get(username="anonymous")
-                request.user = User.objects.get(id=anon_user.id)
-            # получаем объект, который хотим удалить
-            basket = request.user.basket
-            # получаем продукт, который хотим удалить из корзины
-            product = Product.objects.get(id=id)
-            # получаем товар в корзине для удаления
-            basket_item = BasketItem.objects.get(basket=basket, product=product)
-            if basket_item.quantity > count:
-                basket_item.quantity -= count   # будем нажимать кнопку "минус" до тех пор пока не будет 0
-                basket_item.save()
-            else:
-                basket_item.delete()
 
-            # получаем обновленные данные корзины, передаем в сериализатор
-            # где они обрабатываются и возвращаются для отображения на страничке
-            basket_items = BasketItem.objects.filter(basket=basket)
-            serializer = BasketItemSerializer(basket_items, many=True)
+class BasketBatchAPIView(BasketAPIView):
+    """
+    Несколько изменений корзины за один запрос и одну транзакцию:
+    {"operations": [{"action": "add" | "remove", "id": 1, "count": 2}, ...]}
+    """
+    max_operations = 100
 
-            return Response(serializer.data)
-        except Basket.DoesNotExist:
-            return Response("Товары в корзине не найдены", status=404)
+    def post(self, request):
+        operations = request.data.get('operations') if isinstance(request.data, dict) else None
+        if not isinstance(operations, list) or not operations:
+            raise ValidationError("Ожидается непустой список operations")
+        if len(operations) > self.max_operations:
+            raise ValidationError(f"Не больше {self.max_operations} операций за запрос")
+        parsed = []
+        for operation in operations:
+            if not isinstance(operation, dict) or operation.get('action') not in ("add", "remove"):
+                raise ValidationError("Действие операции должно быть add или remove")
+            parsed.append(self.parse_operation(operation['action'], operation))
+        return self.apply(request, parsed)
+
+
+class CreateOrderAPIView(IdempotencyMixin, APIView):
+    """
+    Класс, отвечающий за историю заказов пользователя и оформление заказа.
+    История отдаётся списком кратких представлений заказов от новых
+    к старым постранично (курсорная пагинация по индексу
+    (покупатель, дата создания)), ссылка на следующую страницу
+    передаётся в заголовке Link
+    """
+    default_limit = 20
+    max_limit = 100
 
+    def get(self, request):
+        if not request.user.is_authenticated:
+            raise NotAuthenticated()
+        limit = min(int(request.GET.get('limit', self.default_limit)), self.max_limit)
+        paginator = KeysetPaginator(
+            Order.objects.filter(full_name__user=request.user).only(*OrderSummarySerializer.fields_to_load),
+            ORDERS_ORDERING,
+            limit,
+        )
+        orders, next_cursor = paginator.get_page(request.GET.get('cursor'))
+        response = Response(OrderSummarySerializer(orders, many=True).data)
+        if next_cursor:
+            url = request.build_absolute_uri(f"{request.path}?limit={limit}&cursor={next_cursor}")
+            response["Link"] = f'<{url}>; rel="next"'
+        return response
 
-class CreateOrderAPIView(APIView):
     def post(self, request):
-        try:
-            basket = request.user.basket
-            profile = ProfileUser.objects.get(user=request.user)
-            basket_items = BasketItem.objects.filter(basket__user=request.user)
-            total_cost = 0
-            order = Order.objects.create(
-                full_name=profile,
-                basket=basket,
-            )
-            for item in basket_items:
-                product = Product.objects.get(pk=item.product.pk)
-                product.count_of_orders = item.quantity
-                total_cost += item.product.price * item.quantity
-                product.save()
-            delivery_price = DeliveryPrice.objects.get(id=1)
-            if total_cost > delivery_price.delivery_free_minimum_cost:
-                order.totalCost = total_cost
-            else:
-                order.totalCost = total_cost + delivery_price.delivery_cost
-            order.save()
-            response_data = {"orderId": order.pk}
-            return JsonResponse(response_data)
-        except Basket.DoesNotExist:
+        profile = ProfileUser.objects.get(user=request.user)
+        basket = Basket.objects.filter(user=request.user).first()
+        if basket is None:
             error_data = {"error": "У данного пользователя пока нет 'корзины'"}
             return JsonResponse(error_data)
+        try:
+            order = create_order(profile, basket)
+        except InsufficientStock:
+            return JsonResponse({"error": "Недостаточно товаров в наличии"}, status=400)
+        response_data = {"orderId": order.pk}
+        return JsonResponse(response_data)
 
 
 class OrderDetailAPIView(APIView):
     def get(self, request, order_id):
-        order = Order.objects.get(pk=order_id)
+        order = get_object_or_404(
+            Order.objects.select_related('full_name').prefetch_related('items'), pk=order_id
+        )
         serializer = OrderSerializer(order)
         return JsonResponse(serializer.data)
 
@@ -383,29 +523,41 @@ class OrderDetailAPIView(APIView):
         payment_type = request.data["paymentType"]
         city = request.data["city"]
         address = request.data["address"]
-        status_order = "accepted"
 
+        # стоимость экспресс доставки учитывается один раз при повторном подтверждении
+        express_cost = get_delivery_price().delivery_express_cost
+        total_cost = order.totalCost
+        if order.delivery_type == "express":
+            total_cost -= express_cost
         if delivery_type == "express":
-            delivery_price = DeliveryPrice.objects.get(id=1)
-            order.totalCost += delivery_price.delivery_express_cost
-            order.save()
-
-        order.delivery_type = delivery_type
-        order.payment_type = payment_type
-        order.city = city
-        order.address = address
-        order.status = status_order
-        order.save()
+            total_cost += express_cost
+
+        # подтвердить можно только ещё не отправленный на оплату заказ
+        accepted = Order.change_status(
+            order.pk,
+            Order.ACCEPTED,
+            delivery_type=delivery_type,
+            payment_type=payment_type,
+            city=city,
+            delivery_address=address,
+            totalCost=total_cost,
+        )
+        if not accepted:
+            return Response({"error": "Заказ уже оплачивается или оплачен"}, status=409)
 
         response_data = {"orderId": order.id}
         return Response(response_data, status=200)
 
 
-class PaymentAPIView(APIView):
+class PaymentAPIView(IdempotencyMixin, APIView):
+    """
+    Класс, отвечающий за оплату заказа. Оплата выполняется обработчиком
+    очереди (команда run_payment_worker), запрос только ставит задание
+    в очередь, а статус оплаты затем запрашивается методом GET
+    """
     def get(self, request, order_id):
-        payment = get_object_or_404(Payment, order__id=order_id)
-        order = get_object_or_404(Order, id=order_id)
-        return JsonResponse({"status": order.status})
+        order = get_object_or_404(Order.objects.only('status', 'payment_error'), id=order_id)
+        return JsonResponse({"status": order.status, "error": order.payment_error})
 
     def post(self, request, order_id):
         data = request.data
@@ -418,33 +570,11 @@ class PaymentAPIView(APIView):
 
         if int(expiration_year) < current_year or (
                 int(expiration_year == current_year) and int(expiration_month) < datetime.datetime.now().month):
-            order = Order.objects.get(id=order_id)
-            order.payment_error = "Payment expired"
-            order.save()
-            print("payment expired")
+            Order.objects.filter(id=order_id).update(payment_error="Payment expired")
             return JsonResponse({"error": "Payment expired"}, status=500)
 
-        if len(card_number.strip()) > 8 and int(card_number) % 2 != 0:
-            print("card invalid")
-            return JsonResponse({"error": "Неверный номер банковской карты"}, status=400)
-
         res_date = f"{expiration_month}.{expiration_year}"
-        order = Order.objects.get(id=order_id)
-        payment = Payment.objects.create(order=order, card_number=card_number, validity_period=res_date)
-        order.status = 'paid'
-        order.save()
-        # заказ оплачен
-
-        basket = Basket.objects.get(user=request.user)
-        basket_items = BasketItem.objects.filter(basket=basket)
-        for basket_item in basket_items:
-            product = Product.objects.get(pk=basket_item.product.pk)
-            if product.count < basket_item.quantity:
-                print("недостаточно товаров")
-                return JsonResponse({"error": "Недостаточно товаров в наличии"}, status=400)
-            product.count -= basket_item.quantity
-            product.save()
-            payment.success = True
-            payment.save()
-        basket_items.delete()
-        return HttpResponse(status=200)
+        order = get_object_or_404(Order, id=order_id)
+        if enqueue_payment(order, card_number, res_date) is None:
+            return JsonResponse({"error": f"Заказ в статусе {order.status} нельзя оплатить"}, status=409)
+        return JsonResponse({"orderId": order.pk, "status": Order.PROCESSING}, status=202)